@@ -224,6 +224,61 @@ class BaseConfig(object):
          "--simple-log", action="store_const", const="simple",
           dest="log_type", help="Log using SimpleFileLogger"
         )
+        log_option_group.add_option(
+         "--async-log", action="store_true",
+         dest="async_logging", default=False,
+         help="Write the logs from a thread of their own, in batches"
+        )
+        log_option_group.add_option(
+         "--gzip-logs", action="store_true",
+         dest="gzip_logs", default=False,
+         help="Gzip the logs as they're written"
+        )
+        log_option_group.add_option(
+         "--log-max-bytes", action="store", type="int",
+         dest="log_max_bytes",
+         help="Start a new log segment after this many bytes"
+        )
+        log_option_group.add_option(
+         "--log-backup-count", action="store", type="int",
+         dest="log_backup_count",
+         help="Keep this many old log segments (default 9)"
+        )
+        log_option_group.add_option(
+         "--write-once-log", action="store_true",
+         dest="write_once_log", default=False,
+         help="With --multi-log, write each line to the raw log only, and generate the per-level logs from it at the end"
+        )
+        log_option_group.add_option(
+         "--console-summary", action="store_true",
+         dest="console_summary", default=False,
+         help="Only show action banners, progress, warnings and above and the summary on the console; the log files still get everything"
+        )
+        log_option_group.add_option(
+         "--console-progress-interval", action="store", type="int",
+         dest="console_progress_interval", default=60,
+         help="With --console-summary, show progress at most every this many seconds"
+        )
+        log_option_group.add_option(
+         "--log-sections", action="store_true",
+         dest="log_sections", default=False,
+         help="Also write each action's log to a file of its own, under sections/"
+        )
+        log_option_group.add_option(
+         "--log-item-sections", action="store_true",
+         dest="log_item_sections", default=False,
+         help="Write the log of each work item (e.g. locale) to a file of its own under sections/ (and not to its action's section)"
+        )
+        log_option_group.add_option(
+         "--log-stream", action="store",
+         dest="log_stream",
+         help="Also stream the log to the collector at host:port or unix:/path (see scripts/log_collector.py)"
+        )
+        log_option_group.add_option(
+         "--log-stream-job", action="store",
+         dest="log_stream_job",
+         help="Name this job for the log collector (default: host-log_name-pid)"
+        )
         self.config_parser.add_option_group(log_option_group)
 
 
@@ -12,14 +12,23 @@ Each line of output is matched against each substring or regular expression
 in the error list.  On a match, we determine the 'level' of that line,
 whether IGNORE, DEBUG, INFO, WARNING, ERROR, CRITICAL, or FATAL.
 
-TODO: Context lines (requires work on the OutputParser side)
+OutputParser compiles each error list into an ErrorListMatcher once, through
+compile_error_list(); the matchers for the lists below are compiled at import
+time, so every parser shares them.
+
+An error_check can also ask for 'context_lines' around its matches, as
+'PRE:POST' (e.g. '5:5', '20:' or ':3'); OutputParser then logs the PRE
+lines before a match and the POST lines after it at (at least) the
+match's level, up to CRITICAL.
 
 TODO: We could also create classes that generate these, but with the
 appropriate level (please don't die on any errors; please die on any
 warning; etc.) or platform or language or whatever.
 """
 
+import collections
 import re
+import threading
 
 from mozharness.base.log import WARNING, ERROR, CRITICAL, FATAL
 
@@ -27,6 +36,94 @@ from mozharness.base.log import WARNING, ERROR, CRITICAL, FATAL
 class VCSException(Exception):
     pass
 
+# ErrorListMatcher {{{1
+class ErrorListMatcher(object):
+    """An error list, compiled for matching lines against it quickly.
+
+    match(line) returns the first error_check in the list whose 'substr'
+    is in line, or whose 'regex' matches it; the same one OutputParser
+    used to find by walking the list.
+
+    The rules are walked in order, substrings with 'in' and regexes with
+    their bound search().  A single alternation of all the rules, to
+    reject non-matching lines in one search, was slower than the walk
+    for every list below: Python's re tries each alternative at every
+    position, and the lists are short.
+
+    error_checks with neither 'substr' nor 'regex' are skipped, and
+    listed in invalid_rules.
+
+    query_context_lines(error_check) returns the rule's parsed
+    'context_lines' ('PRE:POST') as a (pre, post) tuple, and
+    num_pre_context_lines is the largest pre in the list.
+    """
+    def __init__(self, error_list):
+        self.invalid_rules = []
+        self.num_pre_context_lines = 0
+        self._context_lines = {}
+        rules = []
+        for error_check in error_list:
+            if 'substr' in error_check:
+                rules.append((error_check['substr'], None, error_check))
+            elif 'regex' in error_check:
+                rules.append((None, error_check['regex'].search,
+                              error_check))
+            else:
+                self.invalid_rules.append(error_check)
+                continue
+            if error_check.get('context_lines'):
+                context_lines = self._parse_context_lines(
+                    error_check['context_lines'])
+                self._context_lines[id(error_check)] = context_lines
+                self.num_pre_context_lines = max(self.num_pre_context_lines,
+                                                 context_lines[0])
+        self.rules = tuple(rules)
+
+    def _parse_context_lines(self, context_lines):
+        """'5:5' -> (5, 5); '20:' -> (20, 0); ':3' -> (0, 3)"""
+        (pre, post) = context_lines.split(':')
+        return (int(pre or 0), int(post or 0))
+
+    def query_context_lines(self, error_check):
+        return self._context_lines.get(id(error_check), (0, 0))
+
+    def match(self, line):
+        for (substr, search, error_check) in self.rules:
+            if substr is not None:
+                if substr in line:
+                    return error_check
+            elif search(line):
+                return error_check
+        return None
+
+
+# compile_error_list() is called from run_commands_parallel()'s worker
+# threads and ParserThreads alike.
+_compiled_error_lists = collections.OrderedDict()
+_compiled_error_lists_lock = threading.Lock()
+
+def compile_error_list(error_list, max_cached=64):
+    """Return an ErrorListMatcher for error_list.
+
+    Matchers are cached on the identity of the error_checks in the list,
+    so lists put together from the same rules share one.  Only the last
+    max_cached are kept.
+    """
+    if isinstance(error_list, ErrorListMatcher):
+        return error_list
+    key = tuple([id(error_check) for error_check in error_list])
+    _compiled_error_lists_lock.acquire()
+    try:
+        matcher = _compiled_error_lists.get(key)
+        if matcher is None:
+            matcher = ErrorListMatcher(error_list)
+            _compiled_error_lists[key] = matcher
+            while len(_compiled_error_lists) > max_cached:
+                _compiled_error_lists.popitem(last=False)
+    finally:
+        _compiled_error_lists_lock.release()
+    return matcher
+
 # ErrorLists {{{1
 
 BaseErrorList = [
@@ -132,6 +229,17 @@ ZipalignErrorList = BaseErrorList + [{
 }]
 
 
+# Compiled ErrorLists {{{1
+BaseErrorMatcher = compile_error_list(BaseErrorList)
+SSHErrorMatcher = compile_error_list(SSHErrorList)
+HgErrorMatcher = compile_error_list(HgErrorList)
+PythonErrorMatcher = compile_error_list(PythonErrorList)
+VirtualenvErrorMatcher = compile_error_list(VirtualenvErrorList)
+MakefileErrorMatcher = compile_error_list(MakefileErrorList)
+JarsignerErrorMatcher = compile_error_list(JarsignerErrorList)
+ZipErrorMatcher = compile_error_list(ZipErrorList)
+ZipalignErrorMatcher = compile_error_list(ZipalignErrorList)
+
 
 # __main__ {{{1
 
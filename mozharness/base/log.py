@@ -6,16 +6,30 @@
 # ***** END LICENSE BLOCK *****
 """Generic logging, the way I remember it from scripts gone by.
 
-TODO:
-- network logging support.
-- log rotation config
+Logs can also be streamed to a collector over the network; see
+StreamingHandler and scripts/log_collector.py.
 """
 
+import atexit
+import collections
 from datetime import datetime
+import glob
+import gzip
 import logging
 import os
+import Queue
+import re
+import shutil
+import socket
+import struct
 import sys
+import threading
+import time
 import traceback
+try:
+    import simplejson as json
+except ImportError:
+    import json
 
 # Define our own FATAL_LEVEL
 FATAL_LEVEL = logging.CRITICAL + 10
@@ -25,6 +39,37 @@ logging.addLevelName(FATAL_LEVEL, 'FATAL')
 DEBUG, INFO, WARNING, ERROR, CRITICAL, FATAL, IGNORE = (
     'debug', 'info', 'warning', 'error', 'critical', 'fatal', 'ignore')
 
+# Log levels from least to most severe, for comparing them.
+LEVEL_ORDER = (IGNORE, DEBUG, INFO, WARNING, ERROR, CRITICAL, FATAL)
+LEVEL_NUMBERS = dict((level, num) for (num, level) in enumerate(LEVEL_ORDER))
+
+# Matches any byte that isn't 7-bit ASCII.
+NON_ASCII_RE = re.compile(r'[\x80-\xff]')
+
+# Matches the characters of a log section name that don't go in its
+# file name.
+SECTION_NAME_RE = re.compile(r'[^\w.-]')
+
+
+def parse_stream_address(address):
+    """Return the (socket family, address) of a log collector address,
+    either 'unix:/path/to/socket' or 'host:port'.
+    """
+    if address.startswith('unix:'):
+        return (socket.AF_UNIX, address[len('unix:'):])
+    (host, port) = address.rsplit(':', 1)
+    return (socket.AF_INET, (host, int(port)))
+
+
+def monotonic_time():
+    """Seconds since some fixed point, that won't jump with the clock.
+    os.times()[4] is the elapsed real time on posix; elsewhere, fall
+    back to time.time().
+    """
+    if os.name != 'nt':
+        return os.times()[4]
+    return time.time()
+
 
 # LogMixin {{{1
 class LogMixin(object):
@@ -35,10 +80,25 @@ class LogMixin(object):
 
     def _log_level_at_least(self, level):
         log_level = INFO
-        levels = [DEBUG, INFO, WARNING, ERROR, CRITICAL, FATAL]
-        if hasattr(self, 'config'):
-            log_level = self.config.get('log_level', INFO)
-        return levels.index(level) >= levels.index(log_level)
+        config = getattr(self, 'config', None)
+        if config:
+            log_level = config.get('log_level', INFO)
+        return LEVEL_NUMBERS[level] >= LEVEL_NUMBERS[log_level]
+
+    def log_enabled(self, level):
+        """Return whether a message at level would be logged at all, so
+        callers can skip building expensive messages.  FATAL messages
+        always are, since they exit.
+        """
+        if level == FATAL:
+            return True
+        if level == IGNORE:
+            return False
+        if self.log_obj:
+            if hasattr(self.log_obj, 'is_enabled_for'):
+                return self.log_obj.is_enabled_for(level)
+            return True
+        return self._log_level_at_least(level)
 
     def _print(self, message, stderr=False):
         if not hasattr(self, 'config') or self.config.get('log_to_console', True):
@@ -47,10 +107,24 @@ class LogMixin(object):
             else:
                 print message
 
-    def log(self, message, level=INFO, exit_code=-1):
+    def log(self, message, *args, **kwargs):
+        """Log message at kwargs['level'] (INFO by default).  Any args
+        are only formatted into message (message % args) if it's going
+        to be logged.  kwargs['exit_code'] is the exit code for FATAL;
+        kwargs['console'] shows message on the console even in
+        console_summary mode (see ConsoleSummaryFilter).
+        """
+        level = kwargs.get('level', INFO)
+        if not self.log_enabled(level):
+            return
+        if args:
+            message = message % args
+        exit_code = kwargs.get('exit_code', -1)
         if self.log_obj:
             return self.log_obj.log_message(message, level=level,
-                                            exit_code=exit_code)
+                                            exit_code=exit_code,
+                                            console=kwargs.get('console',
+                                                               False))
         if level == INFO:
             if self._log_level_at_least(level):
                 self._print(message)
@@ -78,23 +152,24 @@ class LogMixin(object):
         # Log at the end, as a fatal will attempt to exit after the 1st line.
         self.log(message, level=level)
 
-    def debug(self, message):
-        self.log(message, level=DEBUG)
+    def debug(self, message, *args):
+        self.log(message, *args, **{'level': DEBUG})
 
-    def info(self, message):
-        self.log(message, level=INFO)
+    def info(self, message, *args):
+        self.log(message, *args, **{'level': INFO})
 
-    def warning(self, message):
-        self.log(message, level=WARNING)
+    def warning(self, message, *args):
+        self.log(message, *args, **{'level': WARNING})
 
-    def error(self, message):
-        self.log(message, level=ERROR)
+    def error(self, message, *args):
+        self.log(message, *args, **{'level': ERROR})
 
-    def critical(self, message):
-        self.log(message, level=CRITICAL)
+    def critical(self, message, *args):
+        self.log(message, *args, **{'level': CRITICAL})
 
-    def fatal(self, message, exit_code=-1):
-        self.log(message, level=FATAL, exit_code=exit_code)
+    def fatal(self, message, *args, **kwargs):
+        self.log(message, *args, **{'level': FATAL,
+                                    'exit_code': kwargs.get('exit_code', -1)})
 
 
 
@@ -102,75 +177,844 @@ class LogMixin(object):
 class OutputParser(LogMixin):
     """ Helper object to parse command output.
 
-This will buffer output if needed, so we can go back and mark
-[(linenum - 10):linenum+10] as errors if need be, without having to
-get all the output first.
-
-linenum+10 will be easy; we can set self.num_post_context_lines to 10,
-and self.num_post_context_lines-- as we mark each line to at least error
-level X.
-
-linenum-10 will be trickier. We'll not only need to save the line
-itself, but also the level that we've set for that line previously,
-whether by matching on that line, or by a previous line's context.
-We should only log that line if all output has ended (self.finish() ?);
-otherwise store a list of dictionaries in self.context_buffer that is
-buffered up to self.num_pre_context_lines (set to the largest
-pre-context-line setting in error_list.)
+An error_list rule may have 'context_lines': 'PRE:POST' (e.g. '5:5',
+'20:' or ':3'), to log the PRE lines before and the POST lines after a
+matching line at (at least) the rule's level, up to CRITICAL.
+
+linenum+POST is easy; we set self.num_post_context_lines to POST,
+and self.num_post_context_lines-- as we mark each line to at least that
+level.
+
+For linenum-PRE, we hold back the last self.num_pre_context_lines
+non-matching lines (the largest PRE in error_list) and their levels in
+fixed-size deques, and only log a line once it falls out of them, so a
+match can still raise the levels of the lines before it.  A matching
+line logs all the held back lines, then itself, right away, so that a
+FATAL match exits at once.  Call self.finish() after the last
+add_lines() to log what's still held back.
+
+As it goes, the parser counts the lines matched at each level in
+self.level_counts, keeps the worst level matched in self.worst_level
+(INFO if nothing worse matched), and the line number and text of the
+first max_matches matches per level in self.matches.
+
+Output can be given a line (or list of lines) at a time to add_lines(),
+or as raw chunks of bytes, e.g. straight from a pipe, to feed(), which
+does the line splitting itself.  Pure ASCII lines aren't decoded;
+other lines are decoded as UTF-8, with decode_errors
+(self.config['output_decode_errors'], default 'replace') as the error
+handler.
+
+To cut down on log volume, if self.config['output_collapse_repeats'] is
+set, a run of consecutive lines logged at the same level is logged once,
+followed by a "repeated N more times" line.  The lines have to be
+identical, or the same once self.config['output_collapse_regex'] matches
+are removed (e.g. r'\d+' for progress lines).
+self.config['output_rate_limits'] maps levels to the most lines per
+second to log at that level; the rest only go to the raw log, if log_obj
+has one, and how many there were is logged once the second is up.
+Neither affects the counts above; self.num_collapsed_lines and
+self.num_spilled_lines count the lines they held back.
 """
     def __init__(self, config=None, log_obj=None, error_list=None,
-                 log_output=True):
+                 log_output=True, log_prefix='', max_matches=10,
+                 decode_errors=None, event_log=None):
+        # errors.py imports our log levels, so import it here rather than
+        # at the top.
+        from mozharness.base.errors import compile_error_list
         self.config = config
         self.log_obj = log_obj
         self.error_list = error_list
+        if error_list is None:
+            error_list = []
+        self.error_matcher = compile_error_list(error_list)
         self.log_output = log_output
+        if decode_errors is None:
+            decode_errors = (config or {}).get('output_decode_errors',
+                                               'replace')
+        self.decode_errors = decode_errors
+        # The incomplete last line of the data fed so far, per stream.
+        self.partial_lines = {}
+        # Prepended to every logged line, e.g. to tell parallel jobs apart.
+        self.log_prefix = log_prefix
         self.num_errors = 0
-        # TODO context_lines.
-        # Not in use yet, but will be based off error_list.
-        self.context_buffer = []
+        self.num_lines = 0
+        self.worst_level = INFO
+        self.level_counts = {}
+        self.max_matches = max_matches
+        self.matches = {}
+        # An EventLog to record every match in.
+        self.event_log = event_log
+        for error_check in self.error_matcher.invalid_rules:
+            self.warning("error_list: 'substr' and 'regex' not in %s" % \
+                         error_check)
         self.num_pre_context_lines = 0
+        if log_output:
+            self.num_pre_context_lines = \
+                self.error_matcher.num_pre_context_lines
         self.num_post_context_lines = 0
-        # TODO set self.error_level to the worst error level hit
-        # (WARNING, ERROR, CRITICAL, FATAL)
-        # self.error_level = INFO
+        self.post_context_level = None
+        # The held back lines, and their levels; see the docstring.
+        self.context_lines = collections.deque(
+            maxlen=self.num_pre_context_lines)
+        self.context_levels = collections.deque(
+            maxlen=self.num_pre_context_lines)
+        self.context_summaries = collections.deque(
+            maxlen=self.num_pre_context_lines)
+        config = config or {}
+        self.collapse_repeats = config.get('output_collapse_repeats', False)
+        self.collapse_regex = config.get('output_collapse_regex')
+        if isinstance(self.collapse_regex, basestring):
+            self.collapse_regex = re.compile(self.collapse_regex)
+        self.num_collapsed_lines = 0
+        # The (level, key) of the last line logged, and how many times
+        # it's been repeated since.
+        self.last_line_key = None
+        self.num_repeats = 0
+        self.rate_limits = config.get('output_rate_limits', {})
+        self.num_spilled_lines = 0
+        # level: [second, lines logged in it, lines spilled in it]
+        self.rate_windows = {}
 
     def add_lines(self, output):
-        if str(output) == output:
+        if isinstance(output, basestring):
             output = [output]
-        for line in output:
-            if not line or line.isspace():
+        self._parse_lines(output)
+
+    def feed(self, data, stream_name='stdout'):
+        """Parse a chunk of raw output.  Lines can span chunks; the
+        incomplete last line is kept until the next chunk from the same
+        stream_name, or finish().
+        """
+        partial_line = self.partial_lines.get(stream_name)
+        if partial_line:
+            data = partial_line + data
+        lines = data.split('\n')
+        self.partial_lines[stream_name] = lines.pop()
+        if lines:
+            self._parse_lines(lines, ascii=NON_ASCII_RE.search(data) is None)
+
+    def _parse_lines(self, lines, ascii=False):
+        """Match and log lines.  If ascii is set, all of lines are
+        known to be ASCII, so none of them need decoding.
+        """
+        for line in lines:
+            self.num_lines += 1
+            line = line.rstrip()
+            if not line:
                 continue
-            line = line.decode("utf-8").rstrip()
-            for error_check in self.error_list:
-                # TODO buffer for context_lines.
-                match = False
-                if 'substr' in error_check:
-                    if error_check['substr'] in line:
-                        match = True
-                elif 'regex' in error_check:
-                    if error_check['regex'].search(line):
-                        match = True
-                else:
-                    self.warn("error_list: 'substr' and 'regex' not in %s" % \
-                              error_check)
-                if match:
-                    level = error_check.get('level', INFO)
-                    if self.log_output:
-                        message = ' %s' % line
-                        if error_check.get('explanation'):
-                            message += '\n %s' % error_check['explanation']
-                        if error_check.get('summary'):
-                            self.add_summary(message, level=level)
-                        else:
-                            self.log(message, level=level)
-                    if level in (ERROR, CRITICAL, FATAL):
-                        self.num_errors += 1
-                    # TODO set self.error_status (or something)
-                    # that sets the worst error level hit.
+            if not ascii and isinstance(line, str) and \
+               NON_ASCII_RE.search(line):
+                line = line.decode('utf-8', self.decode_errors)
+            error_check = self.error_matcher.match(line)
+            if error_check is not None:
+                level = error_check.get('level', INFO)
+                if level in (ERROR, CRITICAL, FATAL):
+                    self.num_errors += 1
+                self._add_match(level, line)
+                if not self.log_output:
+                    continue
+                message = '%s %s' % (self.log_prefix, line)
+                if error_check.get('explanation'):
+                    message += '\n %s' % error_check['explanation']
+                (pre, post) = \
+                    self.error_matcher.query_context_lines(error_check)
+                context_level = self._query_context_level(level)
+                if pre:
+                    self._raise_context_levels(pre, context_level)
+                if post:
+                    self.num_post_context_lines = post
+                    self.post_context_level = context_level
+                self._flush_context_lines()
+                self._log_line(message, level,
+                               summary=error_check.get('summary'))
+            elif self.log_output:
+                level = INFO
+                if self.num_post_context_lines:
+                    self.num_post_context_lines -= 1
+                    level = self.post_context_level
+                self._add_line('%s %s' % (self.log_prefix, line), level)
+
+    def _add_match(self, level, line):
+        self.level_counts[level] = self.level_counts.get(level, 0) + 1
+        if LEVEL_NUMBERS[level] > LEVEL_NUMBERS[self.worst_level]:
+            self.worst_level = level
+        matches = self.matches.setdefault(level, [])
+        if len(matches) < self.max_matches:
+            matches.append((self.num_lines, line))
+        if self.event_log is not None:
+            self.event_log.add_event('match', level=level, line=line,
+                                     line_number=self.num_lines,
+                                     log_prefix=self.log_prefix.strip())
+
+    def finish(self):
+        """Parse what's left of the data fed, and log the lines held
+        back for pre-context.
+        """
+        for stream_name in self.partial_lines.keys():
+            partial_line = self.partial_lines.pop(stream_name)
+            if partial_line:
+                self._parse_lines([partial_line])
+        self._flush_context_lines()
+        self._flush_repeats()
+        for level in self.rate_windows.keys():
+            self._flush_spilled_lines(level)
+
+    def _flush_context_lines(self):
+        while self.context_lines:
+            self._log_line(self.context_lines.popleft(),
+                           self.context_levels.popleft(),
+                           summary=self.context_summaries.popleft())
+
+    def _add_line(self, message, level, summary=False):
+        if not self.num_pre_context_lines:
+            self._log_line(message, level, summary=summary)
+            return
+        if len(self.context_lines) == self.num_pre_context_lines:
+            self._log_line(self.context_lines.popleft(),
+                           self.context_levels.popleft(),
+                           summary=self.context_summaries.popleft())
+        self.context_lines.append(message)
+        self.context_levels.append(level)
+        self.context_summaries.append(summary)
+
+    def _log_line(self, message, level, summary=False):
+        if summary:
+            self.add_summary(message, level=level)
+            return
+        if self.collapse_repeats:
+            key = message
+            if self.collapse_regex is not None:
+                key = self.collapse_regex.sub('', message)
+            if (level, key) == self.last_line_key:
+                self.num_repeats += 1
+                self.num_collapsed_lines += 1
+                return
+            self._flush_repeats()
+            self.last_line_key = (level, key)
+        self._rate_limit_line(message, level)
+
+    def _flush_repeats(self):
+        if self.num_repeats:
+            level = self.last_line_key[0]
+            self.last_line_key = None
+            self._rate_limit_line("%s Last line repeated %d more times." % \
+                                  (self.log_prefix, self.num_repeats), level)
+            self.num_repeats = 0
+
+    def _rate_limit_line(self, message, level):
+        """Log message, unless that would go over the rate limit for
+        level, in which case it only goes to the raw log.
+        """
+        limit = self.rate_limits.get(level)
+        if not limit or level == FATAL:
+            self.log(message, level=level)
+            return
+        now = int(time.time())
+        window = self.rate_windows.get(level)
+        if window is None or window[0] != now:
+            self._flush_spilled_lines(level)
+            window = self.rate_windows[level] = [now, 0, 0]
+        if window[1] < limit:
+            window[1] += 1
+            self.log(message, level=level)
+            return
+        window[2] += 1
+        self.num_spilled_lines += 1
+        log_raw = getattr(self.log_obj, 'log_raw', None)
+        if log_raw is not None:
+            log_raw(message, level=level)
+
+    def _flush_spilled_lines(self, level):
+        window = self.rate_windows.get(level)
+        if window and window[2]:
+            self.log("%s %d more %s lines than the limit of %d/sec only went to the raw log." % \
+                     (self.log_prefix, window[2], level,
+                      self.rate_limits[level]), level=level)
+            window[2] = 0
+
+    def _query_context_level(self, level):
+        """Context lines are logged at the matching rule's level, but
+        never FATAL, which would exit before the match itself is logged.
+        """
+        if level == FATAL:
+            return CRITICAL
+        return level
+
+    def _raise_context_levels(self, num_lines, level):
+        for i in range(1, min(num_lines, len(self.context_levels)) + 1):
+            if LEVEL_NUMBERS[self.context_levels[-i]] < LEVEL_NUMBERS[level]:
+                self.context_levels[-i] = level
+
+
+
+# FlushableFileHandler {{{1
+class FlushableFileHandler(logging.FileHandler):
+    """A FileHandler that only flushes after every record while
+    auto_flush is set.  Otherwise it's up to the owner to call
+    flush_now(); see LogWriterThread.
+    """
+    auto_flush = True
+
+    def flush(self):
+        if self.auto_flush:
+            self.flush_now()
+
+    def flush_now(self):
+        logging.FileHandler.flush(self)
+
+
+
+# SegmentedFileHandler {{{1
+class SegmentedFileHandler(FlushableFileHandler):
+    """A FileHandler that can gzip its log as it goes (compress), and
+    start a new segment once max_bytes (uncompressed) have been written
+    to the current one.
+
+    The current segment is filename; older ones are filename.1 (the
+    newest) up to filename.backup_count, and older segments than that
+    are deleted.  If compress is set, each of them gets a '.gz' suffix,
+    e.g. log_raw.log.gz, log_raw.log.1.gz ...
+
+    Flushing a gzip stream costs some compression, so a compressed log
+    is only flushed every flush_interval seconds, and by flush_now().
+    finish_member() makes the current segment a complete gzip file as it
+    stands; the next record starts a new gzip member of the same file,
+    so the file is only complete until then.  To upload the logs, see
+    BaseLogger.copy_log_files().
+    """
+    def __init__(self, filename, compress=False, max_bytes=None,
+                 backup_count=9, append=False, flush_interval=1.0):
+        self.compress = compress
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.last_flush_time = time.time()
+        self.log_path = os.path.abspath(filename)
+        if compress:
+            filename = '%s.gz' % filename
+        self.num_bytes = 0
+        mode = 'wb'
+        if append:
+            mode = 'ab'
+            # Only an estimate for a gzipped log.
+            if os.path.exists(filename):
+                self.num_bytes = os.path.getsize(filename)
+        FlushableFileHandler.__init__(self, filename, mode)
+
+    def _open(self):
+        if self.compress:
+            return gzip.GzipFile(self.baseFilename, self.mode)
+        return open(self.baseFilename, self.mode)
+
+    def emit(self, record):
+        try:
+            data = self.format(record)
+            if isinstance(data, unicode):
+                data = data.encode('utf-8')
+            data += '\n'
+            if self.max_bytes and self.num_bytes and \
+               self.num_bytes + len(data) > self.max_bytes:
+                self.rotate()
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(data)
+            self.num_bytes += len(data)
+            self.flush()
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+    def flush(self):
+        if not self.auto_flush:
+            return
+        if not self.compress or \
+           time.time() - self.last_flush_time >= self.flush_interval:
+            self.flush_now()
+
+    def flush_now(self):
+        FlushableFileHandler.flush_now(self)
+        self.last_flush_time = time.time()
+
+    def _query_segment(self, num):
+        segment = '%s.%d' % (self.log_path, num)
+        if self.compress:
+            segment += '.gz'
+        return segment
+
+    def rotate(self):
+        """Start a new segment."""
+        if self.stream is not None:
+            self.stream.close()
+        for num in range(self.backup_count, 0, -1):
+            segment = self._query_segment(num)
+            if not os.path.exists(segment):
+                continue
+            if num == self.backup_count:
+                os.remove(segment)
+            else:
+                os.rename(segment, self._query_segment(num + 1))
+        if self.backup_count > 0:
+            os.rename(self.baseFilename, self._query_segment(1))
+        self.mode = 'wb'
+        self.stream = self._open()
+        self.num_bytes = 0
+
+    def finish_member(self):
+        if not self.compress:
+            self.flush_now()
+            return
+        self.acquire()
+        try:
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+            # _open() a new member for the next record.
+            self.mode = 'ab'
+            self.last_flush_time = time.time()
+        finally:
+            self.release()
+
+
+
+# IndexedFileHandler {{{1
+class IndexedFileHandler(FlushableFileHandler):
+    """A FileHandler that also writes a sidecar index, with the offset,
+    length, level number and time of each record it writes, so that
+    other logs can be generated from this one later on.
+
+    Records with raw_only set are indexed with level number 0, to keep
+    them out of generated logs.
+    """
+    INDEX_FORMAT = '<QIHd'
+
+    def __init__(self, filename, index_filename, append=False):
+        mode = 'wb'
+        self.offset = 0
+        if append:
+            mode = 'ab'
+            if os.path.exists(filename):
+                self.offset = os.path.getsize(filename)
+        FlushableFileHandler.__init__(self, filename, mode)
+        self.index_filename = index_filename
+        self.index_stream = open(index_filename, mode)
+
+    def emit(self, record):
+        try:
+            data = self.format(record)
+            if isinstance(data, unicode):
+                data = data.encode('utf-8')
+            data += '\n'
+            levelno = record.levelno
+            if getattr(record, 'raw_only', False):
+                levelno = 0
+            self.stream.write(data)
+            self.index_stream.write(struct.pack(self.INDEX_FORMAT,
+                                                self.offset, len(data),
+                                                levelno, record.created))
+            self.offset += len(data)
+            self.flush()
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+    def flush_now(self):
+        FlushableFileHandler.flush_now(self)
+        if getattr(self, 'index_stream', None) is not None:
+            self.index_stream.flush()
+
+    def close(self):
+        if getattr(self, 'index_stream', None) is not None:
+            self.index_stream.close()
+            self.index_stream = None
+        logging.FileHandler.close(self)
+
+    def iter_records(self):
+        """Yield (levelno, created, data) for each record written so far,
+        raw_only ones included.
+        """
+        self.flush_now()
+        record_size = struct.calcsize(self.INDEX_FORMAT)
+        index_fh = open(self.index_filename, 'rb')
+        log_fh = open(self.baseFilename, 'rb')
+        try:
+            while True:
+                entry = index_fh.read(record_size)
+                if len(entry) < record_size:
                     break
+                (offset, length, levelno, created) = \
+                    struct.unpack(self.INDEX_FORMAT, entry)
+                log_fh.seek(offset)
+                yield levelno, created, log_fh.read(length)
+        finally:
+            index_fh.close()
+            log_fh.close()
+
+
+
+# LogWriterThread {{{1
+class LogWriterThread(object):
+    """Hand log records to a logger's handlers in a thread of its own,
+    fed through a bounded queue, so that logging doesn't wait on disk.
+
+    The handlers should have auto_flush unset (see FlushableFileHandler);
+    they're flushed every flush_records records, and after
+    flush_interval seconds with records written but not flushed.
+    flush() returns once everything queued so far has been written and
+    flushed.
+    """
+    def __init__(self, logger, max_records=1024, flush_records=256,
+                 flush_interval=1.0):
+        self.logger = logger
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        self._queue = Queue.Queue(max_records)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        num_unflushed = 0
+        last_flush_time = time.time()
+        while True:
+            timeout = None
+            if num_unflushed:
+                timeout = max(last_flush_time + self.flush_interval -
+                              time.time(), 0.001)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except Queue.Empty:
+                self._flush_handlers()
+                num_unflushed = 0
+                last_flush_time = time.time()
+                continue
+            try:
+                if item is None:
+                    self._flush_handlers()
+                    return
+                if item != 'flush':
+                    (handler, record) = item
+                    if handler is None:
+                        self.logger.handle(record)
+                    else:
+                        handler.handle(record)
+                    num_unflushed += 1
+                if item == 'flush' or num_unflushed >= self.flush_records:
+                    self._flush_handlers()
+                    num_unflushed = 0
+                    last_flush_time = time.time()
+            finally:
+                self._queue.task_done()
+
+    def _flush_handlers(self):
+        for handler in self.logger.handlers:
+            if hasattr(handler, 'flush_now'):
+                handler.flush_now()
             else:
-                if self.log_output:
-                    self.info(' %s' % line)
+                handler.flush()
+
+    def add_record(self, record, handler=None):
+        """Queue record for handler, or all the logger's handlers if
+        handler is None.
+        """
+        self._queue.put((handler, record))
+
+    def flush(self):
+        self._queue.put('flush')
+        self._queue.join()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+
+# EventLog {{{1
+class EventLog(object):
+    """Write a machine-readable stream of events, one json object per
+    line, for post-run analysis without scraping the text logs.
+
+    Every event has its type ('event'), the wall clock time ('time'), a
+    monotonic_time() ('monotonic'), and whatever is in self.context
+    (e.g. the current action or locale) at the time, plus the fields
+    passed to add_event().
+    """
+    def __init__(self, path, append=False):
+        self.path = path
+        self.context = {}
+        self._lock = threading.Lock()
+        mode = 'w'
+        if append:
+            mode = 'a'
+        self._fh = open(path, mode)
+
+    def add_event(self, event, **kwargs):
+        record = dict(self.context)
+        record.update(kwargs)
+        record['event'] = event
+        record['time'] = time.time()
+        record['monotonic'] = monotonic_time()
+        line = json.dumps(record, sort_keys=True, default=repr)
+        self._lock.acquire()
+        try:
+            if self._fh is not None:
+                self._fh.write(line + '\n')
+                self._fh.flush()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+        finally:
+            self._lock.release()
+
+
+
+# LevelCounter {{{1
+class LevelCounter(logging.Filter):
+    """Count the records a handler gets by mozharness level, in
+    self.level_counts, letting them all through.
+    """
+    def __init__(self):
+        logging.Filter.__init__(self)
+        self.level_counts = {}
+
+    def filter(self, record):
+        level = record.levelname.lower()
+        self.level_counts[level] = self.level_counts.get(level, 0) + 1
+        return True
+
+
+
+# ConsoleSummaryFilter {{{1
+class ConsoleSummaryFilter(logging.Filter):
+    """Keep the console short, for BaseLogger's console_summary mode:
+    only let through records at min_levelno and above, and the ones
+    logged with console=True (action banners, progress and the summary).
+    The log files still get everything.
+    """
+    def __init__(self, min_levelno=logging.WARNING):
+        logging.Filter.__init__(self)
+        self.min_levelno = min_levelno
+
+    def filter(self, record):
+        return record.levelno >= self.min_levelno or \
+               getattr(record, 'console', False)
+
+
+
+# StreamingHandler {{{1
+class StreamingHandler(logging.Handler):
+    """Stream log records to a collector (see scripts/log_collector.py)
+    over TCP or a unix socket (see parse_stream_address()), as json
+    lines.  Each record has the job name ('job'), 'level', 'time' and
+    'message', and whatever is in record.context if it's set (see
+    BaseLogger._make_record()), or else in self.context when it's
+    handled (e.g. the current action or locale).
+
+    emit() never waits on the network: records go into a queue of at
+    most max_records, which a thread of its own sends in batches of up
+    to batch_records, up to batch_interval seconds after the first one
+    arrives.  While the collector can't be reached, the thread retries
+    with exponential backoff, up to max_backoff seconds apart, and
+    appends each batch to spill_path, as emit() does with records that
+    don't fit in the queue.  The spilled records are sent first once
+    the collector is back.
+
+    A record can be sent twice if the connection drops mid-batch; the
+    collector has to live with that.  Anything that couldn't be sent by
+    close() stays in spill_path.
+    """
+    spill_chunk_size = 64 * 1024
+
+    def __init__(self, address, job, spill_path, max_records=10000,
+                 batch_records=256, batch_interval=0.5, max_backoff=30.0,
+                 timeout=10.0):
+        logging.Handler.__init__(self)
+        (self.family, self.address) = parse_stream_address(address)
+        self.job = job
+        self.spill_path = spill_path
+        self.batch_records = batch_records
+        self.batch_interval = batch_interval
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.context = {}
+        self.num_sent = 0
+        self.num_spilled = 0
+        self._sock = None
+        self._backoff = 0
+        self._next_connect_time = 0
+        # The spill file holds records from _spill_offset to _spill_size
+        # that haven't been sent yet.
+        self._spill_lock = threading.Lock()
+        self._spill_offset = 0
+        self._spill_size = 0
+        if os.path.exists(spill_path):
+            self._spill_size = os.path.getsize(spill_path)
+        self._queue = Queue.Queue(max_records)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def emit(self, record):
+        try:
+            item = dict(getattr(record, 'context', self.context))
+            item['job'] = self.job
+            item['level'] = record.levelname.lower()
+            item['time'] = record.created
+            item['message'] = record.getMessage()
+            line = json.dumps(item, sort_keys=True, default=repr) + '\n'
+        except Exception:
+            self.handleError(record)
+            return
+        if self._thread is None:
+            self._spill([line])
+            return
+        try:
+            self._queue.put_nowait(line)
+        except Queue.Full:
+            self._spill([line])
+
+    def _run(self):
+        closing = False
+        while not closing:
+            lines = []
+            num_items = 0
+            timeout = None
+            if self._spill_offset < self._spill_size:
+                # Keep trying to send the spilled records.
+                timeout = self.batch_interval
+            deadline = None
+            while len(lines) < self.batch_records:
+                if deadline is not None:
+                    timeout = deadline - time.time()
+                    if timeout <= 0:
+                        break
+                try:
+                    line = self._queue.get(timeout=timeout)
+                except Queue.Empty:
+                    break
+                num_items += 1
+                if line is None:
+                    closing = True
+                    break
+                if line == 'flush':
+                    break
+                lines.append(line)
+                if deadline is None:
+                    deadline = time.time() + self.batch_interval
+            try:
+                self._send(lines)
+            finally:
+                for i in range(num_items):
+                    self._queue.task_done()
+
+    def _connect(self):
+        now = time.time()
+        if now < self._next_connect_time:
+            return False
+        sock = socket.socket(self.family, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.address)
+        except socket.error:
+            sock.close()
+            self._backoff = min(max(self._backoff * 2, 1.0), self.max_backoff)
+            self._next_connect_time = now + self._backoff
+            return False
+        self._sock = sock
+        self._backoff = 0
+        return True
+
+    def _disconnect(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _send(self, lines):
+        if self._sock is None and not self._connect():
+            self._spill(lines)
+            return
+        try:
+            self._send_spilled()
+            if lines:
+                self._sock.sendall(''.join(lines))
+                self.num_sent += len(lines)
+        except socket.error:
+            self._disconnect()
+            self._spill(lines)
+
+    def _send_spilled(self):
+        while True:
+            self._spill_lock.acquire()
+            try:
+                if self._spill_offset >= self._spill_size:
+                    if self._spill_size:
+                        open(self.spill_path, 'wb').close()
+                        self._spill_offset = self._spill_size = 0
+                    return
+                fh = open(self.spill_path, 'rb')
+                try:
+                    fh.seek(self._spill_offset)
+                    lines = fh.readlines(self.spill_chunk_size)
+                finally:
+                    fh.close()
+            finally:
+                self._spill_lock.release()
+            self._sock.sendall(''.join(lines))
+            self.num_sent += len(lines)
+            self._spill_offset += sum([len(line) for line in lines])
+
+    def _spill(self, lines):
+        if not lines:
+            return
+        self._spill_lock.acquire()
+        try:
+            fh = open(self.spill_path, 'ab')
+            try:
+                fh.writelines(lines)
+            finally:
+                fh.close()
+            self._spill_size += sum([len(line) for line in lines])
+            self.num_spilled += len(lines)
+        finally:
+            self._spill_lock.release()
+
+    def wait_sent(self):
+        """Return once everything emitted so far has been sent or
+        spilled.  Not flush(), which LogWriterThread calls often.
+        """
+        if self._thread is not None:
+            self._queue.put('flush')
+            self._queue.join()
+
+    def close(self):
+        """Send whatever is queued, if the collector lets us, and stop
+        the sending thread.  Later records go straight to spill_path.
+        """
+        thread = self._thread
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+            self._thread = None
+            self._disconnect()
+            # Anything emit() queued behind the None.
+            lines = []
+            while True:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    break
+                self._queue.task_done()
+            self._spill([line for line in lines
+                         if line is not None and line != 'flush'])
+        logging.Handler.close(self)
 
 
 
@@ -200,6 +1044,13 @@ class BaseLogger(object):
                  logger_name='',
                  halt_on_failure=True,
                  append_to_log=False,
+                 async_logging=False,
+                 gzip_logs=False,
+                 log_max_bytes=None,
+                 log_backup_count=9,
+                 log_stream=None,
+                 log_stream_job=None,
+                 console_summary=False,
                 ):
         self.halt_on_failure = halt_on_failure,
         self.log_format = log_format
@@ -210,6 +1061,16 @@ class BaseLogger(object):
         self.log_name = log_name
         self.log_dir = log_dir
         self.append_to_log = append_to_log
+        self.async_logging = async_logging
+        # See SegmentedFileHandler.
+        self.gzip_logs = gzip_logs
+        self.log_max_bytes = log_max_bytes
+        self.log_backup_count = log_backup_count
+        # See StreamingHandler.
+        self.log_stream = log_stream
+        self.log_stream_job = log_stream_job
+        # See ConsoleSummaryFilter.
+        self.console_summary = console_summary
 
         # Not sure what I'm going to use this for; useless unless we
         # can have multiple logging objects that don't trample each other
@@ -217,9 +1078,25 @@ class BaseLogger(object):
 
         self.all_handlers = []
         self.log_files = {}
+        self.raw_handler = None
+        self.stream_handler = None
+        self.min_logger_level = self.get_logger_level()
+
+        # The index of log sections (see start_log_section()), and the
+        # ones still open, innermost last, as (index entry, handler,
+        # monotonic_time() at the start).
+        self.log_sections = []
+        self.open_log_sections = []
 
         self.create_log_dir()
 
+        # With async_logging, log_message() queues records for
+        # self.log_writer, which is started by new_logger().
+        self.log_writer = None
+        # The names of the methods registered with atexit; see
+        # _close_at_exit().
+        self._atexit_methods = set()
+
     def create_log_dir(self):
         if os.path.exists(self.log_dir):
             if not os.path.isdir(self.log_dir):
@@ -240,6 +1117,10 @@ class BaseLogger(object):
             level = self.log_level
         return self.LEVELS.get(level, logging.NOTSET)
 
+    def is_enabled_for(self, level):
+        """Return whether log_message() would log anything at level."""
+        return self.LEVELS.get(level, logging.NOTSET) >= self.min_logger_level
+
     def get_log_formatter(self, log_format=None, date_format=None):
         if not log_format:
             log_format = self.log_format
@@ -251,16 +1132,27 @@ class BaseLogger(object):
         """Create a new logger.
         By default there are no handlers.
         """
+        self.close_log_writer()
+        if self.async_logging:
+            self.log_writer = LogWriterThread(logging.getLogger(logger_name))
+            self._close_at_exit(self.close_log_writer)
         self.logger = logging.getLogger(logger_name)
         self.logger.setLevel(self.get_logger_level())
+        # For is_enabled_for().
+        self.min_logger_level = self.get_logger_level()
         self._clear_handlers()
         if self.log_to_console:
             self.add_console_handler()
+        if self.log_stream:
+            self.add_stream_handler(self.log_stream, job=self.log_stream_job)
         if self.log_to_raw:
             self.log_files['raw'] = '%s_raw.log' % self.log_name
-            self.add_file_handler(os.path.join(self.abs_log_dir,
-                                               self.log_files['raw']),
-                                 log_format='%(message)s')
+            self.add_raw_handler(os.path.join(self.abs_log_dir,
+                                              self.log_files['raw']))
+
+    def add_raw_handler(self, log_path):
+        self.add_file_handler(log_path, log_format='%(message)s')
+        self.raw_handler = self.all_handlers[-1]
 
     def _clear_handlers(self):
         """To prevent dups -- logging will preserve Handlers across
@@ -271,47 +1163,343 @@ class BaseLogger(object):
             for handler in self.all_handlers:
                 self.logger.removeHandler(handler)
             self.all_handlers = []
+            self.raw_handler = None
+            self.open_log_sections = []
+        self.close_stream_handler()
 
     def __del__(self):
+        self.close_log_writer()
         logging.shutdown()
         self._clear_handlers()
 
+    def flush_logs(self):
+        """Wait until everything logged so far has been written and
+        flushed (only an issue with async_logging), and leave any gzipped
+        logs complete as they stand.  Streamed records are sent to the
+        log collector, or spilled.
+        """
+        if getattr(self, 'log_writer', None) is not None:
+            self.log_writer.flush()
+        for handler in self.all_handlers:
+            if hasattr(handler, 'finish_member'):
+                handler.finish_member()
+        if getattr(self, 'stream_handler', None) is not None:
+            self.stream_handler.wait_sent()
+
+    def copy_log_files(self, dest_dir):
+        """Copy the log files (see query_log_files()) to dest_dir, at
+        the same paths relative to it as to self.abs_log_dir, and return
+        those paths.
+
+        The logs are flushed first, and nothing is logged until they've
+        all been copied, so gzipped logs are copied complete.
+        """
+        self.flush_logs()
+        log_files = self.query_log_files()
+        for log_file in log_files:
+            dest = os.path.join(dest_dir, log_file)
+            if not os.path.isdir(os.path.dirname(dest)):
+                os.makedirs(os.path.dirname(dest))
+            shutil.copyfile(os.path.join(self.abs_log_dir, log_file), dest)
+        return log_files
+
+    def _query_log_segments(self, log_path):
+        """Return the files log_path may have been written to, existing
+        or not: log_path itself, and with gzip_logs or log_max_bytes,
+        the log_path.gz and log_path.N(.gz) files from SegmentedFileHandler.
+        """
+        return [log_path, '%s.gz' % log_path] + \
+               glob.glob('%s.[0-9]*' % log_path)
+
+    def _remove_log_file(self, log_path):
+        for segment in self._query_log_segments(log_path):
+            if os.path.exists(segment):
+                os.remove(segment)
+
+    def query_log_files(self):
+        """Return the paths of the log files, relative to
+        self.abs_log_dir, with every segment of a segmented or gzipped
+        log, and the log sections and their index.
+        """
+        log_files = []
+        for log_file in self.log_files.values():
+            for segment in self._query_log_segments(
+              os.path.join(self.abs_log_dir, log_file)):
+                if os.path.exists(segment):
+                    log_files.append(os.path.basename(segment))
+        if self.log_sections:
+            log_files.append(os.path.basename(
+                self.query_log_section_index_path()))
+        for entry in self.log_sections:
+            log_dir = os.path.dirname(entry['file'])
+            for segment in self._query_log_segments(
+              os.path.join(self.abs_log_dir, entry['file'])):
+                if os.path.exists(segment):
+                    log_files.append(os.path.join(log_dir,
+                                                  os.path.basename(segment)))
+        # Records that never made it to the log collector.
+        spill_path = self.query_stream_spill_path()
+        if os.path.exists(spill_path) and os.path.getsize(spill_path):
+            log_files.append(os.path.basename(spill_path))
+        return sorted(log_files)
+
+    def query_log_section_index_path(self):
+        return os.path.join(self.abs_log_dir,
+                            '%s_sections.json' % self.log_name)
+
+    def start_log_section(self, name):
+        """Also write everything logged from now on to a file of its
+        own, sections/<log_name>_<name>.log, until end_log_section().
+
+        Sections nest (e.g. one per locale within one per action); each
+        line only goes to the innermost open section, so nothing is
+        written twice.  Their index, <log_name>_sections.json, has each
+        one's name, file, parent section, start and end times, number of
+        lines per level, and where it starts and ends in the raw log
+        (raw_start and raw_end, byte offsets that take in the sections
+        within it; None without a raw log, or with a gzipped or segmented
+        one), so whoever triages a failure can go straight to the right
+        file, or the right part of the raw log.
+        """
+        if self.log_writer is not None:
+            self.log_writer.flush()
+        file_name = SECTION_NAME_RE.sub('_', name)
+        used_files = [entry['file'] for entry in self.log_sections]
+        log_file = os.path.join('sections', '%s_%s.log' % (self.log_name,
+                                                            file_name))
+        num = 1
+        while log_file in used_files:
+            num += 1
+            log_file = os.path.join('sections', '%s_%s.%d.log' % \
+                                    (self.log_name, file_name, num))
+        log_path = os.path.join(self.abs_log_dir, log_file)
+        if not os.path.isdir(os.path.dirname(log_path)):
+            os.makedirs(os.path.dirname(log_path))
+        self.add_file_handler(log_path)
+        handler = self.all_handlers[-1]
+        counter = LevelCounter()
+        handler.addFilter(counter)
+        entry = {'name': name,
+                 'file': log_file,
+                 'parent': None,
+                 'start': time.time(),
+                 'end': None,
+                 'duration': None,
+                 'level_counts': counter.level_counts,
+                 'raw_start': self._query_raw_offset(),
+                 'raw_end': None,
+                }
+        if self.open_log_sections:
+            (parent_entry, parent_handler, parent_start_time) = \
+                self.open_log_sections[-1]
+            entry['parent'] = parent_entry['name']
+            # Until this section ends, its lines go here only.
+            self.logger.removeHandler(parent_handler)
+        self.log_sections.append(entry)
+        self.open_log_sections.append((entry, handler, monotonic_time()))
+        self.write_log_section_index()
+
+    def end_log_section(self):
+        """End the innermost open log section, if any."""
+        if not self.open_log_sections:
+            return
+        if self.log_writer is not None:
+            self.log_writer.flush()
+        (entry, handler, start_time) = self.open_log_sections.pop()
+        self.logger.removeHandler(handler)
+        self.all_handlers.remove(handler)
+        handler.close()
+        entry['end'] = time.time()
+        entry['duration'] = monotonic_time() - start_time
+        entry['raw_end'] = self._query_raw_offset()
+        if self.open_log_sections:
+            self.logger.addHandler(self.open_log_sections[-1][1])
+        self.write_log_section_index()
+
+    def _query_raw_offset(self):
+        """Return the size of the raw log so far, or None if there's no
+        raw log, or it's gzipped or segmented.
+        """
+        raw_handler = self.raw_handler
+        if raw_handler is None or \
+           isinstance(raw_handler, SegmentedFileHandler):
+            return None
+        raw_handler.flush_now()
+        return os.path.getsize(raw_handler.baseFilename)
+
+    def write_log_section_index(self):
+        fh = open(self.query_log_section_index_path(), 'w')
+        try:
+            json.dump(self.log_sections, fh, indent=2, sort_keys=True)
+        finally:
+            fh.close()
+
+    def query_stream_spill_path(self):
+        return os.path.join(self.abs_log_dir,
+                            '%s_stream_spill.jsonl' % self.log_name)
+
+    def add_stream_handler(self, address, job=None, log_level=None):
+        """Stream log records to the collector at address, as job (by
+        default, the host name, log_name and pid), spilling them to
+        log_name_stream_spill.jsonl while the collector is unreachable.
+        See StreamingHandler.
+        """
+        if job is None:
+            job = '%s-%s-%d' % (socket.gethostname(), self.log_name,
+                                os.getpid())
+        spill_path = self.query_stream_spill_path()
+        if not self.append_to_log and os.path.exists(spill_path):
+            os.remove(spill_path)
+        self.close_stream_handler()
+        stream_handler = StreamingHandler(address, job, spill_path)
+        stream_handler.setLevel(self.get_logger_level(log_level))
+        self.logger.addHandler(stream_handler)
+        self.stream_handler = stream_handler
+        self._close_at_exit(self.close_stream_handler)
+
+    def close_stream_handler(self):
+        """Send what's left to the log collector, if there's a
+        StreamingHandler, and remove it.
+        """
+        stream_handler = getattr(self, 'stream_handler', None)
+        if stream_handler is None:
+            return
+        # Everything the log writer has queued goes first.
+        if getattr(self, 'log_writer', None) is not None:
+            self.log_writer.flush()
+        self.stream_handler = None
+        self.logger.removeHandler(stream_handler)
+        stream_handler.close()
+
+    def _close_at_exit(self, method):
+        """Register method (e.g. self.close_log_writer) with atexit,
+        once per logger, however many times new_logger() runs.
+        """
+        if method.__name__ not in self._atexit_methods:
+            self._atexit_methods.add(method.__name__)
+            atexit.register(method)
+
+    def close_log_writer(self):
+        """Flush and stop the async_logging writer thread, if any.  Any
+        later logging happens synchronously.
+        """
+        log_writer = getattr(self, 'log_writer', None)
+        if log_writer is not None:
+            self.log_writer = None
+            log_writer.close()
+            for handler in self.all_handlers:
+                if hasattr(handler, 'auto_flush'):
+                    handler.auto_flush = True
+
     def add_console_handler(self, log_level=None, log_format=None,
                           date_format=None):
         console_handler = logging.StreamHandler()
         console_handler.setLevel(self.get_logger_level(log_level))
         console_handler.setFormatter(self.get_log_formatter(log_format=log_format,
                                                             date_format=date_format))
+        if self.console_summary:
+            console_handler.addFilter(
+                ConsoleSummaryFilter(self.get_logger_level(WARNING))
+            )
         self.logger.addHandler(console_handler)
         self.all_handlers.append(console_handler)
 
     def add_file_handler(self, log_path, log_level=None, log_format=None,
                        date_format=None):
-        if not self.append_to_log and os.path.exists(log_path):
-            os.remove(log_path)
-        file_handler = logging.FileHandler(log_path)
+        if not self.append_to_log:
+            self._remove_log_file(log_path)
+        if self.gzip_logs or self.log_max_bytes:
+            file_handler = SegmentedFileHandler(
+                log_path, compress=self.gzip_logs,
+                max_bytes=self.log_max_bytes,
+                backup_count=self.log_backup_count,
+                append=self.append_to_log
+            )
+        else:
+            file_handler = FlushableFileHandler(log_path)
+        if self.log_writer is not None:
+            file_handler.auto_flush = False
         file_handler.setLevel(self.get_logger_level(log_level))
         file_handler.setFormatter(self.get_log_formatter(log_format=log_format,
                                                          date_format=date_format))
         self.logger.addHandler(file_handler)
         self.all_handlers.append(file_handler)
 
-    def log_message(self, message, level=INFO, exit_code=-1):
+    def log_message(self, message, level=INFO, exit_code=-1, console=False):
         """Generic log method.
         There should be more options here -- do or don't split by line,
         use os.linesep instead of assuming \n, be able to pass in log level
         by name or number.
 
         Adding the IGNORE special level for runCommand.
+
+        With async_logging, the lines are queued for the log writer
+        thread, in order; a FATAL message waits for them to be written
+        before exiting.
+
+        console=True shows the message on the console in console_summary
+        mode, whatever its level.
         """
         if level == IGNORE:
             return
-        for line in message.splitlines():
-            self.logger.log(self.get_logger_level(level), line)
+        logger_level = self.get_logger_level(level)
+        if logger_level < self.min_logger_level:
+            # Nothing to log; don't bother splitting the message.
+            pass
+        elif self.log_writer is None:
+            extra = None
+            if console:
+                extra = {'console': True}
+            for line in message.splitlines():
+                self.logger.log(logger_level, line, extra=extra)
+        else:
+            for line in message.splitlines():
+                record = self._make_record(logger_level, line)
+                if console:
+                    record.console = True
+                self.log_writer.add_record(record)
         if level == FATAL and self.halt_on_failure:
-            self.logger.log(FATAL_LEVEL, 'Exiting %d' % exit_code)
+            if self.log_writer is None:
+                self.logger.log(FATAL_LEVEL, 'Exiting %d' % exit_code)
+            else:
+                self.log_writer.add_record(
+                    self._make_record(FATAL_LEVEL, 'Exiting %d' % exit_code)
+                )
+            self.flush_logs()
+            self.generate_logs()
             raise SystemExit(exit_code)
 
+    def _make_record(self, logger_level, line):
+        record = self.logger.makeRecord(self.logger.name, logger_level,
+                                        '(unknown file)', 0, line, None, None)
+        if self.stream_handler is not None:
+            # The context as of now, not as of when the log writer gets
+            # to the record.
+            record.context = dict(self.stream_handler.context)
+        return record
+
+    def generate_logs(self):
+        """Write out any logs that aren't written as we go.  Nothing to
+        do here; see MultiFileLogger.
+        """
+        pass
+
+    def log_raw(self, message, level=INFO):
+        """Log message to the raw log only, if there is one."""
+        if self.raw_handler is None or level == IGNORE:
+            return
+        logger_level = self.get_logger_level(level)
+        if logger_level < self.min_logger_level or \
+           logger_level < self.raw_handler.level:
+            return
+        for line in message.splitlines():
+            record = self._make_record(logger_level, line)
+            record.raw_only = True
+            if self.log_writer is not None:
+                self.log_writer.add_record(record, handler=self.raw_handler)
+            else:
+                self.raw_handler.handle(record)
+
 
 
 # SimpleFileLogger {{{1
@@ -340,10 +1528,21 @@ class SimpleFileLogger(BaseLogger):
 class MultiFileLogger(BaseLogger):
     """Create a log per log level in log_dir.  Possibly also output to
     the terminal and a raw log (no prepending of level or date)
+
+    Each line normally gets written to the raw log and the log of every
+    level at or below its own.  With write_once_log, each line is only
+    written to the raw log, with an index alongside it (see
+    IndexedFileHandler), and the per-level logs are only written when
+    generate_logs() is called.  The raw log is never gzipped or
+    segmented then, since the index points into it.
     """
     def __init__(self, logger_name='Multi',
                  log_format='%(asctime)s %(levelname)8s - %(message)s',
-                 log_dir='logs', log_to_raw=True, **kwargs):
+                 log_dir='logs', log_to_raw=True, write_once_log=False,
+                 **kwargs):
+        self.write_once_log = write_once_log
+        if write_once_log:
+            log_to_raw = True
         BaseLogger.__init__(self, logger_name=logger_name,
                             log_format=log_format,
                             log_to_raw=log_to_raw, log_dir=log_dir,
@@ -359,9 +1558,68 @@ class MultiFileLogger(BaseLogger):
             if self.get_logger_level(level) >= min_logger_level:
                 self.log_files[level] = '%s_%s.log' % (self.log_name,
                                                        level)
-                self.add_file_handler(os.path.join(self.abs_log_dir,
-                                                   self.log_files[level]),
-                                      log_level=level)
+                if not self.write_once_log:
+                    self.add_file_handler(os.path.join(self.abs_log_dir,
+                                                       self.log_files[level]),
+                                          log_level=level)
+
+    def add_raw_handler(self, log_path):
+        if not self.write_once_log:
+            BaseLogger.add_raw_handler(self, log_path)
+            return
+        if not self.append_to_log:
+            for level in self.LEVELS.keys():
+                self._remove_log_file(os.path.join(self.abs_log_dir,
+                                                   '%s_%s.log' % \
+                                                   (self.log_name, level)))
+        raw_handler = IndexedFileHandler(log_path, '%s.idx' % log_path,
+                                         append=self.append_to_log)
+        if self.log_writer is not None:
+            raw_handler.auto_flush = False
+        raw_handler.setLevel(self.get_logger_level())
+        raw_handler.setFormatter(self.get_log_formatter(log_format='%(message)s'))
+        self.logger.addHandler(raw_handler)
+        self.all_handlers.append(raw_handler)
+        self.raw_handler = raw_handler
+
+    def generate_logs(self):
+        """With write_once_log, (re)write the per-level logs from the raw
+        log and its index; gzipped with gzip_logs, but never segmented.
+        """
+        if not self.write_once_log or self.raw_handler is None:
+            return
+        self.flush_logs()
+        formatter = self.get_log_formatter()
+        log_fhs = []
+        try:
+            for level in self.log_files.keys():
+                if level == 'raw':
+                    continue
+                log_path = os.path.join(self.abs_log_dir,
+                                        self.log_files[level])
+                if self.gzip_logs:
+                    fh = gzip.GzipFile('%s.gz' % log_path, 'wb')
+                else:
+                    fh = open(log_path, 'wb')
+                log_fhs.append((self.get_logger_level(level), fh))
+            for (levelno, created, data) in self.raw_handler.iter_records():
+                if not levelno:
+                    continue
+                record = logging.LogRecord(self.logger.name, levelno,
+                                           '(unknown file)', 0,
+                                           data.rstrip('\n'), None, None)
+                record.created = created
+                record.msecs = (created - long(created)) * 1000
+                line = formatter.format(record)
+                if isinstance(line, unicode):
+                    line = line.encode('utf-8')
+                line += '\n'
+                for (min_levelno, fh) in log_fhs:
+                    if levelno >= min_levelno:
+                        fh.write(line)
+        finally:
+            for (min_levelno, fh) in log_fhs:
+                fh.close()
 
 
 
@@ -8,6 +8,7 @@
 '''
 
 import os
+import subprocess
 
 from mozharness.base.errors import VirtualenvErrorList
 from mozharness.base.log import WARNING, FATAL
@@ -91,28 +92,31 @@ class VirtualenvMixin(object):
         packages = {}
 
         if pip_freeze_output is None:
-            # get the output from `pip freeze`
+            # stream the output from `pip freeze`
             pip = self.query_python_path("pip")
             if not pip:
                 self.log("package_versions: Program pip not in path", level=error_level)
                 return {}
-            pip_freeze_output = self.get_output_from_command([pip, "freeze"], silent=True)
-            if not isinstance(pip_freeze_output, basestring):
-                self.fatal("package_versions: Error encountered running `pip freeze`: %s" % pip_freeze_output)
-
-        for line in pip_freeze_output.splitlines():
-            # parse the output into package, version
-            line = line.strip()
-            if not line:
-                # whitespace
-                continue
-            if line.startswith('-'):
-                # not a package, probably like '-e http://example.com/path#egg=package-dev'
-                continue
-            if '==' not in line:
-                self.fatal("pip_freeze_packages: Unrecognized output line: %s" % line)
-            package, version = line.split('==', 1)
-            packages[package] = version
+            pip_freeze_lines = self.iter_output_lines([pip, "freeze"], silent=True)
+        else:
+            pip_freeze_lines = pip_freeze_output.splitlines()
+
+        try:
+            for line in pip_freeze_lines:
+                # parse the output into package, version
+                line = line.strip()
+                if not line:
+                    # whitespace
+                    continue
+                if line.startswith('-'):
+                    # not a package, probably like '-e http://example.com/path#egg=package-dev'
+                    continue
+                if '==' not in line:
+                    self.fatal("pip_freeze_packages: Unrecognized output line: %s" % line)
+                package, version = line.split('==', 1)
+                packages[package] = version
+        except (subprocess.CalledProcessError, OSError), e:
+            self.fatal("package_versions: Error encountered running `pip freeze`: %s" % str(e))
 
         return packages
 
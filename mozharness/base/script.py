@@ -14,13 +14,22 @@ TODO: The mixin names kind of need work too?
 """
 
 import codecs
+import collections
+import errno
+import multiprocessing
 import os
 import platform
 import pprint
+import Queue
 import re
+import select
 import shutil
+import signal
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 import urllib2
 import urlparse
 
@@ -31,7 +40,14 @@ except ImportError:
 
 from mozharness.base.config import BaseConfig
 from mozharness.base.log import SimpleFileLogger, MultiFileLogger, \
-     LogMixin, OutputParser, DEBUG, INFO, ERROR, FATAL
+     LogMixin, OutputParser, EventLog, monotonic_time, DEBUG, INFO, ERROR, \
+     FATAL
+
+# The return code for commands killed by the timeout or output_timeout
+# watchdogs; the same one timeout(1) uses.  A command can exit with 124
+# itself, which callers can't tell apart from a timeout by the status
+# alone; the watchdog also logs an error when it fires.
+TIMEOUT_STATUS = 124
 
 # OSMixin {{{1
 class OSMixin(object):
@@ -53,13 +69,14 @@ class OSMixin(object):
                              level=error_level)
                     return -1
         else:
-            self.debug("mkdir_p: %s Already exists." % path)
+            self.debug("mkdir_p: %s Already exists.", path)
 
     def rmtree(self, path, log_level=INFO, error_level=ERROR, exit_code=-1):
         """
         Returns None for success, not None for failure
         """
         self.log("rmtree: %s" % path, level=log_level)
+        self._drop_cached_output()
         if os.path.exists(path):
             if not self.config.get('noop'):
                 if os.path.isdir(path):
@@ -74,7 +91,15 @@ class OSMixin(object):
                              exit_code=exit_code)
                     return -1
         else:
-            self.debug("%s doesn't exist." % path)
+            self.debug("%s doesn't exist.", path)
+
+    def _drop_cached_output(self):
+        """Files are about to change, so cached query output (see
+        ShellMixin.output_cache) can't be trusted any more.
+        """
+        output_cache = getattr(self, 'output_cache', None)
+        if output_cache is not None:
+            output_cache.clear()
 
     def _is_windows(self):
         system = platform.system()
@@ -143,6 +168,7 @@ class OSMixin(object):
             self.info("Downloading %s%s" % (url, message))
             return file_name
         req = urllib2.Request(url)
+        self._drop_cached_output()
         try:
             self.info("Downloading %s%s" % (url, message))
             f = urllib2.urlopen(req)
@@ -164,6 +190,7 @@ class OSMixin(object):
     def move(self, src, dest, log_level=INFO, error_level=ERROR,
              exit_code=-1):
         self.log("Moving %s to %s" % (src, dest), level=log_level)
+        self._drop_cached_output()
         if not self.config.get('noop'):
             try:
                 shutil.move(src, dest)
@@ -176,11 +203,13 @@ class OSMixin(object):
 
     def chmod(self, path, mode):
         self.info("Chmoding %s to %s" % (path, str(oct(mode))))
+        self._drop_cached_output()
         if not self.config.get('noop'):
             os.chmod(path, mode)
 
     def copyfile(self, src, dest, log_level=INFO, error_level=ERROR):
         self.log("Copying %s to %s" % (src, dest), level=log_level)
+        self._drop_cached_output()
         if not self.config.get('noop'):
             try:
                 shutil.copyfile(src, dest)
@@ -202,10 +231,11 @@ class OSMixin(object):
         Returns file_path if successful, None if not.
         """
         self.info("Writing to file %s" % file_path)
+        self._drop_cached_output()
         if verbose:
             self.info("Contents:")
             for line in contents.splitlines():
-                self.info(" %s" % line)
+                self.info(" %s", line)
         if create_parent_dir:
             parent_dir = os.path.dirname(file_path)
             self.mkdir_p(parent_dir, error_level=error_level)
@@ -236,7 +266,7 @@ class OSMixin(object):
             if verbose:
                 self.info("Contents:")
                 for line in contents.splitlines():
-                    self.info(" %s" % line)
+                    self.info(" %s", line)
             return contents
         except IOError:
             self.log("%s can't be opened for reading!" % file_path,
@@ -274,6 +304,632 @@ class OSMixin(object):
 
 
 
+# OutputPump {{{1
+class OutputPump(object):
+    """Drain a child process' stdout and stderr without busy-waiting.
+
+    The pipes are multiplexed through select.poll() (select.select() where
+    poll() isn't available), so the parent sleeps until the child writes
+    something.  Each read is split into lines, and every line is stamped
+    with the time its chunk arrived.  A partial trailing line is held back
+    until the rest of it arrives or the pipe closes, so the final lines of
+    output aren't lost when the child exits.
+
+    Windows can't select() on pipes, so there we fall back to one reader
+    thread per pipe, feeding a queue.
+
+    Iterating over the pump yields lists of (timestamp, stream_name, line)
+    tuples until both pipes are closed, or until a watchdog fires: timeout
+    is the maximum number of seconds since the pump was created, and
+    output_timeout the maximum number of seconds without any output.
+    Any output counts, including a partial line (e.g. progress dots).
+    When a watchdog fires, self.timed_out is set to 'timeout' or
+    'output_timeout'; killing the child is up to the caller.
+
+    If multiplexed is set, the pump doesn't wait on its pipes itself; an
+    OutputMultiplexer does, and hands it the data through add_data().
+
+    If split_lines is False, the pump doesn't split the reads into lines,
+    and yields each read as it is, for OutputParser.feed().
+
+    If interruptible is set, another thread can stop the iteration with
+    interrupt(), e.g. when a ParserThread's parser has raised; call
+    close() when done with the pump.
+    """
+    def __init__(self, process, chunk_size=65536, timeout=None,
+                 output_timeout=None, multiplexed=False, split_lines=True,
+                 interruptible=False):
+        self.process = process
+        self.chunk_size = chunk_size
+        self.split_lines = split_lines
+        self.timeout = timeout
+        self.output_timeout = output_timeout
+        self.start_time = self.last_output_time = time.time()
+        self.timed_out = None
+        self.interrupted = False
+        self.streams = {}
+        self.partial_lines = {}
+        for stream_name in ('stdout', 'stderr'):
+            fh = getattr(process, stream_name)
+            if fh is not None:
+                self.streams[fh.fileno()] = stream_name
+                self.partial_lines[stream_name] = ''
+        self.open_fds = set(self.streams.keys())
+        self._poller = None
+        self._queue = None
+        self._wakeup = None
+        if multiplexed:
+            pass
+        elif os.name == 'nt':
+            self._start_reader_threads()
+        elif hasattr(select, 'poll'):
+            self._poller = select.poll()
+            for fd in self.open_fds:
+                self._poller.register(fd, select.POLLIN | select.POLLPRI)
+        if interruptible and not multiplexed and self._queue is None:
+            self._wakeup = WakeupPipe(self._poller)
+
+    def __iter__(self):
+        while not self.finished() and not self.interrupted:
+            wait = self._query_watchdog_wait()
+            if wait is not None and wait <= 0:
+                return
+            chunk = self.read_lines(timeout=wait)
+            if chunk:
+                yield chunk
+
+    def query_deadline(self):
+        if self.timeout is not None:
+            return self.start_time + self.timeout
+
+    def _query_watchdog_wait(self):
+        """Return the number of seconds until the next watchdog fires, or
+        None if there are no watchdogs.  Sets self.timed_out if one
+        already has.
+        """
+        now = time.time()
+        waits = {}
+        if self.timeout is not None:
+            waits['timeout'] = self.query_deadline() - now
+        if self.output_timeout is not None:
+            waits['output_timeout'] = self.last_output_time + \
+                                      self.output_timeout - now
+        if not waits:
+            return None
+        name = min(waits, key=waits.get)
+        if waits[name] <= 0:
+            self.timed_out = name
+        return max(waits[name], 0)
+
+    def finished(self):
+        return not self.open_fds
+
+    def interrupt(self):
+        """Stop the iteration as soon as possible; safe to call from
+        another thread.
+        """
+        self.interrupted = True
+        if self._queue is not None:
+            self._queue.put((None, ''))
+        elif self._wakeup is not None:
+            self._wakeup.wake()
+
+    def close(self):
+        if self._wakeup is not None:
+            self._wakeup.close()
+            self._wakeup = None
+
+    def _start_reader_threads(self):
+        self._queue = Queue.Queue()
+        for fd in self.open_fds:
+            t = threading.Thread(target=self._reader_thread, args=(fd, ))
+            t.daemon = True
+            t.start()
+
+    def _reader_thread(self, fd):
+        while True:
+            try:
+                data = os.read(fd, self.chunk_size)
+            except OSError:
+                data = ''
+            self._queue.put((fd, data))
+            if not data:
+                break
+
+    def _wait_for_output(self, timeout):
+        """Return a list of (fd, data) for every pipe that was readable
+        within timeout seconds.  Empty data means the pipe is closed.
+        """
+        if self._queue is not None:
+            try:
+                (fd, data) = self._queue.get(timeout=timeout)
+            except Queue.Empty:
+                return []
+            if fd is None:
+                # interrupt()
+                return []
+            return [(fd, data)]
+        fds = self.open_fds
+        if self._wakeup is not None:
+            fds = list(fds) + [self._wakeup.read_fd]
+        ready_fds = _wait_for_readable(self._poller, fds, timeout)
+        if self._wakeup is not None:
+            ready_fds = self._wakeup.filter(ready_fds)
+        return _read_ready_fds(ready_fds, self.chunk_size)
+
+    def read_lines(self, timeout=None):
+        """Wait up to timeout seconds (forever if None) for output, and
+        return the complete lines read as a list of
+        (timestamp, stream_name, line) tuples.
+        """
+        lines = []
+        if self.finished():
+            return lines
+        for fd, data in self._wait_for_output(timeout):
+            lines.extend(self.add_data(fd, data))
+        return lines
+
+    def add_data(self, fd, data):
+        """Split data read from fd into lines, and return the complete
+        ones as a list of (timestamp, stream_name, line) tuples.
+        Empty data means fd is closed.
+
+        If self.split_lines is False, data is returned whole, as
+        [(timestamp, stream_name, data)].
+        """
+        lines = []
+        timestamp = time.time()
+        stream_name = self.streams[fd]
+        if data:
+            self.last_output_time = timestamp
+        if not self.split_lines:
+            if data:
+                lines.append((timestamp, stream_name, data))
+            else:
+                self.open_fds.discard(fd)
+                if self._poller is not None:
+                    self._poller.unregister(fd)
+            return lines
+        if not data:
+            self.open_fds.discard(fd)
+            if self._poller is not None:
+                self._poller.unregister(fd)
+            if self.partial_lines[stream_name]:
+                lines.append((timestamp, stream_name,
+                              self.partial_lines[stream_name]))
+                self.partial_lines[stream_name] = ''
+            return lines
+        data = self.partial_lines[stream_name] + data
+        split_lines = data.split('\n')
+        self.partial_lines[stream_name] = split_lines.pop()
+        for line in split_lines:
+            lines.append((timestamp, stream_name, line + '\n'))
+        return lines
+
+
+# OutputMultiplexer {{{1
+class OutputMultiplexer(object):
+    """Wait on the pipes of any number of multiplexed OutputPumps at once,
+    from a single thread, through one select.poll() (or select.select()).
+
+    Not available on Windows, which can't select() on pipes.
+
+    If interruptible is set, another thread can make read_lines() return
+    early with interrupt(), as with OutputPump.
+    """
+    def __init__(self, chunk_size=65536, interruptible=False):
+        self.chunk_size = chunk_size
+        self.pumps = {}
+        self.interrupted = False
+        self._poller = None
+        self._wakeup = None
+        if hasattr(select, 'poll'):
+            self._poller = select.poll()
+        if interruptible:
+            self._wakeup = WakeupPipe(self._poller)
+
+    def interrupt(self):
+        self.interrupted = True
+        if self._wakeup is not None:
+            self._wakeup.wake()
+
+    def close(self):
+        if self._wakeup is not None:
+            self._wakeup.close()
+            self._wakeup = None
+
+    def register(self, key, pump):
+        for fd in pump.open_fds:
+            self.pumps[fd] = (key, pump)
+            if self._poller is not None:
+                self._poller.register(fd, select.POLLIN | select.POLLPRI)
+
+    def unregister(self, pump):
+        for fd in self.pumps.keys():
+            if self.pumps[fd][1] is pump:
+                self._remove_fd(fd)
+
+    def _remove_fd(self, fd):
+        del(self.pumps[fd])
+        if self._poller is not None:
+            self._poller.unregister(fd)
+
+    def read_lines(self, timeout=None):
+        """Wait up to timeout seconds (forever if None) for output from
+        any of the pumps, and return a list of (key, lines) for each
+        pump that had complete lines, as OutputPump.read_lines() would.
+        """
+        results = []
+        fds = self.pumps.keys()
+        if self._wakeup is not None:
+            fds.append(self._wakeup.read_fd)
+        ready_fds = _wait_for_readable(self._poller, fds, timeout)
+        if self._wakeup is not None:
+            ready_fds = self._wakeup.filter(ready_fds)
+        for fd, data in _read_ready_fds(ready_fds, self.chunk_size):
+            key, pump = self.pumps[fd]
+            if not data:
+                self._remove_fd(fd)
+            lines = pump.add_data(fd, data)
+            if lines:
+                results.append((key, lines))
+        return results
+
+
+# WakeupPipe {{{1
+class WakeupPipe(object):
+    """A pipe whose read end sits among the fds a thread waits on in
+    _wait_for_readable(), so that another thread can wake it with wake().
+    If poller is set, read_fd is registered with it.
+
+    Not available on Windows, which can't select() on pipes.
+    """
+    def __init__(self, poller=None):
+        (self.read_fd, self.write_fd) = os.pipe()
+        self._poller = poller
+        if poller is not None:
+            poller.register(self.read_fd, select.POLLIN)
+
+    def wake(self):
+        os.write(self.write_fd, 'x')
+
+    def filter(self, ready_fds):
+        """Drain the pipe if it's among ready_fds, and return the
+        other fds.
+        """
+        if self.read_fd not in ready_fds:
+            return ready_fds
+        os.read(self.read_fd, 4096)
+        return [fd for fd in ready_fds if fd != self.read_fd]
+
+    def close(self):
+        if self._poller is not None:
+            self._poller.unregister(self.read_fd)
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+
+def _wait_for_readable(poller, fds, timeout=None):
+    """Return the fds that became readable within timeout seconds
+    (forever if None), using poller, a select.poll() object with fds
+    registered, or select.select() if poller is None.
+    """
+    while True:
+        try:
+            if poller is not None:
+                if timeout is not None:
+                    ready = poller.poll(timeout * 1000)
+                else:
+                    ready = poller.poll()
+                return [fd for (fd, event) in ready]
+            if not fds:
+                if timeout is not None:
+                    time.sleep(timeout)
+                return []
+            return select.select(list(fds), [], [], timeout)[0]
+        except (select.error, IOError, OSError), e:
+            if e.args[0] != errno.EINTR:
+                raise
+
+
+def _read_ready_fds(ready_fds, chunk_size=65536):
+    """Read what's available from each of ready_fds, and return a list
+    of (fd, data).  Empty data means the pipe is closed.
+    """
+    results = []
+    for fd in ready_fds:
+        try:
+            data = os.read(fd, chunk_size)
+        except OSError, e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                continue
+            data = ''
+        results.append((fd, data))
+    return results
+
+
+# ParserThread {{{1
+class ParserThread(object):
+    """Run OutputParser.add_lines() and feed() in a thread of its own, fed
+    through a bounded queue, so that slow logging doesn't keep us from
+    draining a child's pipes (which would block the child on write).
+
+    add_lines() and feed() block while the queue holds max_chunks chunks.
+    high_water_mark is the deepest the queue got, and num_full the number
+    of times it was found full.
+
+    If a parser raises (e.g. SystemExit from a FATAL error_list match),
+    the rest of the queue is discarded, and the exception is re-raised
+    from the next add_lines(), feed(), flush() or close().  self.failed
+    is set, and on_error, if set, is called from the parser thread; e.g.
+    OutputPump.interrupt(), so that the pumping thread finds out without
+    waiting for more output.
+    """
+    def __init__(self, max_chunks=256, on_error=None):
+        self.max_chunks = max_chunks
+        self.on_error = on_error
+        self.high_water_mark = 0
+        self.num_full = 0
+        self.failed = False
+        self._exc_info = None
+        self._queue = Queue.Queue(max_chunks)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if self._exc_info is None:
+                    function, args = item
+                    function(*args)
+            except:
+                self._exc_info = sys.exc_info()
+                self.failed = True
+                if self.on_error is not None:
+                    self.on_error()
+            finally:
+                self._queue.task_done()
+
+    def _raise(self):
+        exc_info = self._exc_info
+        if exc_info is not None:
+            self._exc_info = (None, None, None)
+            if exc_info[0] is not None:
+                raise exc_info[0], exc_info[1], exc_info[2]
+
+    def _put(self, function, *args):
+        self._raise()
+        if self._queue.full():
+            self.num_full += 1
+        self._queue.put((function, args))
+        self.high_water_mark = max(self.high_water_mark, self._queue.qsize())
+
+    def add_lines(self, parser, lines):
+        self._put(parser.add_lines, lines)
+
+    def feed(self, parser, data, stream_name='stdout'):
+        self._put(parser.feed, data, stream_name)
+
+    def flush(self):
+        """Wait until everything queued so far has been parsed."""
+        self._queue.join()
+        self._raise()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._raise()
+
+
+
+# OutputBuffer {{{1
+class OutputBuffer(object):
+    """Collect a stream of output lines, optionally capped at max_bytes.
+
+    Past the cap, we either keep only the first and last keep_lines lines
+    (the default), or, if spill is set, move everything to a private
+    temporary file and keep appending there.
+    """
+    def __init__(self, max_bytes=None, keep_lines=100, spill=False):
+        self.max_bytes = max_bytes
+        self.keep_lines = keep_lines
+        self.spill = spill
+        self.num_bytes = 0
+        self.num_lines = 0
+        self.lines = []
+        self.tail = None
+        self.spill_path = None
+        self._spill_fh = None
+
+    def add_line(self, line):
+        self.num_bytes += len(line)
+        self.num_lines += 1
+        if self._spill_fh is not None:
+            self._spill_fh.write(line)
+        elif self.tail is not None:
+            self.tail.append(line)
+        else:
+            self.lines.append(line)
+            if self.max_bytes is not None and self.num_bytes > self.max_bytes:
+                self._overflow()
+
+    def _overflow(self):
+        if self.spill:
+            fd, self.spill_path = tempfile.mkstemp(prefix='mozharness_output_')
+            self._spill_fh = os.fdopen(fd, 'w+b')
+            self._spill_fh.writelines(self.lines)
+            self.lines = []
+        else:
+            self.tail = collections.deque(self.lines[self.keep_lines:],
+                                          self.keep_lines)
+            del(self.lines[self.keep_lines:])
+
+    def __iter__(self):
+        if self._spill_fh is not None:
+            self._spill_fh.flush()
+            self._spill_fh.seek(0)
+            for line in self._spill_fh:
+                yield line
+            self._spill_fh.seek(0, os.SEEK_END)
+            return
+        for line in self.lines:
+            yield line
+        if self.tail is not None:
+            num_omitted = self.num_lines - len(self.lines) - len(self.tail)
+            if num_omitted:
+                yield "[%d lines omitted]\n" % num_omitted
+            for line in self.tail:
+                yield line
+
+    def getvalue(self):
+        """Return everything as one string.  After a spill, that reads
+        the whole temporary file back into memory; iterate over the
+        buffer instead where the lines can be handled one at a time.
+        """
+        return ''.join(self)
+
+    def close(self):
+        if self._spill_fh is not None:
+            self._spill_fh.close()
+            self._spill_fh = None
+            os.remove(self.spill_path)
+
+
+# OutputCache {{{1
+class OutputCache(object):
+    """Remember the output of read-only query commands (|hg branch|,
+    |make ident|, ...), keyed on (kind, command, cwd, env); kind keeps
+    apart the differently shaped output of the various helpers.
+
+    Everything is dropped by clear() whenever a command that might
+    change things runs, wherever it runs or writes to, and whenever
+    OSMixin's file helpers (rmtree(), move(), ...) change something.
+    hits and misses count the lookups.
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _query_key(self, command, cwd=None, env=None, kind='output'):
+        if isinstance(command, list):
+            command = tuple(command)
+        cwd = os.path.abspath(cwd or os.getcwd())
+        if env is not None:
+            env = tuple(sorted(env.items()))
+        return (kind, command, cwd, env)
+
+    def get(self, command, cwd=None, env=None, kind='output'):
+        """Return the cached output; raise KeyError if there isn't any."""
+        key = self._query_key(command, cwd=cwd, env=env, kind=kind)
+        self._lock.acquire()
+        try:
+            if key in self._entries:
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            raise KeyError(key)
+        finally:
+            self._lock.release()
+
+    def set(self, command, output, cwd=None, env=None, kind='output'):
+        key = self._query_key(command, cwd=cwd, env=env, kind=kind)
+        self._lock.acquire()
+        try:
+            self._entries[key] = output
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+        finally:
+            self._lock.release()
+
+
+# ReadOnlyEnv {{{1
+class ReadOnlyEnv(collections.Mapping):
+    """A read-only environment: a base mapping, shared and never changed,
+    with a small dict of variables laid over it.
+
+    overlay() derives a new ReadOnlyEnv from the same base, so a
+    per-locale variation costs the size of the overlay rather than a copy
+    of the whole environment.
+    """
+    def __init__(self, base, overlay=None):
+        if isinstance(base, ReadOnlyEnv):
+            merged_overlay = dict(base._overlay)
+            merged_overlay.update(overlay or {})
+            overlay = merged_overlay
+            base = base._base
+        self._base = base
+        self._overlay = dict(overlay or {})
+
+    def __getitem__(self, key):
+        if key in self._overlay:
+            return self._overlay[key]
+        return self._base[key]
+
+    def __iter__(self):
+        for key in self._base:
+            yield key
+        for key in self._overlay:
+            if key not in self._base:
+                yield key
+
+    def __len__(self):
+        return len(self._base) + \
+               len([key for key in self._overlay if key not in self._base])
+
+    def __repr__(self):
+        return "ReadOnlyEnv(%r)" % dict(self)
+
+    def overlay(self, env_dict):
+        """Return a new ReadOnlyEnv with env_dict laid over this one."""
+        return ReadOnlyEnv(self, env_dict)
+
+    def copy(self):
+        """Return a plain, changeable dict copy."""
+        return dict(self)
+
+
+# CommandResult {{{1
+class CommandResult(object):
+    """What run_command(return_type='result') returns: the return code,
+    along with what the OutputParser found in the output.
+
+    worst_level is the worst level the error_list matched (INFO if
+    nothing worse), level_counts the number of matches per level, and
+    matches the (line number, line) of the first few matches per level.
+    """
+    def __init__(self, command, return_code, parser=None):
+        self.command = command
+        self.return_code = return_code
+        self.num_errors = 0
+        self.num_lines = 0
+        self.worst_level = INFO
+        self.level_counts = {}
+        self.matches = {}
+        if parser is not None:
+            self.num_errors = parser.num_errors
+            self.num_lines = parser.num_lines
+            self.worst_level = parser.worst_level
+            self.level_counts = dict(parser.level_counts)
+            self.matches = dict(parser.matches)
+
+    def __repr__(self):
+        return "CommandResult(%r, return_code=%r, worst_level=%r, " \
+               "level_counts=%r)" % (self.command, self.return_code,
+                                     self.worst_level, self.level_counts)
+
+
+
 # ShellMixin {{{1
 class ShellMixin(object):
     """These are very special but very complex methods that, together with
@@ -284,6 +940,18 @@ class ShellMixin(object):
     """
     def __init__(self):
         self.env = None
+        # Resource usage records for every finished command; see
+        # _start_process() and _reap_process().
+        self.command_stats = []
+        self.current_action = None
+        self._running_commands = {}
+        # Output of cacheable=True queries; see get_output_from_command().
+        self.output_cache = OutputCache()
+        # query_env() results, and the os.environ snapshot they share.
+        self._env_cache = {}
+        self._base_env = None
+        # An EventLog for command, match and other events, if any.
+        self.event_log = None
 
     def query_env(self, partial_env=None, replace_dict=None,
                   set_self_env=None):
@@ -296,7 +964,17 @@ class ShellMixin(object):
         If you specify partial_env, partial_env will be used instead of
         self.config['env'], and we don't save self.env as it's a one-off.
 
+        The env is a ReadOnlyEnv: partial_env laid over a snapshot of
+        os.environ.  It's memoized on the contents of partial_env and
+        replace_dict, so asking again returns the same object, until
+        os.environ itself changes; then the snapshot is retaken and the
+        memoized envs (self.env included) are dropped.  Use env.overlay()
+        for variations, or env.copy() for a dict you can change.
         """
+        if self._base_env != os.environ:
+            self._base_env = os.environ.copy()
+            self._env_cache.clear()
+            self.env = None
         if partial_env is None:
             if self.env is not None:
                 return self.env
@@ -305,22 +983,30 @@ class ShellMixin(object):
                 partial_env = {}
             if set_self_env is None:
                 set_self_env = True
-        env = os.environ.copy()
-        default_replace_dict = self.query_abs_dirs()
-        default_replace_dict['PATH'] = os.environ['PATH']
-        if not replace_dict:
+        key = (self._query_env_key(partial_env),
+               self._query_env_key(replace_dict))
+        env = self._env_cache.get(key)
+        if env is None:
+            default_replace_dict = dict(self.query_abs_dirs())
+            default_replace_dict['PATH'] = self._base_env['PATH']
+            if replace_dict:
+                default_replace_dict.update(replace_dict)
             replace_dict = default_replace_dict
-        else:
-            for key in default_replace_dict:
-                if key not in replace_dict:
-                    replace_dict[key] = default_replace_dict[key]
-        for key in partial_env.keys():
-            env[key] = partial_env[key] % replace_dict
-            self.debug("ENV: %s is now %s" % (key, env[key]))
+            overlay = {}
+            for env_key in partial_env.keys():
+                overlay[env_key] = partial_env[env_key] % replace_dict
+                self.debug("ENV: %s is now %s", env_key, overlay[env_key])
+            env = ReadOnlyEnv(self._base_env, overlay)
+            self._env_cache[key] = env
         if set_self_env:
             self.env = env
         return env
 
+    def _query_env_key(self, env_dict):
+        if not env_dict:
+            return None
+        return tuple(sorted(env_dict.items()))
+
     def query_exe(self, exe_name, exe_dict='exes'):
         """One way to work around PATH rewrites.
 
@@ -335,10 +1021,22 @@ class ShellMixin(object):
 
     def run_command(self, command, cwd=None, error_list=None, parse_at_end=False,
                     halt_on_failure=False, success_codes=None,
-                    env=None, return_type='status', throw_exception=False):
+                    env=None, return_type='status', throw_exception=False,
+                    timeout=None, output_timeout=None):
         """Run a command, with logging and error parsing.
 
-        TODO: parse_at_end, context_lines
+        timeout is the maximum number of seconds the command may run;
+        output_timeout the maximum number of seconds it may go without
+        any output.  They default to self.config['command_timeout'] and
+        self.config['command_output_timeout'].  On expiry the command's
+        process group is killed, and the return code is TIMEOUT_STATUS.
+
+        return_type 'status' (the default) returns the return code;
+        'num_errors' the number of error lines the error_list matched; and
+        'result' a CommandResult with both, plus the worst level matched,
+        the number of matches per level and the first matches.
+
+        TODO: parse_at_end
         TODO: retry_interval?
         TODO: error_level_override?
         TODO: Add a copy-pastable version of |command| if it's a list.
@@ -346,8 +1044,8 @@ class ShellMixin(object):
 
         error_list example:
         [{'regex': re.compile('^Error: LOL J/K'), level=IGNORE},
-         {'regex': re.compile('^Error:'), level=ERROR, contextLines='5:5'},
-         {'substr': 'THE WORLD IS ENDING', level=FATAL, contextLines='20:'}
+         {'regex': re.compile('^Error:'), level=ERROR, context_lines='5:5'},
+         {'substr': 'THE WORLD IS ENDING', level=FATAL, context_lines='20:'}
         ]
         """
         if error_list is None:
@@ -361,46 +1059,623 @@ class ShellMixin(object):
                     level = FATAL
                 self.log("Can't run command %s in non-existent directory %s!" % \
                          (command, cwd), level=level)
+                if return_type == 'result':
+                    return CommandResult(command, -1)
                 return -1
             self.info("Running command: %s in %s" % (command, cwd))
         else:
             self.info("Running command: %s" % command)
         if self.config.get('noop'):
             self.info("(Dry run; skipping)")
+            if return_type == 'result':
+                return CommandResult(command, None)
             return
-        shell = True
-        if isinstance(command, list):
-            shell = False
-        p = subprocess.Popen(command, shell=shell, stdout=subprocess.PIPE,
-                             cwd=cwd, stderr=subprocess.STDOUT, env=env)
+        p = self._start_process(command, cwd=cwd, env=env)
         parser = OutputParser(config=self.config, log_obj=self.log_obj,
-                              error_list=error_list)
-        loop = True
-        while loop:
-            if p.poll() is not None:
-                """Avoid losing the final lines of the log?"""
-                loop = False
-            for line in p.stdout:
-                parser.add_lines(line)
+                              error_list=error_list,
+                              event_log=self.event_log)
+        returncode = self._pump_output(p, parser, command=command,
+                                       timeout=timeout,
+                                       output_timeout=output_timeout)
         return_level = INFO
-        if p.returncode not in success_codes:
+        if returncode not in success_codes:
             return_level = ERROR
             if throw_exception:
-                raise subprocess.CalledProcessError(p.returncode, command)
-        self.log("Return code: %d" % p.returncode, level=return_level)
+                raise subprocess.CalledProcessError(returncode, command)
+        self.log("Return code: %d" % returncode, level=return_level)
         if halt_on_failure:
-            if parser.num_errors or p.returncode not in success_codes:
+            if parser.num_errors or returncode not in success_codes:
                 self.fatal("Halting on failure while running %s" % command,
-                           exit_code=p.returncode)
+                           exit_code=returncode)
         if return_type == 'num_errors':
             return parser.num_errors
-        return p.returncode
+        if return_type == 'result':
+            return CommandResult(command, returncode, parser=parser)
+        return returncode
+
+    def run_commands_parallel(self, jobs, max_workers=None,
+                              halt_on_failure=False):
+        """Run several commands at once, with at most max_workers running
+        at any given time.
+
+        Each job is a dict of run_command() arguments: 'command' and,
+        optionally, 'cwd', 'env', 'error_list', 'success_codes', 'timeout'
+        and 'output_timeout'.
+        An optional 'name' is used to prefix that job's log lines; it
+        defaults to the job's position in jobs.
+
+        Every job gets its own OutputParser.  max_workers defaults to
+        self.config['max_parallel_jobs'], or the number of cpus.
+
+        self.config['parallel_backend'] picks how the jobs are driven:
+        'threads' (the default) runs each job from its own worker thread;
+        'event_loop' drives all of them from this thread, waiting on every
+        job's output at once, which scales to many more jobs.  Windows
+        always uses 'threads'.
+
+        Returns a list of {'return_code': ..., 'num_errors': ...} dicts,
+        in the same order as jobs.  Jobs that couldn't be started, or
+        that raised in the 'threads' backend's worker (which is logged),
+        have a return_code of -1.  If a job's parser raises SystemExit
+        (a FATAL error_list match), the other jobs are killed, and it's
+        re-raised here, whichever the backend.
+        """
+        if not jobs:
+            return []
+        if max_workers is None:
+            max_workers = self.config.get('max_parallel_jobs')
+        if not max_workers:
+            max_workers = multiprocessing.cpu_count()
+        max_workers = max(1, min(max_workers, len(jobs)))
+        self.info("Running %d commands, %d at a time." % (len(jobs), max_workers))
+        backend = self.config.get('parallel_backend', 'threads')
+        if backend == 'event_loop' and os.name == 'nt':
+            self.warning("The event_loop parallel backend isn't available on Windows; using threads.")
+            backend = 'threads'
+        if backend == 'event_loop':
+            results = self._run_jobs_event_loop(jobs, max_workers)
+        else:
+            results = self._run_jobs_threads(jobs, max_workers)
+        if halt_on_failure:
+            for job, result in zip(jobs, results):
+                if result['num_errors'] or \
+                   result['return_code'] not in job.get('success_codes', [0]):
+                    self.fatal("Halting on failure while running %s" % job['command'],
+                               exit_code=result['return_code'])
+        return results
+
+    def _run_jobs_threads(self, jobs, max_workers):
+        """run_commands_parallel()'s 'threads' backend.
+
+        A worker that gets SystemExit (or KeyboardInterrupt) from a job
+        stops, and passes it back to this thread, which stops the other
+        workers from starting any more jobs, kills the running ones, and
+        re-raises it once the workers are done.
+        """
+        results = [None] * len(jobs)
+        job_queue = Queue.Queue()
+        for job_num, job in enumerate(jobs):
+            job_queue.put((job_num, job))
+        # The running jobs' processes, by job number.  lock covers
+        # starting a job and setting stop, so that nothing starts once
+        # stop is set.
+        running = {}
+        lock = threading.Lock()
+        stop = threading.Event()
+        # Each worker's exc_info, or None, as it exits.
+        exits = Queue.Queue()
+
+        def worker():
+            exc_info = None
+            while exc_info is None:
+                try:
+                    job_num, job = job_queue.get_nowait()
+                except Queue.Empty:
+                    break
+                try:
+                    lock.acquire()
+                    try:
+                        if stop.is_set():
+                            break
+                        p, parser, result = self._start_parallel_job(job_num,
+                                                                     job)
+                        if p is not None:
+                            running[job_num] = p
+                    finally:
+                        lock.release()
+                    if p is not None:
+                        try:
+                            result = self._pump_parallel_job(job, p, parser,
+                                                             result)
+                        finally:
+                            del(running[job_num])
+                    results[job_num] = result
+                except Exception:
+                    # Don't let one job take the worker, and the jobs
+                    # still queued, down with it.
+                    self.dump_exception("[%s] Error running %s:" % \
+                                        (job.get('name', job_num),
+                                         job['command']))
+                    results[job_num] = {'return_code': -1, 'num_errors': 0}
+                except BaseException:
+                    exc_info = sys.exc_info()
+            exits.put(exc_info)
+
+        threads = []
+        for i in range(max_workers):
+            t = threading.Thread(target=worker)
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        exc_info = None
+        for t in threads:
+            worker_exc_info = exits.get()
+            if worker_exc_info is None or exc_info is not None:
+                continue
+            exc_info = worker_exc_info
+            lock.acquire()
+            try:
+                stop.set()
+                processes = running.values()
+            finally:
+                lock.release()
+            for p in processes:
+                self._kill_process_group(p)
+        for t in threads:
+            t.join()
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return results
+
+    def _run_jobs_event_loop(self, jobs, max_workers):
+        """run_commands_parallel()'s 'event_loop' backend: a single
+        OutputMultiplexer waits on the output of every running job, and
+        feeds each job's lines to that job's OutputParser, through one
+        shared ParserThread unless self.config['background_parsing'] is
+        False.
+        """
+        results = [None] * len(jobs)
+        pending = list(enumerate(jobs))
+        pending.reverse()
+        running = {}
+        parser_thread = self._query_parser_thread()
+        multiplexer = OutputMultiplexer(
+            interruptible=parser_thread is not None
+        )
+        if parser_thread is not None:
+            parser_thread.on_error = multiplexer.interrupt
+        try:
+            while pending or running:
+                while pending and len(running) < max_workers:
+                    job_num, job = pending.pop()
+                    p, parser, result = self._start_parallel_job(job_num, job)
+                    if p is None:
+                        results[job_num] = result
+                        continue
+                    pump = self._query_output_pump(
+                        p, timeout=job.get('timeout'),
+                        output_timeout=job.get('output_timeout'),
+                        multiplexed=True, split_lines=False
+                    )
+                    multiplexer.register(job_num, pump)
+                    running[job_num] = (p, parser, result, pump)
+                if not running:
+                    continue
+                waits = []
+                for (p, parser, result, pump) in running.values():
+                    if pump.finished():
+                        # The pipes are closed; poll for the exit.
+                        waits.append(0.1)
+                    else:
+                        wait = pump._query_watchdog_wait()
+                        if wait is not None:
+                            waits.append(wait)
+                wait = None
+                if waits:
+                    wait = min(waits)
+                for job_num, chunk in multiplexer.read_lines(timeout=wait):
+                    parser = running[job_num][1]
+                    for (timestamp, stream_name, data) in chunk:
+                        if parser_thread is not None:
+                            parser_thread.feed(parser, data, stream_name)
+                        else:
+                            parser.feed(data, stream_name)
+                if multiplexer.interrupted:
+                    # A parser raised; flush() re-raises it here.
+                    parser_thread.flush()
+                for job_num in running.keys():
+                    p, parser, result, pump = running[job_num]
+                    command = "%s %s" % (parser.log_prefix,
+                                         jobs[job_num]['command'])
+                    if not pump.finished():
+                        pump._query_watchdog_wait()
+                        if not pump.timed_out:
+                            continue
+                        returncode = self._wait_for_process(
+                            p, command, timed_out=pump.timed_out, pump=pump
+                        )
+                    else:
+                        returncode = self._reap_process(p, nohang=True)
+                        if returncode is None:
+                            deadline = pump.query_deadline()
+                            if deadline is None or time.time() < deadline:
+                                continue
+                            returncode = self._wait_for_process(
+                                p, command, timed_out='timeout', pump=pump
+                            )
+                    multiplexer.unregister(pump)
+                    del(running[job_num])
+                    if parser_thread is not None:
+                        parser_thread.flush()
+                    parser.finish()
+                    results[job_num] = self._finish_parallel_job(
+                        jobs[job_num], parser, result, returncode
+                    )
+        except:
+            # A parser raised, e.g. SystemExit on a FATAL error_list
+            # match; don't leave the other commands running without us.
+            exc_info = sys.exc_info()
+            for (p, parser, result, pump) in running.values():
+                self._kill_process_group(p)
+            raise exc_info[0], exc_info[1], exc_info[2]
+        finally:
+            try:
+                self._close_parser_thread(parser_thread,
+                                          "the parallel commands")
+            finally:
+                multiplexer.close()
+        return results
+
+    def _pump_parallel_job(self, job, p, parser, result):
+        """Helper method for run_commands_parallel()'s 'threads' backend:
+        wait for a job started by _start_parallel_job() to finish.
+
+        This runs in a worker thread, so it logs failures rather than
+        calling fatal(); only the parser's SystemExit gets through.
+        """
+        returncode = self._pump_output(
+            p, parser, command="%s %s" % (parser.log_prefix, job['command']),
+            timeout=job.get('timeout'),
+            output_timeout=job.get('output_timeout')
+        )
+        return self._finish_parallel_job(job, parser, result, returncode)
+
+    def _start_parallel_job(self, job_num, job):
+        """Start one of run_commands_parallel()'s jobs.
+
+        Returns (process, parser, result).  process is None if there's
+        nothing to wait for: the job couldn't be started, or this is a
+        dry run.  result is then already filled in.
+        """
+        command = job['command']
+        cwd = job.get('cwd')
+        prefix = "[%s]" % job.get('name', job_num)
+        result = {'return_code': -1, 'num_errors': 0}
+        if cwd:
+            if not os.path.isdir(cwd):
+                self.error("%s Can't run command %s in non-existent directory %s!" % \
+                           (prefix, command, cwd))
+                return (None, None, result)
+            self.info("%s Running command: %s in %s" % (prefix, command, cwd))
+        else:
+            self.info("%s Running command: %s" % (prefix, command))
+        if self.config.get('noop'):
+            self.info("%s (Dry run; skipping)" % prefix)
+            result['return_code'] = 0
+            return (None, None, result)
+        try:
+            p = self._start_process(command, cwd=cwd, env=job.get('env'))
+        except OSError:
+            self.dump_exception("%s Unable to run %s:" % (prefix, command))
+            return (None, None, result)
+        parser = OutputParser(config=self.config, log_obj=self.log_obj,
+                              error_list=job.get('error_list', []),
+                              log_prefix=prefix, event_log=self.event_log)
+        return (p, parser, result)
+
+    def _finish_parallel_job(self, job, parser, result, returncode):
+        success_codes = job.get('success_codes', [0])
+        return_level = INFO
+        if returncode not in success_codes:
+            return_level = ERROR
+        self.log("%s Return code: %d" % (parser.log_prefix, returncode),
+                 level=return_level)
+        result['return_code'] = returncode
+        result['num_errors'] = parser.num_errors
+        return result
+
+    def _start_process(self, command, cwd=None, env=None,
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                       cacheable=False, secret_args=None):
+        """Popen command in its own process group, so the timeout
+        watchdogs can kill it along with all of its children.
+
+        Unless command is a cacheable (read-only) query, it may change
+        things anywhere, so all the cached query output is dropped.
+
+        secret_args (e.g. passwords) are masked in the command that goes
+        into self.command_stats and the event log; see
+        _query_masked_command().
+        """
+        if not cacheable:
+            self.output_cache.clear()
+        shell = True
+        if isinstance(command, list):
+            shell = False
+        kwargs = {}
+        if os.name == 'nt':
+            kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            kwargs['preexec_fn'] = os.setpgrp
+        start_time = time.time()
+        process = subprocess.Popen(command, shell=shell, stdout=stdout,
+                                   stderr=stderr, cwd=cwd, env=env, **kwargs)
+        command = self._query_masked_command(command, secret_args)
+        self._running_commands[process.pid] = {
+            'command': command,
+            'cwd': cwd,
+            'action': self.current_action,
+            'start_time': start_time,
+        }
+        if self.event_log is not None:
+            self.event_log.add_event('command_start', command=command,
+                                     cwd=cwd, pid=process.pid)
+        return process
+
+    def _query_masked_command(self, command, secret_args=None):
+        """Return command (a list or a string) with each of secret_args
+        replaced by '********'.
+        """
+        if not secret_args:
+            return command
+        secret_args = [arg for arg in secret_args if arg]
+        if isinstance(command, basestring):
+            for arg in secret_args:
+                command = command.replace(arg, '********')
+            return command
+        masked_command = []
+        for arg in command:
+            for secret_arg in secret_args:
+                arg = arg.replace(secret_arg, '********')
+            masked_command.append(arg)
+        return masked_command
+
+    def _query_process_io(self, pid):
+        """Return (read_bytes, write_bytes) from /proc/PID/io, or
+        (None, None) where that isn't available.
+
+        These are the bytes the process (all its threads) fetched from
+        and sent to storage so far, page cache hits excluded, plus those
+        of the children it has already waited for.  Children it hasn't
+        waited for, and grandchildren left to init, aren't included.
+        """
+        io = {}
+        try:
+            fh = open('/proc/%d/io' % pid)
+            try:
+                for line in fh:
+                    key, value = line.split(':', 1)
+                    io[key] = int(value)
+            finally:
+                fh.close()
+        except (IOError, ValueError):
+            pass
+        return (io.get('read_bytes'), io.get('write_bytes'))
+
+    def _reap_process(self, process, nohang=False):
+        """A Popen.wait()/poll() replacement that also collects the
+        process' resource usage through os.wait4(), and the bytes it
+        read and wrote from /proc/PID/io, into self.command_stats.
+
+        Returns the return code, or None if nohang is set and process is
+        still running.
+        """
+        if process.returncode is not None:
+            return process.returncode
+        record = self._running_commands.get(process.pid)
+        if record is not None:
+            # /proc/PID is gone once the process is reaped, so sample it
+            # every time we check on the process, and keep the last
+            # sample.  That's exact if the process has already exited
+            # (polling, or a blocking wait after its pipes closed);
+            # otherwise whatever it does from here on is missed.
+            (read_bytes, write_bytes) = self._query_process_io(process.pid)
+            if read_bytes is not None:
+                record['read_bytes'] = read_bytes
+                record['write_bytes'] = write_bytes
+        if not hasattr(os, 'wait4'):
+            if nohang:
+                returncode = process.poll()
+            else:
+                returncode = process.wait()
+            rusage = None
+        else:
+            flags = 0
+            if nohang:
+                flags = os.WNOHANG
+            while True:
+                try:
+                    pid, status, rusage = os.wait4(process.pid, flags)
+                    break
+                except OSError, e:
+                    if e.errno == errno.EINTR:
+                        continue
+                    if e.errno != errno.ECHILD:
+                        raise
+                    # Someone else reaped it.
+                    pid, rusage = process.pid, None
+                    status = None
+                    break
+            if pid == 0:
+                return None
+            if status is None:
+                returncode = process.wait()
+            else:
+                process._handle_exitstatus(status)
+                returncode = process.returncode
+        if nohang and returncode is None:
+            return None
+        if record is not None:
+            self._running_commands.pop(process.pid, None)
+            self._add_command_stats(record, returncode, rusage)
+        return returncode
+
+    def _add_command_stats(self, record, returncode, rusage=None):
+        record['returncode'] = returncode
+        record['wall_time'] = time.time() - record.pop('start_time')
+        if not isinstance(record['command'], basestring):
+            record['command'] = subprocess.list2cmdline(record['command'])
+        if rusage is not None:
+            record['user_time'] = rusage.ru_utime
+            record['sys_time'] = rusage.ru_stime
+            record['max_rss'] = rusage.ru_maxrss
+        for key in ('user_time', 'sys_time', 'max_rss',
+                    'read_bytes', 'write_bytes'):
+            record.setdefault(key, None)
+        self.command_stats.append(record)
+        if self.event_log is not None:
+            self.event_log.add_event('command_end', **record)
+
+    def _query_output_pump(self, process, timeout=None, output_timeout=None,
+                           multiplexed=False, split_lines=True,
+                           interruptible=False):
+        if timeout is None:
+            timeout = self.config.get('command_timeout')
+        if output_timeout is None:
+            output_timeout = self.config.get('command_output_timeout')
+        return OutputPump(process, timeout=timeout,
+                          output_timeout=output_timeout,
+                          multiplexed=multiplexed, split_lines=split_lines,
+                          interruptible=interruptible)
+
+    def _pump_output(self, process, parser, command=None, timeout=None,
+                     output_timeout=None):
+        """Feed process' stdout and stderr to parser as it arrives, in
+        reads of up to 64 KiB, then wait for process to exit.  Unless
+        self.config['background_parsing'] is False, the parsing happens in
+        a ParserThread.  If the parser raises, process' group is killed
+        before the exception is passed on.
+
+        Returns the return code, or TIMEOUT_STATUS.
+        """
+        parser_thread = self._query_parser_thread()
+        pump = self._query_output_pump(process, timeout=timeout,
+                                       output_timeout=output_timeout,
+                                       split_lines=False,
+                                       interruptible=parser_thread is not None)
+        if parser_thread is not None:
+            parser_thread.on_error = pump.interrupt
+        try:
+            for chunk in pump:
+                for (timestamp, stream_name, data) in chunk:
+                    if parser_thread is not None:
+                        parser_thread.feed(parser, data, stream_name)
+                    else:
+                        parser.feed(data, stream_name)
+            if pump.interrupted:
+                # The parser raised; flush() re-raises it here.
+                parser_thread.flush()
+        except:
+            # E.g. SystemExit on a FATAL error_list match; don't leave the
+            # command running without us.
+            exc_info = sys.exc_info()
+            self._kill_process_group(process)
+            raise exc_info[0], exc_info[1], exc_info[2]
+        finally:
+            try:
+                self._close_parser_thread(parser_thread, command)
+            finally:
+                pump.close()
+        parser.finish()
+        return self._wait_for_process(process, command,
+                                      deadline=pump.query_deadline(),
+                                      timed_out=pump.timed_out,
+                                      pump=pump)
+
+    def _query_parser_thread(self):
+        if not self.config.get('background_parsing', True):
+            return None
+        return ParserThread(
+            max_chunks=self.config.get('parser_queue_size', 256)
+        )
+
+    def _close_parser_thread(self, parser_thread, command):
+        """Wait for parser_thread to finish, and report how far the
+        parsing fell behind.
+        """
+        if parser_thread is None:
+            return
+        parser_thread.close()
+        message = "Parser queue high-water mark: %d of %d chunks" % \
+                  (parser_thread.high_water_mark, parser_thread.max_chunks)
+        if parser_thread.num_full:
+            self.info("%s; output parsing held up %s %d times." % \
+                      (message, command, parser_thread.num_full))
+        else:
+            self.debug("%s." % message)
+
+    def _wait_for_process(self, process, command, deadline=None,
+                          timed_out=None, pump=None):
+        """Wait for process to exit, until deadline (a time.time() value)
+        if set.  If that passes, or a watchdog has already fired
+        (timed_out), kill the process group.
+
+        Returns the return code, or TIMEOUT_STATUS.
+        """
+        if not timed_out and deadline is not None:
+            while self._reap_process(process, nohang=True) is None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    timed_out = 'timeout'
+                    break
+                time.sleep(min(remaining, 0.1))
+        if not timed_out:
+            return self._reap_process(process)
+        if timed_out == 'output_timeout':
+            self.error("No output for %d seconds from %s; killing it!" % \
+                       (pump.output_timeout, command))
+        else:
+            self.error("%s timed out; killing it!" % command)
+        self._kill_process_group(process)
+        return TIMEOUT_STATUS
+
+    def _kill_process_group(self, process, grace_period=None):
+        """Send SIGTERM to process' process group, then SIGKILL if it's
+        still around after grace_period seconds
+        (self.config['kill_grace_period'], default 10).
+        """
+        if grace_period is None:
+            grace_period = self.config.get('kill_grace_period', 10)
+        if os.name == 'nt':
+            if self._reap_process(process, nohang=True) is None:
+                process.kill()
+            self._reap_process(process)
+            return
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except OSError:
+            # The process group is already gone.
+            pass
+        end_time = time.time() + grace_period
+        while self._reap_process(process, nohang=True) is None and \
+              time.time() < end_time:
+            time.sleep(0.1)
+        # Take down the process if it ignored SIGTERM, along with anything
+        # still left in its group.
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self._reap_process(process)
 
     def get_output_from_command(self, command, cwd=None,
                                 halt_on_failure=False, env=None,
                                 silent=False, tmpfile_base_path='tmpfile',
                                 return_type='output', save_tmpfiles=False,
-                                throw_exception=False):
+                                throw_exception=False, capture_mode=None,
+                                max_output_bytes=None, output_overflow=None,
+                                keep_lines=100, timeout=None,
+                                output_timeout=None, cacheable=False):
         """Similar to run_command, but where run_command is an
         os.system(command) analog, get_output_from_command is a `command`
         analog.
@@ -408,10 +1683,34 @@ class ShellMixin(object):
         Less error checking by design, though if we figure out how to
         do it without borking the output, great.
 
+        capture_mode 'pipe' (the default, or self.config['output_capture_mode'])
+        reads stdout and stderr straight into memory, with no temporary
+        files, so it's safe to call from several threads in the same cwd.
+        capture_mode 'tmpfile' writes them to tmpfile_base_path_stdout and
+        tmpfile_base_path_stderr; that's always used if return_type isn't
+        'output' or save_tmpfiles is set, since the caller wants the files.
+
+        In pipe mode, max_output_bytes (or self.config['max_output_bytes'])
+        caps the memory used per stream.  Past the cap, output_overflow
+        'truncate' (the default) keeps the first and last keep_lines lines;
+        'spill' moves the output to a private temporary file instead,
+        though it all ends up in memory anyway, as the return value;
+        iter_output_lines() doesn't hold on to it at all.
+
+        timeout and output_timeout work as in run_command(); output_timeout
+        is only enforced in pipe mode.
+
+        If cacheable is set, command is a read-only query: its output is
+        saved in self.output_cache, and later calls with the same command,
+        cwd, env and silent (which changes the output) return it without
+        running anything, until a command that isn't cacheable runs, a
+        file helper changes something, or the next action starts.  Failed
+        commands aren't cached, and neither is anything but return_type
+        'output'.
+
         TODO: binary mode? silent is kinda like that.
         TODO: since p.wait() can take a long time, optionally log something
         every N seconds?
-        TODO: optionally only keep the first or last (N) line(s) of output?
         TODO: optionally only return the tmp_stdout_filename?
         """
         if cwd:
@@ -429,75 +1728,129 @@ class ShellMixin(object):
         if self.config.get('noop'):
             self.info("(Dry run; skipping)")
             return ''
-        tmp_stdout = None
-        tmp_stderr = None
-        tmp_stdout_filename = '%s_stdout' % tmpfile_base_path
-        tmp_stderr_filename = '%s_stderr' % tmpfile_base_path
+        if return_type != 'output':
+            cacheable = False
+        cache_kind = 'output'
+        if silent:
+            cache_kind = 'silent_output'
+        if cacheable:
+            try:
+                output = self.output_cache.get(command, cwd=cwd, env=env,
+                                               kind=cache_kind)
+                self.info("Using cached output.")
+                return output
+            except KeyError:
+                pass
+        if capture_mode is None:
+            capture_mode = self.config.get('output_capture_mode', 'pipe')
+        if return_type != 'output' or save_tmpfiles:
+            capture_mode = 'tmpfile'
+        if capture_mode == 'pipe':
+            if max_output_bytes is None:
+                max_output_bytes = self.config.get('max_output_bytes')
+            if output_overflow is None:
+                output_overflow = self.config.get('output_overflow', 'truncate')
+            buffers = {}
+            for stream_name in ('stdout', 'stderr'):
+                buffers[stream_name] = OutputBuffer(
+                    max_bytes=max_output_bytes, keep_lines=keep_lines,
+                    spill=(output_overflow == 'spill')
+                )
+            try:
+                p = self._start_process(command, cwd=cwd, env=env,
+                                        cacheable=cacheable)
+                pump = self._query_output_pump(p, timeout=timeout,
+                                               output_timeout=output_timeout)
+                for chunk in pump:
+                    for (timestamp, stream_name, line) in chunk:
+                        buffers[stream_name].add_line(line)
+                returncode = self._wait_for_process(
+                    p, command, deadline=pump.query_deadline(),
+                    timed_out=pump.timed_out, pump=pump
+                )
+                return_level, output = self._log_captured_output(
+                    returncode, buffers['stdout'], buffers['stderr'],
+                    silent=silent
+                )
+            finally:
+                for output_buffer in buffers.values():
+                    output_buffer.close()
+        else:
+            tmp_stdout = None
+            tmp_stderr = None
+            tmp_stdout_filename = '%s_stdout' % tmpfile_base_path
+            tmp_stderr_filename = '%s_stderr' % tmpfile_base_path
 
-        # TODO probably some more elegant solution than 2 similar passes
-        try:
-            tmp_stdout = open(tmp_stdout_filename, 'w')
-        except IOError:
-            level = ERROR
-            if halt_on_failure:
-                level = FATAL
-            self.log("Can't open %s for writing!" % tmp_stdout_filename + \
-                     self.dump_exception(), level=level)
-            return -1
-        try:
-            tmp_stderr = open(tmp_stderr_filename, 'w')
-        except IOError:
-            level = ERROR
-            if halt_on_failure:
-                level = FATAL
-            self.log("Can't open %s for writing!" % tmp_stderr_filename + \
-                     self.dump_exception(), level=level)
-            return -1
-        shell = True
-        if isinstance(command, list):
-            shell = False
-        p = subprocess.Popen(command, shell=shell, stdout=tmp_stdout,
-                             cwd=cwd, stderr=tmp_stderr, env=env)
-        self.debug("Temporary files: %s and %s" % (tmp_stdout_filename, tmp_stderr_filename))
-        p.wait()
-        tmp_stdout.close()
-        tmp_stderr.close()
-        return_level = DEBUG
-        output = None
-        if os.path.exists(tmp_stdout_filename) and os.path.getsize(tmp_stdout_filename):
-            output = self.read_from_file(tmp_stdout_filename,
-                                         verbose=False)
-            if not silent:
-                self.info("Output received:")
-                output_lines = output.rstrip().splitlines()
-                for line in output_lines:
+            # TODO probably some more elegant solution than 2 similar passes
+            try:
+                tmp_stdout = open(tmp_stdout_filename, 'w')
+            except IOError:
+                level = ERROR
+                if halt_on_failure:
+                    level = FATAL
+                self.log("Can't open %s for writing!" % tmp_stdout_filename + \
+                         self.dump_exception(), level=level)
+                return -1
+            try:
+                tmp_stderr = open(tmp_stderr_filename, 'w')
+            except IOError:
+                level = ERROR
+                if halt_on_failure:
+                    level = FATAL
+                self.log("Can't open %s for writing!" % tmp_stderr_filename + \
+                         self.dump_exception(), level=level)
+                return -1
+            p = self._start_process(command, cwd=cwd, env=env,
+                                    stdout=tmp_stdout, stderr=tmp_stderr,
+                                    cacheable=cacheable)
+            self.debug("Temporary files: %s and %s", tmp_stdout_filename, tmp_stderr_filename)
+            if timeout is None:
+                timeout = self.config.get('command_timeout')
+            deadline = None
+            if timeout is not None:
+                deadline = time.time() + timeout
+            returncode = self._wait_for_process(p, command, deadline=deadline)
+            tmp_stdout.close()
+            tmp_stderr.close()
+            return_level = DEBUG
+            output = None
+            if os.path.exists(tmp_stdout_filename) and os.path.getsize(tmp_stdout_filename):
+                output = self.read_from_file(tmp_stdout_filename,
+                                             verbose=False)
+                if not silent:
+                    self.info("Output received:")
+                    output_lines = output.rstrip().splitlines()
+                    for line in output_lines:
+                        if not line or line.isspace():
+                            continue
+                        line = line.decode("utf-8")
+                        self.info(' %s', line)
+                    output = '\n'.join(output_lines)
+            if os.path.exists(tmp_stderr_filename) and os.path.getsize(tmp_stderr_filename):
+                return_level = ERROR
+                self.error("Errors received:")
+                errors = self.read_from_file(tmp_stderr_filename,
+                                             verbose=False)
+                for line in errors.rstrip().splitlines():
                     if not line or line.isspace():
                         continue
                     line = line.decode("utf-8")
-                    self.info(' %s' % line)
-                output = '\n'.join(output_lines)
-        if os.path.exists(tmp_stderr_filename) and os.path.getsize(tmp_stderr_filename):
-            return_level = ERROR
-            self.error("Errors received:")
-            errors = self.read_from_file(tmp_stderr_filename,
-                                         verbose=False)
-            for line in errors.rstrip().splitlines():
-                if not line or line.isspace():
-                    continue
-                line = line.decode("utf-8")
-                self.error(' %s' % line)
-        elif p.returncode:
-            return_level = ERROR
-        # Clean up.
-        if not save_tmpfiles:
-            self.rmtree(tmp_stderr_filename, log_level=DEBUG)
-            self.rmtree(tmp_stdout_filename, log_level=DEBUG)
-        if p.returncode and throw_exception:
-            raise subprocess.CalledProcessError(p.returncode, command)
-        self.log("Return code: %d" % p.returncode, level=return_level)
+                    self.error(' %s', line)
+            elif returncode:
+                return_level = ERROR
+            # Clean up.
+            if not save_tmpfiles:
+                self.rmtree(tmp_stderr_filename, log_level=DEBUG)
+                self.rmtree(tmp_stdout_filename, log_level=DEBUG)
+        if returncode and throw_exception:
+            raise subprocess.CalledProcessError(returncode, command)
+        self.log("Return code: %d" % returncode, level=return_level)
         if halt_on_failure and return_level == ERROR:
             self.fatal("Halting on failure while running %s" % command,
-                       exit_code=p.returncode)
+                       exit_code=returncode)
+        if cacheable and return_level != ERROR:
+            self.output_cache.set(command, output, cwd=cwd, env=env,
+                                  kind=cache_kind)
         # Hm, options on how to return this? I bet often we'll want
         # output_lines[0] with no newline.
         if return_type != 'output':
@@ -505,6 +1858,124 @@ class ShellMixin(object):
         else:
             return output
 
+    def iter_output_lines(self, command, cwd=None, env=None, silent=False,
+                          success_codes=None, timeout=None,
+                          output_timeout=None, cacheable=False):
+        """Like get_output_from_command(), but a generator that yields
+        each decoded line of stdout (without the trailing newline) as soon
+        as the child writes it.  stderr lines are logged as errors.
+
+        The consumer can stop iterating early; the child is then killed.
+        timeout and output_timeout work as in run_command(), and cacheable
+        as in get_output_from_command(); only output that was read to the
+        end is cached.
+        Raises subprocess.CalledProcessError once the output is exhausted
+        if the return code isn't in success_codes (default [0]), or
+        up front if cwd doesn't exist.
+        """
+        if success_codes is None:
+            success_codes = [0]
+        if cwd:
+            if not os.path.isdir(cwd):
+                self.error("Can't run command %s in non-existent directory %s!" % \
+                           (command, cwd))
+                raise subprocess.CalledProcessError(-1, command)
+            self.info("Getting output from command: %s in %s" % (command, cwd))
+        else:
+            self.info("Getting output from command: %s" % command)
+        if self.config.get('noop'):
+            self.info("(Dry run; skipping)")
+            return
+        if cacheable:
+            try:
+                lines = self.output_cache.get(command, cwd=cwd, env=env,
+                                              kind='lines')
+            except KeyError:
+                pass
+            else:
+                self.info("Using cached output.")
+                for line in lines:
+                    yield line
+                return
+        p = self._start_process(command, cwd=cwd, env=env,
+                                cacheable=cacheable)
+        returncode = None
+        lines = []
+        try:
+            pump = self._query_output_pump(p, timeout=timeout,
+                                           output_timeout=output_timeout)
+            for chunk in pump:
+                for (timestamp, stream_name, line) in chunk:
+                    line = line.rstrip('\r\n').decode('utf-8', 'replace')
+                    if stream_name == 'stderr':
+                        if line and not line.isspace():
+                            self.error(' %s', line)
+                        continue
+                    if not silent:
+                        self.info(' %s', line)
+                    if cacheable:
+                        lines.append(line)
+                    yield line
+            returncode = self._wait_for_process(
+                p, command, deadline=pump.query_deadline(),
+                timed_out=pump.timed_out, pump=pump
+            )
+        finally:
+            if returncode is None and \
+               self._reap_process(p, nohang=True) is None:
+                self.debug("Output no longer needed; killing %s", command)
+                self._kill_process_group(p)
+        return_level = DEBUG
+        if returncode not in success_codes:
+            return_level = ERROR
+        self.log("Return code: %d" % returncode, level=return_level)
+        if returncode not in success_codes:
+            raise subprocess.CalledProcessError(returncode, command)
+        if cacheable:
+            self.output_cache.set(command, lines, cwd=cwd, env=env,
+                                  kind='lines')
+
+    def _log_captured_output(self, returncode, stdout_buffer, stderr_buffer,
+                             silent=False):
+        """Log the output that get_output_from_command() captured in pipe
+        mode, the same way the tmpfile mode does.
+
+        Returns (return_level, output).
+        """
+        return_level = DEBUG
+        output = None
+        if stdout_buffer.num_bytes and silent:
+            output = stdout_buffer.getvalue()
+        elif stdout_buffer.num_bytes:
+            self.info("Output received:")
+            # Read a spilled buffer line by line, rather than through
+            # getvalue() and copies of that.
+            output_lines = []
+            for line in stdout_buffer:
+                output_lines.extend(line.splitlines())
+            # As output.rstrip() would.
+            while output_lines and not output_lines[-1].strip():
+                output_lines.pop()
+            if output_lines:
+                output_lines[-1] = output_lines[-1].rstrip()
+            for line in output_lines:
+                if not line or line.isspace():
+                    continue
+                line = line.decode("utf-8")
+                self.info(' %s', line)
+            output = '\n'.join(output_lines)
+        if stderr_buffer.num_bytes:
+            return_level = ERROR
+            self.error("Errors received:")
+            for line in stderr_buffer:
+                line = line.rstrip()
+                if not line or line.isspace():
+                    continue
+                line = line.decode("utf-8")
+                self.error(' %s', line)
+        elif returncode:
+            return_level = ERROR
+        return (return_level, output)
 
 
 # BaseScript {{{1
@@ -524,7 +1995,24 @@ class BaseScript(ShellMixin, OSMixin, LogMixin, object):
         self.actions = tuple(rw_config.actions)
         self.all_actions = tuple(rw_config.all_actions)
         self.env = None
+        # The current action, locale etc.; see set_event_context().
+        self.event_context = {}
+        # The name of the current work item's log section, if any.
+        self.item_log_section = None
+        # For report_progress().
+        self.action_start_time = monotonic_time()
+        self.last_progress_time = None
         self.new_log_obj(default_log_level=default_log_level)
+        if self.config.get('event_log', True):
+            dirs = self.query_abs_dirs()
+            self.event_log = EventLog(
+                os.path.join(dirs['abs_log_dir'], 'log_events.jsonl'),
+                append=self.config.get('append_to_log', False)
+            )
+            self.event_log.context = self.event_context
+        # Stream the log with the same context.
+        if self.log_obj.stream_handler is not None:
+            self.log_obj.stream_handler.context = self.event_context
 
         # Set self.config to read-only.
         #
@@ -578,20 +2066,55 @@ class BaseScript(ShellMixin, OSMixin, LogMixin, object):
             else:
                 method_name = action.replace("-", "_")
                 self.action_message("Running %s step." % action)
+                self.current_action = action
+                event_context = dict(self.event_context)
+                if self.config.get('log_sections'):
+                    self.log_obj.start_log_section(action)
+                self.set_event_context(action=action)
+                self.action_start_time = monotonic_time()
+                self.last_progress_time = None
+                if self.event_log is not None:
+                    self.event_log.add_event('action_start')
+                # Query output is only trusted within an action.
+                self.output_cache.clear()
                 self._possibly_run_method("preflight_%s" % method_name)
                 self._possibly_run_method(method_name, error_if_missing=True)
                 self._possibly_run_method("postflight_%s" % method_name)
+                if self.event_log is not None:
+                    self.event_log.add_event(
+                        'action_end',
+                        duration=monotonic_time() - self.action_start_time
+                    )
+                self._end_item_log_section()
+                if self.config.get('log_sections'):
+                    self.log_obj.end_log_section()
+                # Anything set during the action was only for it.
+                # (In place, as the event log and the log's
+                # stream_handler share it.)
+                self.event_context.clear()
+                self.event_context.update(event_context)
+                self.current_action = None
         self.summary()
+        self.dump_command_stats()
         dirs = self.query_abs_dirs()
         self.info("Copying logs to upload dir...")
-        log_files = ['localconfig.json']
-        for log_name in self.log_obj.log_files.keys():
-            log_files.append(self.log_obj.log_files[log_name])
+        self.log_obj.generate_logs()
+        log_files = ['localconfig.json', 'command_stats.json']
+        if self.event_log is not None:
+            log_files.append(os.path.basename(self.event_log.path))
         for log_file in log_files:
             self.copy_to_upload_dir(os.path.join(dirs['abs_log_dir'], log_file),
                                     dest=os.path.join('logs', log_file),
-                                    short_desc='%s log' % log_name,
-                                    long_desc='%s log' % log_name)
+                                    short_desc='%s log' % log_file,
+                                    long_desc='%s log' % log_file)
+        # Last, without logging in between, so that gzipped logs are
+        # copied complete.  They're copied as they are, segment by
+        # segment, and log sections go to logs/sections/.
+        log_files = self.log_obj.copy_log_files(
+            os.path.join(dirs['abs_upload_dir'], 'logs')
+        )
+        self.info("Copied %d log files to %s.", len(log_files),
+                  os.path.join(dirs['abs_upload_dir'], 'logs'))
         sys.exit(self.return_code)
 
     def clobber(self):
@@ -624,6 +2147,43 @@ class BaseScript(ShellMixin, OSMixin, LogMixin, object):
         fh.close()
         self.info(pprint.pformat(self.config))
 
+    def dump_command_stats(self, file_path=None):
+        """Dump the resource usage of every command we ran to
+        command_stats.json, next to localconfig.json.
+        """
+        dirs = self.query_abs_dirs()
+        if not file_path:
+            file_path = os.path.join(dirs['abs_log_dir'], "command_stats.json")
+        self.info("Dumping command stats to %s." % file_path)
+        self.mkdir_p(os.path.dirname(file_path))
+        fh = open(file_path, 'w')
+        json.dump(self.command_stats, fh, sort_keys=True, indent=4)
+        fh.close()
+
+    def summarize_command_stats(self, num_commands=None):
+        """Log the num_commands (self.config['command_stats_top'], default
+        10) commands that took the longest.
+        """
+        if not self.command_stats:
+            return
+        if num_commands is None:
+            num_commands = self.config.get('command_stats_top', 10)
+        stats = sorted(self.command_stats, key=lambda r: r['wall_time'],
+                       reverse=True)[:num_commands]
+        self.info("Top %d commands by wall time:" % len(stats))
+        for record in stats:
+            message = " %.1fs wall" % record['wall_time']
+            if record['user_time'] is not None:
+                message += ", %.1fs user, %.1fs sys, %d maxrss" % (
+                    record['user_time'], record['sys_time'], record['max_rss'])
+            if record['read_bytes'] is not None:
+                message += ", %d bytes read, %d bytes written" % (
+                    record['read_bytes'], record['write_bytes'])
+            if record['action']:
+                message += " [%s]" % record['action']
+            message += ": %s" % record['command']
+            self.info(message)
+
     # logging {{{2
     def new_log_obj(self, default_log_level="info"):
         dirs = self.query_abs_dirs()
@@ -634,10 +2194,18 @@ class BaseScript(ShellMixin, OSMixin, LogMixin, object):
                       "log_format": '%(asctime)s %(levelname)8s - %(message)s',
                       "log_to_console": True,
                       "append_to_log": False,
+                      "async_logging": False,
+                      "gzip_logs": False,
+                      "log_max_bytes": None,
+                      "log_backup_count": 9,
+                      "log_stream": None,
+                      "log_stream_job": None,
+                      "console_summary": False,
                      }
         log_type = self.config.get("log_type", "multi")
         if log_type == "multi":
             log_config['logger_name'] = 'Multi'
+            log_config['write_once_log'] = False
         for key in log_config.keys():
             value = self.config.get(key, None)
             if value is not None:
@@ -648,23 +2216,91 @@ class BaseScript(ShellMixin, OSMixin, LogMixin, object):
             self.log_obj = SimpleFileLogger(**log_config)
 
     def action_message(self, message):
-        self.info("#####")
-        self.info("##### %s" % message)
-        self.info("#####")
+        self.log("#####", console=True)
+        self.log("##### %s", message, console=True)
+        self.log("#####", console=True)
+
+    def report_progress(self, num_done, num_total, item_name='items'):
+        """Log progress through the current action's work items, e.g.
+        "repack 37/84 locales, 12m elapsed".  In console_summary mode,
+        this goes to the console at most every console_progress_interval
+        seconds (60 by default), and once everything is done.
+        """
+        now = monotonic_time()
+        console = False
+        if num_done >= num_total or self.last_progress_time is None or \
+           now - self.last_progress_time >= \
+           self.config.get('console_progress_interval', 60):
+            console = True
+            self.last_progress_time = now
+        elapsed = int(now - self.action_start_time)
+        if elapsed >= 3600:
+            elapsed_str = "%dh%02dm" % (elapsed / 3600, elapsed % 3600 / 60)
+        elif elapsed >= 60:
+            elapsed_str = "%dm" % (elapsed / 60)
+        else:
+            elapsed_str = "%ds" % elapsed
+        self.log("%s %d/%d %s, %s elapsed", self.current_action or
+                 self.__class__.__name__, num_done, num_total, item_name,
+                 elapsed_str, console=console)
 
     def summary(self):
         self.action_message("%s summary:" % self.__class__.__name__)
         if self.summary_list:
             for item in self.summary_list:
                 try:
-                    self.log(item['message'], level=item['level'])
+                    self.log(item['message'], level=item['level'],
+                             console=True)
                 except ValueError:
                     """log is closed; print as a default. Ran into this
                     when calling from __del__()"""
                     print "### Log is closed! (%s)" % item['message']
+        self.summarize_command_stats()
+        if self.output_cache.hits or self.output_cache.misses:
+            self.info("Output cache: %d hits, %d misses." % (
+                self.output_cache.hits, self.output_cache.misses))
+
+    def set_event_context(self, **kwargs):
+        """Add kwargs (e.g. locale='de') to the context of the events
+        (and streamed log records; see StreamingHandler) that follow,
+        until the end of the current action, if any.
+        A value of None removes that key.
+
+        With log_item_sections, each work item within an action, i.e.
+        each context besides the action (e.g. platform and locale), gets
+        a log section of its own; see BaseLogger.start_log_section().
+        """
+        for key, value in kwargs.items():
+            if value is None:
+                self.event_context.pop(key, None)
+            else:
+                self.event_context[key] = value
+        if not self.config.get('log_item_sections') or \
+           not self.current_action:
+            return
+        item = ['%s' % self.event_context[key]
+                for key in sorted(self.event_context.keys())
+                if key != 'action']
+        if item:
+            item_name = '%s-%s' % (self.current_action, '-'.join(item))
+        else:
+            item_name = None
+        if item_name == self.item_log_section:
+            return
+        self._end_item_log_section()
+        if item_name is not None:
+            self.log_obj.start_log_section(item_name)
+            self.item_log_section = item_name
+
+    def _end_item_log_section(self):
+        if self.item_log_section is not None:
+            self.log_obj.end_log_section()
+            self.item_log_section = None
 
     def add_summary(self, message, level=INFO):
         self.summary_list.append({'message': message, 'level': level})
+        if self.event_log is not None:
+            self.event_log.add_event('summary', message=message, level=level)
         # TODO write to a summary-only log?
         # Summaries need a lot more love.
         self.log(message, level=level)
@@ -673,6 +2309,8 @@ class BaseScript(ShellMixin, OSMixin, LogMixin, object):
         if key not in self.failures:
             self.failures.append(key)
             self.return_code += 1
+            if self.event_log is not None:
+                self.event_log.add_event('failure', key=key)
             self.add_summary(message % {'key': key}, level=level)
 
     def query_failure(self, key):
@@ -11,10 +11,10 @@ import getpass
 import hashlib
 import os
 import re
-import subprocess
 
 from mozharness.base.errors import JarsignerErrorList, ZipErrorList, ZipalignErrorList
 from mozharness.base.log import OutputParser, IGNORE, DEBUG, INFO, ERROR, FATAL
+from mozharness.base.script import TIMEOUT_STATUS
 
 UnsignApkErrorList = [{
     'regex': re.compile(r'''zip warning: name not matched: '?META-INF/'''),
@@ -116,12 +116,11 @@ class AndroidSigningMixin(object):
         # suppress_command_echo=True or something?)
         self.log("(signing %s)" % apk, level=log_level)
         try:
-            p = subprocess.Popen([jarsigner, "-keystore", keystore,
-                                 "-storepass", storepass,
-                                 "-keypass", keypass,
-                                 apk, key_alias],
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.STDOUT)
+            p = self._start_process([jarsigner, "-keystore", keystore,
+                                     "-storepass", storepass,
+                                     "-keypass", keypass,
+                                     apk, key_alias],
+                                    secret_args=[storepass, keypass])
         except OSError:
             self.dump_exception("Error while signing %s (missing %s?):" % (apk, jarsigner))
             return -2
@@ -129,14 +128,10 @@ class AndroidSigningMixin(object):
             self.dump_exception("Popen called with invalid arguments during signing?")
             return -3
         parser = OutputParser(config=self.config, log_obj=self.log_obj,
-                              error_list=error_list)
-        loop = True
-        while loop:
-            if p.poll() is not None:
-                """Avoid losing the final lines of the log?"""
-                loop = False
-            for line in p.stdout:
-                parser.add_lines(line)
+                              error_list=error_list,
+                              event_log=self.event_log)
+        if self._pump_output(p, parser, command="jarsigner") == TIMEOUT_STATUS:
+            parser.num_errors += 1
         if parser.num_errors:
             self.log("(failure)", level=error_level)
         else:
@@ -150,17 +145,46 @@ class AndroidSigningMixin(object):
                                 success_codes=[0, 12],
                                 return_type='num_errors', **kwargs)
 
+    def _query_align_apk_command(self, unaligned_apk, aligned_apk):
+        zipalign = self.query_exe("zipalign")
+        return [zipalign, '-f', '4', unaligned_apk, aligned_apk]
+
     def align_apk(self, unaligned_apk, aligned_apk, error_level=ERROR):
         """
         Zipalign apk.
         Returns None on success, not None on failure.
         """
         dirs = self.query_abs_dirs()
-        zipalign = self.query_exe("zipalign")
-        if self.run_command([zipalign, '-f', '4',
-                             unaligned_apk, aligned_apk],
+        if self.run_command(self._query_align_apk_command(unaligned_apk,
+                                                          aligned_apk),
                             return_type='num_errors',
                             cwd=dirs['abs_work_dir'],
                             error_list=ZipalignErrorList):
             self.log("Unable to zipalign %s to %s!" % (unaligned_apk, aligned_apk), level=error_level)
             return -1
+
+    def align_apks(self, apk_list, error_level=ERROR, max_workers=None):
+        """
+        Zipalign a list of (unaligned_apk, aligned_apk) tuples in parallel.
+        Returns a list with None for each success, not None for each
+        failure, in the same order as apk_list.
+        """
+        dirs = self.query_abs_dirs()
+        jobs = []
+        for unaligned_apk, aligned_apk in apk_list:
+            jobs.append({
+                'command': self._query_align_apk_command(unaligned_apk,
+                                                         aligned_apk),
+                'cwd': dirs['abs_work_dir'],
+                'error_list': ZipalignErrorList,
+                'name': os.path.basename(os.path.dirname(aligned_apk)),
+            })
+        statuses = []
+        results = self.run_commands_parallel(jobs, max_workers=max_workers)
+        for (unaligned_apk, aligned_apk), result in zip(apk_list, results):
+            if result['num_errors'] or result['return_code']:
+                self.log("Unable to zipalign %s to %s!" % (unaligned_apk, aligned_apk), level=error_level)
+                statuses.append(-1)
+            else:
+                statuses.append(None)
+        return statuses
@@ -94,24 +94,28 @@ class MercurialVCS(ShellMixin, OSMixin, LogMixin, object):
     def get_revision_from_path(self, path):
         """Returns which revision directory `path` currently has checked out."""
         return self.get_output_from_command(
-            self.hg + ['parent', '--template', '{node|short}'], cwd=path
+            self.hg + ['parent', '--template', '{node|short}'], cwd=path,
+            cacheable=True
         )
 
     def get_branch_from_path(self, path):
-        branch = self.get_output_from_command(self.hg + ['branch'], cwd=path)
+        branch = self.get_output_from_command(self.hg + ['branch'], cwd=path,
+                                              cacheable=True)
         return str(branch).strip()
 
     def get_branches_from_path(self, path):
         branches = []
-        for line in self.get_output_from_command(self.hg + ['branches', '-c'],
-                                                 cwd=path).splitlines():
-            branches.append(line.split()[0])
+        for line in self.iter_output_lines(self.hg + ['branches', '-c'],
+                                           cwd=path, cacheable=True):
+            if line.strip():
+                branches.append(line.split()[0])
         return branches
 
     def hg_ver(self):
         """Returns the current version of hg, as a tuple of
         (major, minor, build)"""
-        ver_string = self.get_output_from_command(self.hg + ['-q', 'version'])
+        ver_string = self.get_output_from_command(self.hg + ['-q', 'version'],
+                                                  cacheable=True)
         match = re.search("\(version ([0-9.]+)\)", ver_string)
         if match:
             bits = match.group(1).split(".")
@@ -259,7 +263,9 @@ class MercurialVCS(ShellMixin, OSMixin, LogMixin, object):
         if os.path.exists(src):
             try:
                 revs = []
-                for line in self.get_output_from_command(cmd, cwd=src, throw_exception=True).rstrip().split("\n"):
+                for line in self.iter_output_lines(cmd, cwd=src):
+                    if not line.strip():
+                        continue
                     try:
                         rev, branch = line.split()
                     # Mercurial displays no branch at all if the revision
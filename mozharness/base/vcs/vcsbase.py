@@ -48,6 +48,12 @@ class VCSMixin(object):
          config=self.config,
          vcs_config=kwargs,
         )
+        # Account for the vcs commands in our command stats, and share
+        # our query output cache and event log.
+        vcs_obj.command_stats = self.command_stats
+        vcs_obj.current_action = self.current_action
+        vcs_obj.output_cache = self.output_cache
+        vcs_obj.event_log = self.event_log
         got_revision = vcs_obj.ensure_repo_and_revision()
         if got_revision:
             return got_revision
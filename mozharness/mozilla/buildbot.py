@@ -60,6 +60,9 @@ class BuildbotMixin(object):
     def set_buildbot_property(self, prop_name, prop_value, write_to_file=False):
         self.info("Setting buildbot property %s to %s" % (prop_name, prop_value))
         self.buildbot_properties[prop_name] = prop_value
+        if getattr(self, 'event_log', None) is not None:
+            self.event_log.add_event('buildbot_property', name=prop_name,
+                                     value=prop_value)
         if write_to_file:
             return self.dump_buildbot_properties(prop_list=[prop_name], file_name=prop_name)
         return self.buildbot_properties[prop_name]
@@ -46,21 +46,21 @@ class LocalesMixin(ChunkingMixin):
                 self.fatal("No way to determine locales!")
         for locale in ignore_locales:
             if locale in locales:
-                self.debug("Ignoring locale %s." % locale)
+                self.debug("Ignoring locale %s.", locale)
                 locales.remove(locale)
         for locale in additional_locales:
             if locale not in locales:
-                self.debug("Adding locale %s." % locale)
+                self.debug("Adding locale %s.", locale)
                 locales.append(locale)
         if locales is None:
             return
         if 'total_locale_chunks' and 'this_locale_chunk' in c:
-            self.debug("Pre-chunking locale list: %s" % str(locales))
+            self.debug("Pre-chunking locale list: %s", locales)
             locales = self.query_chunked_list(locales,
                                               c['this_locale_chunk'],
                                               c['total_locale_chunks'],
                                               sort=True)
-            self.debug("Post-chunking locale list: %s" % locales)
+            self.debug("Post-chunking locale list: %s", locales)
         self.locales = locales
         return self.locales
 
@@ -187,6 +187,8 @@ class MultiLocaleBuild(LocalesMixin, MercurialScript):
             # This is for Maemo, where we don't want an env for builds
             # but we do for packaging.  self.query_env() will return None.
             env = os.environ.copy()
+        else:
+            env = env.copy()
         if package_type == 'multi':
             command += " AB_CD=multi"
             env['MOZ_CHROME_MULTILOCALE'] = "en-US " + \
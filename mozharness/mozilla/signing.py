@@ -97,16 +97,45 @@ class MobileSigningMixin(AndroidSigningMixin, SigningMixin):
         This currently doesn't check to see if the apk exists; you may want
         to do that before calling the method.
         """
+        return self.run_command(
+            **self._query_android_signature_verification_job(
+                apk, script=script, key_alias=key_alias,
+                tools_dir=tools_dir, env=env
+            )
+        )
+
+    def verify_android_signatures(self, apk_list, script=None,
+                                  key_alias="nightly", tools_dir="tools/",
+                                  env=None, max_workers=None):
+        """Runs verify_android_signature() on each apk in apk_list, in
+        parallel.
+        Returns a list of return codes, in the same order as apk_list.
+        """
+        jobs = []
+        for apk in apk_list:
+            job = self._query_android_signature_verification_job(
+                apk, script=script, key_alias=key_alias,
+                tools_dir=tools_dir, env=env
+            )
+            job['name'] = apk
+            jobs.append(job)
+        results = self.run_commands_parallel(jobs, max_workers=max_workers)
+        return [result['return_code'] for result in results]
+
+    def _query_android_signature_verification_job(self, apk, script=None,
+                                                  key_alias="nightly",
+                                                  tools_dir="tools/",
+                                                  env=None):
         c = self.config
         dirs = self.query_abs_dirs()
         if script is None:
             script = c.get('signature_verification_script')
         if env is None:
             env = self.query_env()
-        return self.run_command(
-            [script, "--tools-dir=%s" % tools_dir, "--%s" % key_alias,
-             "--apk=%s" % apk],
-            cwd=dirs['abs_work_dir'],
-            env=env,
-            error_list=AndroidSignatureVerificationErrorList
-        )
+        return {
+            'command': [script, "--tools-dir=%s" % tools_dir,
+                        "--%s" % key_alias, "--apk=%s" % apk],
+            'cwd': dirs['abs_work_dir'],
+            'env': env,
+            'error_list': AndroidSignatureVerificationErrorList,
+        }
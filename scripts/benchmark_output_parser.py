@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""benchmark_output_parser.py
+
+Measure how fast OutputParser.add_lines() gets through synthetic logs for
+each of the error lists in mozharness.base.errors, at several densities of
+matching lines, and under several kinds of logging.  The results are
+written as json, so runs against different revisions can be compared with
+--baseline-file.
+"""
+
+import gc
+import os
+import platform
+import random
+import sys
+import time
+try:
+    import simplejson as json
+except ImportError:
+    import json
+try:
+    import resource
+except ImportError:
+    resource = None
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+sys.path.insert(1, os.path.dirname(sys.path[0]))
+
+import mozharness.base.errors as errors
+from mozharness.base.log import OutputParser, SimpleFileLogger, \
+                                MultiFileLogger, CRITICAL, FATAL
+from mozharness.base.script import BaseScript
+
+# Synthetic logs {{{1
+# For each error list, lines that shouldn't match anything, and lines that
+# should.  %(num)d is replaced with the line number, to keep the lines
+# from all being identical.
+SYNTHETIC_LOGS = {
+ 'BaseErrorList': ([
+  "Running command: ['./configure', '--enable-application=mobile/android'] (%(num)d)",
+  "checking for a BSD-compatible install... /usr/bin/install -c",
+  "creating objdir-%(num)d/config.status",
+ ], [
+  "/bin/sh: line %(num)d: autoconf-2.13: command not found",
+ ]),
+ 'SSHErrorList': ([
+  "sending incremental file list",
+  "dist/fennec-%(num)d.en-US.android-arm.apk",
+  "sent %(num)d bytes  received 31 bytes  1862.00 bytes/sec",
+  "total size is 21857483  speedup is 1.00",
+ ], [
+  "ssh: Could not resolve hostname stage-%(num)d.mozilla.org: Name or service not known",
+  "rsync error: unexplained error (code 255) at io.c(%(num)d) [sender=3.0.6]",
+  "Permission denied: /pub/mozilla.org/mobile/%(num)d",
+  "Warning: Identity file /home/cltbld/.ssh/ffxbld_dsa not accessible",
+ ]),
+ 'HgErrorList': ([
+  "requesting all changes",
+  "adding changesets",
+  "added %(num)d changesets with 9 changes to 7 files",
+  "updating to branch default",
+  "%(num)d files updated, 0 files merged, 0 files removed, 0 files unresolved",
+ ], [
+  "abort: HTTP Error 500: Internal Server Error (%(num)d)",
+  "** unknown exception encountered, please report by visiting",
+  "*** failed to import extension share: No module named share",
+ ]),
+ 'PythonErrorList': ([
+  "INFO - Running test %(num)d: test_startup.py",
+  "  File \"runtests.py\", line %(num)d, in run_tests",
+  "TEST-PASS | test_startup.py | %(num)d assertions passed",
+ ], [
+  "Traceback (most recent call last):",
+  "TypeError: unsupported operand type(s) for +: 'int' and 'str' (%(num)d)",
+  "NameError: global name 'options_%(num)d' is not defined",
+  "    raise RuntimeError: lost the connection at line %(num)d",
+ ]),
+ 'VirtualenvErrorList': ([
+  "Downloading/unpacking simplejson (from -r requirements.txt (line %(num)d))",
+  "  Running setup.py egg_info for package simplejson",
+  "Successfully installed simplejson mozinfo",
+ ], [
+  "simplejson/_speedups.c:%(num)d: error: Python.h: No such file or directory",
+  "simplejson/_speedups.c:%(num)d: warning: implicit declaration of function",
+  "Traceback (most recent call last):",
+ ]),
+ 'MakefileErrorList': ([
+  "make[%(num)d]: Entering directory `/builds/mozilla-central/objdir/xpcom'",
+  "c++ -o nsThread.o -c -fvisibility=hidden -DMOZILLA_INTERNAL_API -I. nsThread.cpp",
+  "nsThread.cpp: In member function 'nsresult nsThread::Init()':",
+  "make[%(num)d]: Leaving directory `/builds/mozilla-central/objdir/xpcom'",
+ ], [
+  "nsThread.cpp:%(num)d: error: 'mThread' was not declared in this scope",
+  "nsThread.cpp:%(num)d: warning: unused variable 'rv'",
+  "make[%(num)d]: *** [nsThread.o] Error 1",
+  "make: *** No rule to make target `libs_%(num)d'.  Stop.",
+ ]),
+ 'JarsignerErrorList': ([
+  "   adding: META-INF/MANIFEST.MF",
+  "   signing: res/drawable/icon_%(num)d.png",
+  "  updating: classes.dex",
+ ], [
+  "jarsigner: unable to open jar file: fennec-%(num)d.apk",
+  "jarsigner: key associated with nightly-%(num)d not a private key",
+ ]),
+ 'ZipErrorList': ([
+  "  adding: assets/omni-%(num)d.ja (deflated 61%%)",
+  "  adding: lib/armeabi-v7a/libmozglue.so (deflated 53%%)",
+ ], [
+  "zip warning: name not matched: omni-%(num)d.ja",
+  "zip error: Nothing to do! (fennec-%(num)d.apk)",
+ ]),
+ 'ZipalignErrorList': ([
+  "Verifying alignment of fennec-%(num)d.apk (4)...",
+  "      50 META-INF/MANIFEST.MF (OK - compressed)",
+  "Verification succesful",
+ ], [
+  "Unable to open 'fennec-%(num)d.apk' as a zip archive",
+  "Output file 'fennec-%(num)d.apk' exists",
+ ]),
+}
+
+LOGGERS = ('console-off', 'file-only', 'multi-file')
+
+
+def generate_log(error_list_name, num_lines, match_density, seed=0):
+    """Return num_lines lines of synthetic output for error_list_name,
+    about match_density of them matching the error list.
+    """
+    rng = random.Random(seed)
+    noise, matches = SYNTHETIC_LOGS[error_list_name]
+    lines = []
+    for num in range(num_lines):
+        if rng.random() < match_density:
+            template = rng.choice(matches)
+        else:
+            template = rng.choice(noise)
+        lines.append(template % {'num': num} + '\n')
+    return lines
+
+
+# BenchmarkOutputParser {{{1
+class BenchmarkOutputParser(BaseScript):
+    config_options = [[
+     ["--error-list",],
+     {"action": "extend",
+      "dest": "error_lists",
+      "help": "Specify the error lists to benchmark (default: all of them)"
+     }
+    ], [
+     ["--match-density",],
+     {"action": "extend",
+      "dest": "match_densities",
+      "help": "Specify the fractions of lines that match (default: 0,0.01,0.1)"
+     }
+    ], [
+     ["--logger",],
+     {"action": "extend",
+      "dest": "loggers",
+      "help": "Specify the logging to benchmark under: %s (default: all)" % \
+              ', '.join(LOGGERS)
+     }
+    ], [
+     ["--num-lines",],
+     {"action": "store",
+      "dest": "num_lines",
+      "type": "int",
+      "default": 100000,
+      "help": "Specify the number of lines per synthetic log"
+     }
+    ], [
+     ["--repeat",],
+     {"action": "store",
+      "dest": "repeat",
+      "type": "int",
+      "default": 3,
+      "help": "Specify how many times to run each benchmark; the fastest run counts"
+     }
+    ], [
+     ["--results-file",],
+     {"action": "store",
+      "dest": "results_file",
+      "type": "string",
+      "help": "Specify where to write the json results"
+     }
+    ], [
+     ["--baseline-file",],
+     {"action": "store",
+      "dest": "baseline_file",
+      "type": "string",
+      "help": "Specify the json results of an earlier run to compare against"
+     }
+    ]]
+
+    def __init__(self, require_config_file=False):
+        self.results = None
+        BaseScript.__init__(self, config_options=self.config_options,
+                            all_actions=['clobber',
+                                         'run-benchmarks',
+                                         'compare-results',
+                                         ],
+                            default_actions=['clobber',
+                                             'run-benchmarks',
+                                             'compare-results'],
+                            require_config_file=require_config_file)
+
+    def query_results_file(self):
+        if self.config.get('results_file'):
+            return os.path.abspath(self.config['results_file'])
+        dirs = self.query_abs_dirs()
+        return os.path.join(dirs['abs_work_dir'], 'benchmark_output_parser.json')
+
+    def query_error_list(self, error_list_name):
+        """FATAL matches exit, so benchmark them as CRITICAL; the cost of
+        matching is the same.
+        """
+        error_list = []
+        for error_check in getattr(errors, error_list_name):
+            if error_check.get('level') == FATAL:
+                error_check = dict(error_check, level=CRITICAL)
+            error_list.append(error_check)
+        return error_list
+
+    def _query_parser(self, error_list, logger_type, log_dir):
+        if logger_type == 'console-off':
+            return OutputParser(config={'log_to_console': False},
+                                error_list=error_list), None
+        log_config = {'log_dir': log_dir,
+                      'log_name': 'benchmark',
+                      'log_to_console': False,
+                      'logger_name': 'Benchmark-%s' % logger_type,
+                     }
+        if logger_type == 'file-only':
+            log_obj = SimpleFileLogger(**log_config)
+        elif logger_type == 'multi-file':
+            log_obj = MultiFileLogger(**log_config)
+        else:
+            self.fatal("Unknown --logger %s!  Choose from %s." % \
+                       (logger_type, ', '.join(LOGGERS)))
+        return OutputParser(config=self.config, log_obj=log_obj,
+                            error_list=error_list), log_obj
+
+    def _close_logger(self, log_obj):
+        if log_obj is None:
+            return
+        for handler in log_obj.all_handlers:
+            handler.close()
+        log_obj._clear_handlers()
+
+    def benchmark(self, error_list_name, lines, logger_type, log_dir):
+        """Parse lines with a fresh OutputParser self.config['repeat']
+        times, and return the numbers for the fastest run.
+        """
+        error_list = self.query_error_list(error_list_name)
+        best = None
+        for run in range(max(self.config['repeat'], 1)):
+            parser, log_obj = self._query_parser(error_list, logger_type,
+                                                 log_dir)
+            gc.collect()
+            num_objects = len(gc.get_objects())
+            if tracemalloc is not None:
+                tracemalloc.start()
+            start_time = time.time()
+            for i in range(0, len(lines), 256):
+                parser.add_lines(lines[i:i + 256])
+            parser.finish()
+            elapsed = time.time() - start_time
+            result = {'seconds': elapsed,
+                      'num_matches': sum(parser.level_counts.values()),
+                      'retained_objects': len(gc.get_objects()) - num_objects,
+                     }
+            if tracemalloc is not None:
+                result['peak_allocated_bytes'] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            self._close_logger(log_obj)
+            if best is None or elapsed < best['seconds']:
+                best = result
+        best['lines_per_second'] = len(lines) / max(best['seconds'], 1e-9)
+        return best
+
+    def run_benchmarks(self):
+        c = self.config
+        dirs = self.query_abs_dirs()
+        error_list_names = c.get('error_lists') or sorted(SYNTHETIC_LOGS.keys())
+        match_densities = [float(d) for d in
+                           c.get('match_densities') or (0, 0.01, 0.1)]
+        loggers = c.get('loggers') or LOGGERS
+        log_dir = os.path.join(dirs['abs_work_dir'], 'benchmark_logs')
+        benchmarks = []
+        for error_list_name in error_list_names:
+            if error_list_name not in SYNTHETIC_LOGS:
+                self.fatal("No synthetic log for --error-list %s!  Choose from %s." % \
+                           (error_list_name, ', '.join(sorted(SYNTHETIC_LOGS.keys()))))
+            for match_density in match_densities:
+                lines = generate_log(error_list_name, c['num_lines'],
+                                     match_density)
+                for logger_type in loggers:
+                    result = self.benchmark(error_list_name, lines,
+                                            logger_type,
+                                            os.path.join(log_dir, logger_type))
+                    result.update({'error_list': error_list_name,
+                                   'match_density': match_density,
+                                   'logger': logger_type,
+                                   'num_lines': len(lines),
+                                  })
+                    self.info("%(error_list)s, %(match_density)s match density, %(logger)s: %(lines_per_second)d lines/sec" % result)
+                    benchmarks.append(result)
+        self.rmtree(log_dir)
+        self.results = {'python': sys.version.split()[0],
+                        'platform': platform.platform(),
+                        'time': time.strftime("%Y%m%d %H:%M:%S"),
+                        'benchmarks': benchmarks,
+                       }
+        if resource is not None:
+            self.results['max_rss'] = \
+              resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        results_file = self.query_results_file()
+        self.mkdir_p(os.path.dirname(results_file))
+        self.write_to_file(results_file,
+                           json.dumps(self.results, indent=2, sort_keys=True),
+                           verbose=False)
+        self.info("Wrote %s." % results_file)
+
+    def compare_results(self):
+        c = self.config
+        if not c.get('baseline_file'):
+            self.info("No --baseline-file; nothing to compare against.")
+            return
+        if self.results is None:
+            contents = self.read_from_file(self.query_results_file(),
+                                           verbose=False)
+            if contents is None:
+                self.fatal("Can't read %s; run the run-benchmarks action first." % \
+                           self.query_results_file())
+            self.results = json.loads(contents)
+        contents = self.read_from_file(c['baseline_file'], verbose=False)
+        if contents is None:
+            self.fatal("Can't read --baseline-file %s!" % c['baseline_file'])
+        baseline = {}
+        for result in json.loads(contents)['benchmarks']:
+            key = (result['error_list'], result['match_density'],
+                   result['logger'])
+            baseline[key] = result
+        for result in self.results['benchmarks']:
+            key = (result['error_list'], result['match_density'],
+                   result['logger'])
+            if key not in baseline:
+                continue
+            ratio = result['lines_per_second'] / \
+                    max(baseline[key]['lines_per_second'], 1e-9)
+            message = "%s, %s match density, %s: %.2fx baseline" % \
+                      (key + (ratio,))
+            if ratio < 0.9:
+                self.add_summary(message, level="warning")
+            else:
+                self.info(message)
+
+# __main__ {{{1
+if __name__ == '__main__':
+    benchmark_output_parser = BenchmarkOutputParser()
+    benchmark_output_parser.run()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""log_collector.py
+
+A reference collector for the logs that scripts stream with --log-stream
+(see StreamingHandler in mozharness.base.log), for local testing.
+
+It listens on --listen (host:port or unix:/path), and appends every
+record it receives to <output dir>/<job>.log, one file per job, as
+  HH:MM:SS    LEVEL - [action locale] message
+Records can arrive twice, if a job's connection drops mid-batch; they
+aren't deduplicated.  Run it until it's interrupted.
+"""
+
+import os
+import re
+import SocketServer
+import sys
+import threading
+import time
+
+sys.path.insert(1, os.path.dirname(sys.path[0]))
+
+from mozharness.base.log import parse_stream_address
+from mozharness.base.script import BaseScript
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+# Characters that don't belong in a job's file name.
+JOB_NAME_RE = re.compile(r'[^\w.-]')
+
+
+class JobLogWriter(object):
+    """Append formatted records to one log file per job."""
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.num_records = 0
+        self._fhs = {}
+        self._lock = threading.Lock()
+
+    def format_record(self, record):
+        context = ' '.join([str(record[key]) for key in ('action', 'locale')
+                            if record.get(key)])
+        if context:
+            context = '[%s] ' % context
+        message = record.get('message', '')
+        if isinstance(message, unicode):
+            message = message.encode('utf-8')
+        return '%s %8s - %s%s\n' % (
+            time.strftime('%H:%M:%S',
+                          time.localtime(record.get('time', time.time()))),
+            record.get('level', 'info').upper(), context, message)
+
+    def add_record(self, record):
+        job = JOB_NAME_RE.sub('_', str(record.get('job', 'unknown')))
+        line = self.format_record(record)
+        self._lock.acquire()
+        try:
+            fh = self._fhs.get(job)
+            if fh is None:
+                fh = open(os.path.join(self.output_dir, '%s.log' % job), 'a')
+                self._fhs[job] = fh
+            fh.write(line)
+            self.num_records += 1
+        finally:
+            self._lock.release()
+
+    def flush(self):
+        self._lock.acquire()
+        try:
+            for fh in self._fhs.values():
+                fh.flush()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            for fh in self._fhs.values():
+                fh.close()
+            self._fhs = {}
+        finally:
+            self._lock.release()
+
+
+class LogStreamHandler(SocketServer.BaseRequestHandler):
+    """Read json lines from one job's connection until it closes,
+    flushing the job logs after every read, so they're current while
+    the job runs.
+    """
+    chunk_size = 64 * 1024
+
+    def handle(self):
+        writer = self.server.job_log_writer
+        partial_line = ''
+        while True:
+            data = self.request.recv(self.chunk_size)
+            if not data:
+                break
+            lines = (partial_line + data).split('\n')
+            partial_line = lines.pop()
+            for line in lines:
+                self.add_line(writer, line)
+            writer.flush()
+        self.add_line(writer, partial_line)
+        writer.flush()
+
+    def add_line(self, writer, line):
+        line = line.strip()
+        if not line:
+            return
+        try:
+            record = json.loads(line)
+        except ValueError:
+            return
+        writer.add_record(record)
+
+
+class ThreadingTCPServer(SocketServer.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class ThreadingUnixStreamServer(SocketServer.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+# LogCollector {{{1
+class LogCollector(BaseScript):
+    config_options = [[
+     ["--listen",],
+     {"action": "store",
+      "dest": "listen",
+      "type": "string",
+      "default": "localhost:9514",
+      "help": "Specify the host:port or unix:/path to listen on"
+     }
+    ], [
+     ["--output-dir",],
+     {"action": "store",
+      "dest": "output_dir",
+      "type": "string",
+      "help": "Specify the directory to write the per-job logs to"
+     }
+    ]]
+
+    def __init__(self, require_config_file=False):
+        BaseScript.__init__(self, config_options=self.config_options,
+                            all_actions=['collect'],
+                            require_config_file=require_config_file)
+
+    def query_output_dir(self):
+        if self.config.get('output_dir'):
+            return os.path.abspath(self.config['output_dir'])
+        dirs = self.query_abs_dirs()
+        return os.path.join(dirs['abs_work_dir'], 'collected_logs')
+
+    def collect(self):
+        output_dir = self.query_output_dir()
+        self.mkdir_p(output_dir)
+        try:
+            (family, address) = parse_stream_address(self.config['listen'])
+        except ValueError:
+            self.fatal("Can't parse --listen %s!" % self.config['listen'])
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.remove(address)
+            server = ThreadingUnixStreamServer(address, LogStreamHandler)
+        else:
+            server = ThreadingTCPServer(address, LogStreamHandler)
+        server.job_log_writer = JobLogWriter(output_dir)
+        self.info("Collecting logs from %s into %s; interrupt to stop." % \
+                  (self.config['listen'], output_dir))
+        try:
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+        finally:
+            server.server_close()
+            server.job_log_writer.close()
+        self.add_summary("Collected %d records." % \
+                         server.job_log_writer.num_records)
+
+# __main__ {{{1
+if __name__ == '__main__':
+    log_collector = LogCollector()
+    log_collector.run()
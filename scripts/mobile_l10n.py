@@ -13,6 +13,7 @@ Android.  This also creates nightly updates.
 from copy import deepcopy
 import os
 import re
+import subprocess
 import sys
 
 try:
@@ -25,6 +26,7 @@ sys.path.insert(1, os.path.dirname(sys.path[0]))
 
 from mozharness.base.errors import BaseErrorList, MakefileErrorList
 from mozharness.base.log import OutputParser
+from mozharness.base.script import TIMEOUT_STATUS
 from mozharness.base.transfer import TransferMixin
 from mozharness.mozilla.buildbot import BuildbotMixin
 from mozharness.mozilla.release import ReleaseMixin
@@ -137,7 +139,9 @@ class MobileSingleLocale(LocalesMixin, ReleaseMixin, MobileSigningMixin,
                                     replace_dict=replace_dict)
         if c.get('base_en_us_binary_url') and c.get('release_config_file'):
             rc = self.query_release_config()
-            repack_env['EN_US_BINARY_URL'] = c['base_en_us_binary_url'] % replace_dict
+            repack_env = repack_env.overlay({
+                'EN_US_BINARY_URL': c['base_en_us_binary_url'] % replace_dict
+            })
         self.repack_env = repack_env
         return self.repack_env
 
@@ -165,13 +169,44 @@ class MobileSingleLocale(LocalesMixin, ReleaseMixin, MobileSigningMixin,
                                               cwd=dirs['abs_locales_dir'],
                                               env=env,
                                               silent=True,
-                                              halt_on_failure=True)
+                                              halt_on_failure=True,
+                                              cacheable=True)
         parser = OutputParser(config=self.config, log_obj=self.log_obj,
-                              error_list=MakefileErrorList)
+                              error_list=MakefileErrorList,
+                              event_log=self.event_log)
         parser.add_lines(output)
+        parser.finish()
         self.make_ident_output = output
         return output
 
+    def _iter_make_ident_lines(self):
+        """Yield |make ident| output lines; from the saved output if we
+        already have it, otherwise straight from make, so the caller can
+        stop as soon as it finds what it's looking for.
+        Only valid after setup is run.
+        """
+        if self.make_ident_output:
+            for line in self.make_ident_output.splitlines():
+                yield line
+            return
+        env = self.query_repack_env()
+        dirs = self.query_abs_dirs()
+        parser = OutputParser(config=self.config, log_obj=self.log_obj,
+                              error_list=MakefileErrorList,
+                              event_log=self.event_log)
+        try:
+            for line in self.iter_output_lines(["make", "ident"],
+                                               cwd=dirs['abs_locales_dir'],
+                                               env=env, silent=True,
+                                               cacheable=True):
+                parser.add_lines(line.encode('utf-8'))
+                yield line
+        except subprocess.CalledProcessError:
+            self.fatal("Halting on failure while running make ident")
+        finally:
+            # Also when the caller stops early.
+            parser.finish()
+
     def query_buildid(self):
         """Get buildid from the objdir.
         Only valid after setup is run.
@@ -179,11 +214,11 @@ class MobileSingleLocale(LocalesMixin, ReleaseMixin, MobileSigningMixin,
         if self.buildid:
             return self.buildid
         r = re.compile("buildid (\d+)")
-        output = self._query_make_ident_output()
-        for line in output.splitlines():
+        for line in self._iter_make_ident_lines():
             m = r.match(line)
             if m:
                 self.buildid = m.groups()[0]
+                break
         return self.buildid
 
     def query_revision(self):
@@ -210,11 +245,13 @@ class MobileSingleLocale(LocalesMixin, ReleaseMixin, MobileSigningMixin,
         output = self.get_output_from_command(
             [make, "echo-variable-%s" % variable] + make_args,
             cwd=dirs['abs_locales_dir'], silent=True,
-            env=env
+            env=env, cacheable=True
         )
         parser = OutputParser(config=self.config, log_obj=self.log_obj,
-                              error_list=MakefileErrorList)
+                              error_list=MakefileErrorList,
+                              event_log=self.event_log)
         parser.add_lines(output)
+        parser.finish()
         return output.strip()
 
     def query_base_package_name(self):
@@ -351,7 +388,9 @@ class MobileSingleLocale(LocalesMixin, ReleaseMixin, MobileSigningMixin,
         self._setup_configure()
 
     def repack(self):
-        # TODO per-locale logs and reporting.
+        # With --log-item-sections, each locale gets a log of its own
+        # (see set_event_context()).
+        # TODO per-locale reporting.
         c = self.config
         dirs = self.query_abs_dirs()
         locales = self.query_locales()
@@ -360,30 +399,43 @@ class MobileSingleLocale(LocalesMixin, ReleaseMixin, MobileSigningMixin,
         base_package_name = self.query_base_package_name()
         base_package_dir = os.path.join(dirs['abs_objdir'], 'dist')
         success_count = total_count = 0
-        for locale in locales:
+        verify_list = []
+        # compare-locales and make installers share the merge dir and
+        # objdir, so they need to run one locale at a time.
+        for (num, locale) in enumerate(locales):
+            self.set_event_context(locale=locale)
+            self.report_progress(num, len(locales), 'locales')
             total_count += 1
             if self.run_compare_locales(locale):
                 self.add_failure(locale, message="%s failed in compare-locales!" % locale)
                 continue
-            if self.run_command([make, "installers-%s" % locale],
-                                cwd=dirs['abs_locales_dir'],
-                                env=repack_env,
-                                error_list=MakefileErrorList,
-                                halt_on_failure=False):
+            status = self.run_command([make, "installers-%s" % locale],
+                                      cwd=dirs['abs_locales_dir'],
+                                      env=repack_env,
+                                      error_list=MakefileErrorList,
+                                      halt_on_failure=False)
+            if status == TIMEOUT_STATUS:
+                self.add_failure(locale, message="%s timed out in make installers-%s!" % (locale, locale))
+                continue
+            elif status:
                 self.add_failure(locale, message="%s failed in make installers-%s!" % (locale, locale))
                 continue
             signed_path = os.path.join(base_package_dir,
                                        base_package_name % {'locale': locale})
-            status = self.verify_android_signature(
-                signed_path,
-                script=c['signature_verification_script'],
-                env=repack_env
-            )
+            verify_list.append((locale, signed_path))
+        statuses = self.verify_android_signatures(
+            [entry[-1] for entry in verify_list],
+            script=c['signature_verification_script'],
+            env=repack_env
+        )
+        for (locale, signed_path), status in zip(verify_list, statuses):
             if status:
                 self.add_failure(locale, message="Errors verifying %s binary!" % locale)
                 # No need to rm because upload is per-locale
                 continue
             success_count += 1
+        self.set_event_context(locale=None)
+        self.report_progress(len(locales), len(locales), 'locales')
         self.summarize_success_count(success_count, total_count,
                                      message="Repacked %d of %d binaries successfully.")
 
@@ -400,24 +452,31 @@ class MobileSingleLocale(LocalesMixin, ReleaseMixin, MobileSigningMixin,
         if c.get('release_config_file'):
             rc = self.query_release_config()
             buildnum = rc['buildnum']
-        for locale in locales:
+        for (num, locale) in enumerate(locales):
+            self.set_event_context(locale=locale)
+            self.report_progress(num, len(locales), 'locales')
             if self.query_failure(locale):
                 self.warning("Skipping previously failed locale %s." % locale)
                 continue
             total_count += 1
+            env = upload_env
             if c.get('base_post_upload_cmd'):
-                upload_env['POST_UPLOAD_CMD'] = c['base_post_upload_cmd'] % {'version': version, 'locale': locale, 'buildnum': str(buildnum)}
+                env = upload_env.overlay({
+                    'POST_UPLOAD_CMD': c['base_post_upload_cmd'] % {'version': version, 'locale': locale, 'buildnum': str(buildnum)}
+                })
             output = self.get_output_from_command(
                 # Ugly hack to avoid |make upload| stderr from showing up
                 # as get_output_from_command errors
                 "%s upload AB_CD=%s 2>&1" % (make, locale),
                 cwd=dirs['abs_locales_dir'],
-                env=upload_env,
+                env=env,
                 silent=True
             )
             parser = OutputParser(config=self.config, log_obj=self.log_obj,
-                                  error_list=MakefileErrorList)
+                                  error_list=MakefileErrorList,
+                                  event_log=self.event_log)
             parser.add_lines(output)
+            parser.finish()
             if parser.num_errors:
                 self.add_failure(locale, message="%s failed in make upload!" % (locale))
                 continue
@@ -435,6 +494,8 @@ class MobileSingleLocale(LocalesMixin, ReleaseMixin, MobileSigningMixin,
                 print output
                 continue
             success_count += 1
+        self.set_event_context(locale=None)
+        self.report_progress(len(locales), len(locales), 'locales')
         self.summarize_success_count(success_count, total_count,
                                      message="Uploaded %d of %d binaries successfully.")
 
@@ -451,7 +512,9 @@ class MobileSingleLocale(LocalesMixin, ReleaseMixin, MobileSigningMixin,
             'buildid': buildid,
             'build_target': c['build_target'],
         }
-        for locale in locales:
+        for (num, locale) in enumerate(locales):
+            self.set_event_context(locale=locale)
+            self.report_progress(num, len(locales), 'locales')
             total_count += 1
             replace_dict['locale'] = locale
             aus_base_dir = c['aus_base_dir'] % replace_dict
@@ -469,6 +532,8 @@ class MobileSingleLocale(LocalesMixin, ReleaseMixin, MobileSigningMixin,
                 continue
             self.run_command(["touch", os.path.join(aus_abs_dir, "partial.txt")])
             success_count += 1
+        self.set_event_context(locale=None)
+        self.report_progress(len(locales), len(locales), 'locales')
         self.summarize_success_count(success_count, total_count,
                                      message="Created %d of %d snippets successfully.")
 
@@ -291,6 +291,7 @@ class MobilePartnerRepack(LocalesMixin, ReleaseMixin, MobileSigningMixin,
         dirs = self.query_abs_dirs()
         locales = self.query_locales()
         success_count = total_count = 0
+        align_list = []
         for platform in c['platforms']:
             for locale in locales:
                 installer_name = c['installer_base_names'][platform] % {'version': rc['version'], 'locale': locale}
@@ -312,12 +313,18 @@ class MobilePartnerRepack(LocalesMixin, ReleaseMixin, MobileSigningMixin,
                         self.add_summary("Unable to sign %s:%s apk!" % (platform, locale), level=FATAL)
                     else:
                         self.mkdir_p(signed_dir)
-                        if self.align_apk(unsigned_path, signed_path):
-                            self.add_failure(platform, locale,
-                                             message="Unable to align %(platform)s%(locale)s apk!")
-                            self.rmtree(signed_dir)
-                        else:
-                            success_count += 1
+                        align_list.append((platform, locale, unsigned_path,
+                                           signed_path))
+        # The last two of each align_list entry are the apk paths.
+        statuses = self.align_apks([entry[-2:] for entry in align_list])
+        for (platform, locale, unsigned_path, signed_path), status in \
+          zip(align_list, statuses):
+            if status:
+                self.add_failure(platform, locale,
+                                 message="Unable to align %(platform)s%(locale)s apk!")
+                self.rmtree(os.path.dirname(signed_path))
+            else:
+                success_count += 1
         self.summarize_success_count(success_count, total_count,
                                      message="Signed %d of %d apks successfully.")
 
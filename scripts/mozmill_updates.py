@@ -142,7 +142,7 @@ class MozmillUpdate(VirtualenvMixin, MercurialScript):
             for version in version_dict.keys():
                 self.info("Testing %s on %s channel" % (version, channel))
                 report_json = os.path.join(dirs['abs_work_dir'], "report_%s_%s.json" % (version, channel))
-                self.run_command(
+                result = self.run_command(
                  [python, 'testrun_update.py',
                   '--channel=%s' % channel,
                   '--report=file://%s' % report_json,
@@ -150,6 +150,7 @@ class MozmillUpdate(VirtualenvMixin, MercurialScript):
                  ],
                  cwd="%s/mozmill-automation" % dirs['abs_work_dir'],
                  error_list=MozmillErrorList,
+                 return_type='result',
                 )
                 if os.path.exists(report_json):
                     raw_json = self.read_from_file(report_json, verbose=False)
@@ -170,6 +171,8 @@ class MozmillUpdate(VirtualenvMixin, MercurialScript):
                         self.copy_to_upload_dir(report_json)
                 else:
                     self.add_summary("%s on %s channel didn't create report json!" % (version, channel), level="error")
+                    if result.matches.get('error'):
+                        self.add_summary(" First error, line %d: %s" % result.matches['error'][0], level="error")
                     self.return_code += 1
 
 # __main__ {{{1
@@ -13,9 +13,9 @@ import sys
 sys.path.insert(1, os.path.dirname(sys.path[0]))
 
 from mozharness.base.errors import PythonErrorList
-from mozharness.base.log import DEBUG, INFO, WARNING, ERROR
+from mozharness.base.log import DEBUG, INFO, WARNING, ERROR, LEVEL_NUMBERS
 from mozharness.base.vcs.vcsbase import MercurialScript
-from mozharness.mozilla.buildbot import TBPL_SUCCESS, TBPL_FAILURE
+from mozharness.mozilla.buildbot import TBPL_SUCCESS, TBPL_WARNING, TBPL_FAILURE
 from mozharness.mozilla.testing.testbase import TestingMixin, testing_config_options
 
 class PepTest(TestingMixin, MercurialScript):
@@ -192,10 +192,19 @@ class PepTest(TestingMixin, MercurialScript):
         if self.config.get('iterations'):
             cmd.extend(self._build_arg('--iterations', self.config.get('iterations')))
 
-        code = self.run_command(cmd, error_list=error_list)
+        result = self.run_command(cmd, error_list=error_list,
+                                  return_type='result')
+        code = result.return_code
         # get status and set summary
         level = ERROR
-        if code == 0:
+        if code == 0 and \
+           LEVEL_NUMBERS[result.worst_level] >= LEVEL_NUMBERS[ERROR]:
+            # peptest thinks all is well, but its output matched the
+            # error_list.
+            status = "errors in output"
+            tbpl_status = TBPL_WARNING
+            level = WARNING
+        elif code == 0:
             status = "success"
             tbpl_status = TBPL_SUCCESS
             level = INFO
@@ -214,11 +223,18 @@ class PepTest(TestingMixin, MercurialScript):
             tbpl_status = TBPL_FAILURE
 
         # TODO create a better summary for peptest
-        #      for now just display return code
+        #      for now just display return code and what we matched
         self.add_summary("%s exited with return code %s: %s" % (cmd[0],
                                                                 code,
                                                                 status),
                          level=level)
+        for match_level in (ERROR, WARNING):
+            if match_level not in result.level_counts:
+                continue
+            (line_number, line) = result.matches[match_level][0]
+            self.add_summary("%d %s lines; the first, line %d: %s" % \
+                             (result.level_counts[match_level], match_level,
+                              line_number, line), level=level)
         self.buildbot_status(tbpl_status)
 
 
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# ***** BEGIN LICENSE BLOCK *****
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# ***** END LICENSE BLOCK *****
+"""reparse_log.py
+
+Re-triage an existing log against one or more of the error lists in
+mozharness.base.errors, e.g. after an error list has been updated.
+
+The log is memory-mapped and split on line boundaries into chunks, which
+a pool of processes classifies in parallel.  The results are merged into
+per-level line counts and a report of the first matches at each level.
+
+Raw logs (e.g. log_raw.log from MultiFileLogger) work best, since regexes
+anchored at the start of the line won't match after a timestamp and level.
+"""
+
+import mmap
+import multiprocessing
+import os
+import sys
+
+sys.path.insert(1, os.path.dirname(sys.path[0]))
+
+import mozharness.base.errors as errors
+from mozharness.base.errors import compile_error_list
+from mozharness.base.log import INFO, LEVEL_ORDER
+from mozharness.base.script import BaseScript
+
+
+def query_error_list(error_list_names):
+    """Concatenate the named error lists from mozharness.base.errors."""
+    error_list = []
+    for error_list_name in error_list_names:
+        error_list.extend(getattr(errors, error_list_name))
+    return error_list
+
+
+def query_chunks(fh, chunk_size):
+    """Split the file open as fh into chunks of about chunk_size bytes,
+    ending on line boundaries, and return them as (start, end) offsets.
+    """
+    chunks = []
+    file_size = os.fstat(fh.fileno()).st_size
+    if not file_size:
+        return chunks
+    m = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        start = 0
+        while start < file_size:
+            end = m.find('\n', min(start + chunk_size, file_size) - 1)
+            if end < 0:
+                end = file_size
+            else:
+                end += 1
+            chunks.append((start, end))
+            start = end
+    finally:
+        m.close()
+    return chunks
+
+
+def classify_chunk(args):
+    """Match the lines between the start and end offsets of log_file
+    against the named error lists.
+
+    Returns (num_lines, level_counts, matches), where matches holds the
+    first max_matches (line number within the chunk, line) per level.
+    This runs in the pool's worker processes, so it has to be picklable:
+    a module-level function taking a tuple.
+    """
+    (log_file, start, end, error_list_names, max_matches) = args
+    error_matcher = compile_error_list(query_error_list(error_list_names))
+    num_lines = 0
+    level_counts = {}
+    matches = {}
+    fh = open(log_file, 'rb')
+    try:
+        m = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            lines = m[start:end].split('\n')
+        finally:
+            m.close()
+    finally:
+        fh.close()
+    if lines and not lines[-1]:
+        lines.pop()
+    for line in lines:
+        num_lines += 1
+        line = line.rstrip()
+        if not line:
+            continue
+        error_check = error_matcher.match(line)
+        if error_check is None:
+            continue
+        level = error_check.get('level', INFO)
+        level_counts[level] = level_counts.get(level, 0) + 1
+        level_matches = matches.setdefault(level, [])
+        if len(level_matches) < max_matches:
+            level_matches.append((num_lines, line))
+    return num_lines, level_counts, matches
+
+
+# ReparseLog {{{1
+class ReparseLog(BaseScript):
+    config_options = [[
+     ["--log-file",],
+     {"action": "store",
+      "dest": "log_file",
+      "type": "string",
+      "help": "Specify the log to re-parse"
+     }
+    ], [
+     ["--error-list",],
+     {"action": "extend",
+      "dest": "error_lists",
+      "help": "Specify the error lists from mozharness.base.errors to match against"
+     }
+    ], [
+     ["--chunk-size",],
+     {"action": "store",
+      "dest": "chunk_size",
+      "type": "int",
+      "default": 8 * 1024 * 1024,
+      "help": "Specify the size in bytes of the chunks the log is split into"
+     }
+    ], [
+     ["--processes",],
+     {"action": "store",
+      "dest": "processes",
+      "type": "int",
+      "help": "Specify the number of processes to parse with (default: one per cpu)"
+     }
+    ], [
+     ["--max-matches",],
+     {"action": "store",
+      "dest": "max_matches",
+      "type": "int",
+      "default": 10,
+      "help": "Specify the number of matches per level to report"
+     }
+    ], [
+     ["--report-file",],
+     {"action": "store",
+      "dest": "report_file",
+      "type": "string",
+      "help": "Specify where to write the report"
+     }
+    ]]
+
+    def __init__(self, require_config_file=False):
+        BaseScript.__init__(self, config_options=self.config_options,
+                            all_actions=['reparse-log'],
+                            require_config_file=require_config_file)
+
+    def query_report_file(self):
+        if self.config.get('report_file'):
+            return os.path.abspath(self.config['report_file'])
+        dirs = self.query_abs_dirs()
+        return os.path.join(dirs['abs_work_dir'], 'reparse_report.txt')
+
+    def _classify_chunks(self, chunk_args):
+        """Yield the classify_chunk() results for chunk_args, in order."""
+        processes = self.config.get('processes')
+        if processes is None:
+            try:
+                processes = multiprocessing.cpu_count()
+            except NotImplementedError:
+                processes = 1
+        processes = min(processes, len(chunk_args))
+        if processes <= 1:
+            for args in chunk_args:
+                yield classify_chunk(args)
+            return
+        self.info("Parsing %d chunks in %d processes." % \
+                  (len(chunk_args), processes))
+        pool = multiprocessing.Pool(processes)
+        try:
+            for result in pool.imap(classify_chunk, chunk_args):
+                yield result
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    def reparse_log(self):
+        c = self.config
+        log_file = c.get('log_file')
+        if not log_file or not os.path.isfile(log_file):
+            self.fatal("Specify an existing --log-file!")
+        error_list_names = c.get('error_lists')
+        if not error_list_names:
+            self.fatal("Specify at least one --error-list!")
+        for error_list_name in error_list_names:
+            if not isinstance(getattr(errors, error_list_name, None), list):
+                self.fatal("%s isn't an error list in mozharness.base.errors!" % \
+                           error_list_name)
+        max_matches = c['max_matches']
+        fh = open(log_file, 'rb')
+        try:
+            chunks = query_chunks(fh, max(c['chunk_size'], 1))
+        finally:
+            fh.close()
+        chunk_args = [(log_file, start, end, error_list_names, max_matches)
+                      for (start, end) in chunks]
+
+        num_lines = 0
+        level_counts = {}
+        matches = {}
+        for (chunk_lines, chunk_counts, chunk_matches) in \
+          self._classify_chunks(chunk_args):
+            for level, count in chunk_counts.items():
+                level_counts[level] = level_counts.get(level, 0) + count
+            for level, level_matches in chunk_matches.items():
+                merged = matches.setdefault(level, [])
+                for (line_num, line) in level_matches[:max_matches - len(merged)]:
+                    merged.append((num_lines + line_num, line))
+            num_lines += chunk_lines
+
+        report = ["%s: %d lines, matched against %s." % \
+                  (log_file, num_lines, ', '.join(error_list_names))]
+        for level in reversed(LEVEL_ORDER):
+            if level not in level_counts:
+                continue
+            report.append("%s: %d lines" % (level, level_counts[level]))
+            for (line_num, line) in matches[level]:
+                report.append("  line %d: %s" % (line_num, line))
+        report_file = self.query_report_file()
+        self.write_to_file(report_file, '\n'.join(report) + '\n',
+                           create_parent_dir=True)
+        for level in reversed(LEVEL_ORDER):
+            if level in level_counts:
+                self.add_summary("%d %s lines in %s." % \
+                                 (level_counts[level], level, log_file))
+        if not level_counts:
+            self.add_summary("No lines in %s matched." % log_file)
+
+# __main__ {{{1
+if __name__ == '__main__':
+    reparse_log = ReparseLog()
+    reparse_log.run()
@@ -9,6 +9,7 @@
 """
 # TODO split out signing and transfers to helper objects so we can do
 #      the downloads/signing/uploads in parallel, speeding that up
+#      (zipalign and signature verification already run in parallel.)
 # TODO retire this script when Android signing-on-demand lands.
 
 from copy import deepcopy
@@ -278,6 +279,7 @@ class SignAndroid(LocalesMixin, ReleaseMixin, MobileSigningMixin,
         dirs = self.query_abs_dirs()
         locales = self.query_locales()
         success_count = total_count = 0
+        align_list = []
         for platform in c['platforms']:
             for locale in locales:
                 if self.query_failure(platform, locale):
@@ -300,16 +302,25 @@ class SignAndroid(LocalesMixin, ReleaseMixin, MobileSigningMixin,
                                      level=FATAL)
                 else:
                     self.mkdir_p(signed_dir)
-                    if self.align_apk(unsigned_path, signed_path):
-                        self.add_failure(platform, locale,
-                                         message="Unable to align %(platform)s:%(locale)s apk!")
-                        self.rmtree(signed_dir)
-                    else:
-                        success_count += 1
+                    align_list.append((platform, locale, unsigned_path,
+                                       signed_path))
+        # zipalign doesn't need the passphrases, so we can run those in
+        # parallel.
+        # The last two of each align_list entry are the apk paths.
+        statuses = self.align_apks([entry[-2:] for entry in align_list])
+        for (platform, locale, unsigned_path, signed_path), status in \
+          zip(align_list, statuses):
+            if status:
+                self.add_failure(platform, locale,
+                                 message="Unable to align %(platform)s:%(locale)s apk!")
+                self.rmtree(os.path.dirname(signed_path))
+            else:
+                success_count += 1
         self.summarize_success_count(success_count, total_count,
                                      message="Signed %d of %d apks successfully.")
         if c['enable_partner_repacks']:
             total_count = success_count = 0
+            align_list = []
             self.info("Signing partner repacks.")
             for partner in c.get("partners", []):
                 for platform in c.get("partner_platforms", []):
@@ -332,11 +343,16 @@ class SignAndroid(LocalesMixin, ReleaseMixin, MobileSigningMixin,
                             continue
                         else:
                             self.mkdir_p(signed_dir)
-                            if self.align_apk(unsigned_path, signed_path):
-                                self.add_summary("Unable to align %s %s:%s apk!" % (partner, platform, locale))
-                                self.rmtree(signed_dir)
-                            else:
-                                success_count += 1
+                            align_list.append((partner, platform, locale,
+                                               unsigned_path, signed_path))
+            statuses = self.align_apks([entry[-2:] for entry in align_list])
+            for (partner, platform, locale, unsigned_path, signed_path), \
+              status in zip(align_list, statuses):
+                if status:
+                    self.add_summary("Unable to align %s %s:%s apk!" % (partner, platform, locale))
+                    self.rmtree(os.path.dirname(signed_path))
+                else:
+                    success_count += 1
             self.summarize_success_count(success_count, total_count,
                                          message="Signed %d of %d partner apks successfully.")
 
@@ -346,6 +362,7 @@ class SignAndroid(LocalesMixin, ReleaseMixin, MobileSigningMixin,
         dirs = self.query_abs_dirs()
         locales = self.query_locales()
         env = self.query_env(partial_env=c.get("env"))
+        verify_list = []
         for platform in c['platforms']:
             for locale in locales:
                 if self.query_failure(platform, locale):
@@ -359,18 +376,21 @@ class SignAndroid(LocalesMixin, ReleaseMixin, MobileSigningMixin,
                     self.add_failure(platform, locale,
                                      message="Can't verify nonexistent %(platform)s:%(locale)s apk!")
                     continue
-                status = self.verify_android_signature(
-                    signed_path,
-                    script=c['signature_verification_script'],
-                    key_alias=c['key_alias'],
-                    tools_dir="tools/",
-                    env=env,
-                )
-                if status:
-                    self.add_failure(platform, locale,
-                                     message="Errors verifying %(platform)s:%(locale)s apk!")
-                    # rm to avoid uploading ?
-                    self.rmtree(signed_path)
+                verify_list.append((platform, locale, signed_path))
+        statuses = self.verify_android_signatures(
+            [entry[-1] for entry in verify_list],
+            script=c['signature_verification_script'],
+            key_alias=c['key_alias'],
+            tools_dir="tools/",
+            env=env,
+        )
+        for (platform, locale, signed_path), status in \
+          zip(verify_list, statuses):
+            if status:
+                self.add_failure(platform, locale,
+                                 message="Errors verifying %(platform)s:%(locale)s apk!")
+                # rm to avoid uploading ?
+                self.rmtree(signed_path)
 
     def upload_signed_bits(self):
         c = self.config
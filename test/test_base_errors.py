@@ -0,0 +1,40 @@
+import re
+import unittest
+
+import mozharness.base.errors as errors
+from mozharness.base.log import WARNING, ERROR, CRITICAL
+
+test_error_list = [
+ {'substr': 'error:', 'level': ERROR},
+ {'regex': re.compile(r'^warning: (\w+)'), 'level': WARNING},
+ {'regex': re.compile(r'CRASH', re.I), 'level': CRITICAL},
+ {'substr': 'warning: foo', 'level': ERROR},
+]
+
+class TestErrorListMatcher(unittest.TestCase):
+    def _test_matcher(self, matcher):
+        self.assertEqual(matcher.match("nothing to see here"), None)
+        self.assertEqual(matcher.match("make: error: warning: foo"),
+                         test_error_list[0])
+        self.assertEqual(matcher.match("warning: foo"), test_error_list[1])
+        self.assertEqual(matcher.match("it crashed"), test_error_list[2])
+        self.assertEqual(matcher.match(" warning: foo"), test_error_list[3])
+
+    def test_match(self):
+        self._test_matcher(errors.ErrorListMatcher(test_error_list))
+
+    def test_invalid_rules(self):
+        matcher = errors.ErrorListMatcher([{'level': ERROR}])
+        self.assertEqual(len(matcher.invalid_rules), 1)
+        self.assertEqual(matcher.match("error:"), None)
+
+    def test_compile_error_list(self):
+        self.assertTrue(errors.compile_error_list(errors.HgErrorList) is
+                        errors.HgErrorMatcher)
+        self.assertTrue(errors.compile_error_list(list(errors.HgErrorList)) is
+                        errors.HgErrorMatcher)
+        self.assertFalse(errors.compile_error_list(errors.HgErrorList[1:]) is
+                         errors.HgErrorMatcher)
+
+if __name__ == '__main__':
+    unittest.main()
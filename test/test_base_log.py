@@ -1,6 +1,13 @@
+import atexit
+import gzip
+import json
+import logging
 import os
 import shutil
+import socket
 import subprocess
+import threading
+from StringIO import StringIO
 import unittest
 
 import mozharness.base.log as log
@@ -35,5 +42,430 @@ class TestLog(unittest.TestCase):
         self.assertTrue(os.path.exists(get_log_file_path()))
         del(l)
 
+    def test_log_raw(self):
+        l = log.MultiFileLogger(log_dir=tmp_dir, log_name=log_name,
+                                log_to_console=False)
+        l.log_raw('raw only', level=log.WARNING)
+        l.log_message('everywhere', level=log.WARNING)
+        del(l)
+        raw_log = open(get_log_file_path('raw')).read()
+        warning_log = open(get_log_file_path(log.WARNING)).read()
+        self.assertTrue('raw only' in raw_log and 'everywhere' in raw_log)
+        self.assertFalse('raw only' in warning_log)
+        self.assertTrue('everywhere' in warning_log)
+
+    def test_write_once_log(self):
+        l = log.MultiFileLogger(log_dir=tmp_dir, log_name=log_name,
+                                log_to_console=False, write_once_log=True,
+                                logger_name='WriteOnce')
+        l.log_message('some info')
+        l.log_message('an error', level=log.ERROR)
+        l.log_raw('raw only')
+        self.assertFalse(os.path.exists(get_log_file_path(log.ERROR)))
+        l.generate_logs()
+        info_log = open(get_log_file_path(log.INFO)).read()
+        error_log = open(get_log_file_path(log.ERROR)).read()
+        raw_log = open(get_log_file_path('raw')).read()
+        self.assertTrue(' INFO - some info' in info_log)
+        self.assertTrue(' ERROR - an error' in info_log)
+        self.assertFalse('some info' in error_log)
+        self.assertTrue(' ERROR - an error' in error_log)
+        self.assertFalse('raw only' in info_log)
+        self.assertTrue(raw_log.endswith('some info\nan error\nraw only\n'))
+        self.assertEqual(os.path.getsize(get_log_file_path('raw') + '.idx'),
+                         4 * 22)
+        del(l)
+
+    def test_async_logging(self):
+        l = log.MultiFileLogger(log_dir=tmp_dir, log_name=log_name,
+                                log_to_console=False, async_logging=True,
+                                logger_name='Async')
+        for i in range(1000):
+            l.log_message('line %d' % i)
+        l.log_raw('raw only')
+        l.log_message('an error', level=log.ERROR)
+        l.flush_logs()
+        lines = open(get_log_file_path(log.INFO)).read().splitlines()
+        self.assertEqual(len(lines), 1002)
+        self.assertTrue(lines[1].endswith(' INFO - line 0'))
+        self.assertTrue(lines[1000].endswith(' INFO - line 999'))
+        self.assertTrue(lines[1001].endswith(' ERROR - an error'))
+        raw_lines = open(get_log_file_path('raw')).read().splitlines()
+        self.assertEqual(raw_lines[-2:], ['raw only', 'an error'])
+        self.assertRaises(SystemExit, l.log_message, 'oops', level=log.FATAL)
+        fatal_lines = open(get_log_file_path(log.FATAL)).read().splitlines()
+        self.assertTrue(fatal_lines[0].endswith(' FATAL - oops'))
+        self.assertTrue(fatal_lines[1].endswith(' FATAL - Exiting -1'))
+        l.close_log_writer()
+        self.assertEqual(l.log_writer, None)
+        l.log_message('after close')
+        self.assertTrue(open(get_log_file_path(log.INFO)).read().endswith(
+            ' INFO - after close\n'))
+        del(l)
+
+    def test_async_logging_atexit(self):
+        num_handlers = len(atexit._exithandlers)
+        l = log.SimpleFileLogger(log_dir=tmp_dir, log_name=log_name,
+                                 log_to_console=False, async_logging=True,
+                                 logger_name='AsyncAtexit')
+        for i in range(3):
+            l.new_logger('AsyncAtexit')
+        self.assertEqual(len(atexit._exithandlers), num_handlers + 1)
+        l.close_log_writer()
+        del(l)
+
+    def test_gzip_segments(self):
+        l = log.SimpleFileLogger(log_dir=tmp_dir, log_name=log_name,
+                                 log_to_console=False, log_format='%(message)s',
+                                 logger_name='Gzip', gzip_logs=True,
+                                 log_max_bytes=100, log_backup_count=2)
+        for i in range(30):
+            l.log_message('line %02d' % i)
+        l.flush_logs()
+        self.assertEqual(l.query_log_files(),
+                         ['test.log.1.gz', 'test.log.2.gz', 'test.log.gz'])
+        lines = []
+        for name in ('test.log.2.gz', 'test.log.1.gz', 'test.log.gz'):
+            fh = gzip.open(os.path.join(tmp_dir, name))
+            lines.extend(fh.read().splitlines())
+            fh.close()
+        self.assertEqual(lines[-1], 'line 29')
+        self.assertEqual(lines, ['line %02d' % i for i in range(30 - len(lines), 30)])
+        l.log_message('after flush')
+        del(l)
+        fh = gzip.open(get_log_file_path() + '.gz')
+        self.assertTrue(fh.read().endswith('line 29\nafter flush\n'))
+        fh.close()
+
+    def test_is_enabled_for(self):
+        l = log.SimpleFileLogger(log_dir=tmp_dir, log_name=log_name,
+                                 log_to_console=False, log_level=log.WARNING,
+                                 logger_name='Enabled')
+        self.assertFalse(l.is_enabled_for(log.INFO))
+        self.assertTrue(l.is_enabled_for(log.WARNING))
+        self.assertTrue(l.is_enabled_for(log.FATAL))
+        l.log_message('skipped')
+        l.log_message('kept', level=log.ERROR)
+        del(l)
+        log_contents = open(get_log_file_path()).read()
+        self.assertFalse('skipped' in log_contents)
+        self.assertTrue(' ERROR - kept' in log_contents)
+
+    def test_stream_spill(self):
+        os.makedirs(tmp_dir)
+        spill_path = os.path.join(tmp_dir, 'spill.jsonl')
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        address = '127.0.0.1:%d' % listener.getsockname()[1]
+        # Nothing's listening yet, so everything is spilled.
+        handler = log.StreamingHandler(address, 'job1', spill_path,
+                                       batch_interval=0.01)
+        handler.context['action'] = 'build'
+        handler.handle(make_record('one'))
+        handler.close()
+        handler.handle(make_record('two'))
+        self.assertEqual(handler.num_sent, 0)
+        self.assertEqual(handler.num_spilled, 2)
+        self.assertEqual(len(open(spill_path).readlines()), 2)
+
+        listener.listen(1)
+        received = []
+        def receive():
+            conn = listener.accept()[0]
+            received.extend(conn.makefile().readlines())
+            conn.close()
+        receiver = threading.Thread(target=receive)
+        receiver.start()
+        handler = log.StreamingHandler(address, 'job1', spill_path,
+                                       batch_interval=0.01)
+        handler.handle(make_record('three', logging.ERROR))
+        handler.close()
+        receiver.join()
+        listener.close()
+        records = [json.loads(line) for line in received]
+        self.assertEqual([r['message'] for r in records],
+                         ['one', 'two', 'three'])
+        self.assertEqual(records[0]['action'], 'build')
+        self.assertEqual(records[2]['level'], log.ERROR)
+        self.assertEqual(records[2]['job'], 'job1')
+        self.assertEqual(handler.num_sent, 3)
+        self.assertEqual(os.path.getsize(spill_path), 0)
+
+    def test_stream_context_async(self):
+        l = log.SimpleFileLogger(log_dir=tmp_dir, log_name=log_name,
+                                 log_to_console=False, async_logging=True,
+                                 logger_name='AsyncStream')
+        # Nothing listens on port 1, so everything is spilled.
+        l.add_stream_handler('127.0.0.1:1', job='job1')
+        l.stream_handler.context['action'] = 'build'
+        l.log_message('one')
+        l.stream_handler.context['action'] = 'test'
+        l.log_message('two')
+        l.close_stream_handler()
+        l.close_log_writer()
+        records = [json.loads(line) for line in
+                   open(l.query_stream_spill_path()).readlines()]
+        self.assertEqual([(r['action'], r['message']) for r in records],
+                         [('build', 'one'), ('test', 'two')])
+        del(l)
+
+    def test_log_sections(self):
+        l = log.SimpleFileLogger(log_dir=tmp_dir, log_name=log_name,
+                                 log_to_console=False, log_format='%(message)s',
+                                 log_to_raw=True, logger_name='Sections')
+        l.log_message('before')
+        l.start_log_section('build')
+        l.log_message('building')
+        l.start_log_section('build')
+        l.log_message('oops', level=log.WARNING)
+        l.end_log_section()
+        l.log_message('built')
+        l.end_log_section()
+        l.end_log_section()
+        l.log_message('after')
+        sections_dir = os.path.join(tmp_dir, 'sections')
+        self.assertEqual(open(os.path.join(sections_dir, 'test_build.log')).read(),
+                         'building\nbuilt\n')
+        self.assertEqual(open(os.path.join(sections_dir, 'test_build.2.log')).read(),
+                         'oops\n')
+        self.assertEqual([(s['name'], s['file'], s['parent'], s['level_counts'])
+                          for s in l.log_sections],
+                         [('build', os.path.join('sections', 'test_build.log'),
+                           None, {log.INFO: 2}),
+                          ('build', os.path.join('sections', 'test_build.2.log'),
+                           'build', {log.WARNING: 1})])
+        raw_log = open(get_log_file_path('raw')).read()
+        self.assertEqual([raw_log[s['raw_start']:s['raw_end']]
+                          for s in l.log_sections],
+                         ['building\noops\nbuilt\n', 'oops\n'])
+        self.assertEqual(l.query_log_files(),
+                         [os.path.join('sections', 'test_build.2.log'),
+                          os.path.join('sections', 'test_build.log'),
+                          'test.log', 'test_raw.log', 'test_sections.json'])
+        del(l)
+
+    def test_console_summary(self):
+        l = log.SimpleFileLogger(log_dir=tmp_dir, log_name=log_name,
+                                 log_format='%(levelname)s - %(message)s',
+                                 logger_name='Console', console_summary=True)
+        console = StringIO()
+        l.all_handlers[0].stream = console
+        l.log_message('detail')
+        l.log_message('banner', console=True)
+        l.log_message('careful', level=log.WARNING)
+        self.assertEqual(console.getvalue(),
+                         'INFO - banner\nWARNING - careful\n')
+        del(l)
+        log_lines = open(get_log_file_path()).read().splitlines()
+        self.assertEqual(log_lines[-3:], ['INFO - detail', 'INFO - banner',
+                                          'WARNING - careful'])
+
+    def test_gzip_copy(self):
+        l = log.SimpleFileLogger(log_dir=tmp_dir, log_name=log_name,
+                                 log_to_console=False, log_format='%(message)s',
+                                 logger_name='GzipCopy', gzip_logs=True)
+        l.log_message('first')
+        l.flush_logs()
+        # Enough to spill compressed data from a new member to disk.
+        for i in range(20000):
+            l.log_message('line %d %s' % (i, 'x' * (i % 97)))
+        copy_dir = os.path.join(tmp_dir, 'copy')
+        self.assertEqual(l.copy_log_files(copy_dir), ['test.log.gz'])
+        l.log_message('after copy')
+        fh = gzip.open(os.path.join(copy_dir, 'test.log.gz'))
+        lines = fh.read().splitlines()
+        fh.close()
+        self.assertEqual(len(lines), 20002)
+        self.assertEqual(lines[-1], 'line 19999 %s' % ('x' * (19999 % 97)))
+        del(l)
+
+def make_record(message, levelno=logging.INFO):
+    return logging.LogRecord('Stream', levelno, '(unknown file)', 0,
+                             message, None, None)
+
+class Unformattable(object):
+    def __str__(self):
+        raise AssertionError("Formatted a message that isn't logged.")
+
+class TestLogMixin(unittest.TestCase):
+    def test_deferred_formatting(self):
+        obj = log.LogMixin()
+        obj.config = {'log_level': log.INFO}
+        obj.log_obj = LogRecorder()
+        obj.log_obj.is_enabled_for = lambda level: level != log.DEBUG
+        obj.debug("not logged: %s", Unformattable())
+        obj.info("%s is now %s", 'FOO', 1)
+        obj.info("100% literal")
+        obj.log("at %s", 'warning', level=log.WARNING)
+        self.assertEqual(obj.log_obj.messages, [
+            (log.INFO, 'FOO is now 1'),
+            (log.INFO, '100% literal'),
+            (log.WARNING, 'at warning'),
+        ])
+
+    def test_no_log_obj(self):
+        obj = log.LogMixin()
+        obj.config = {'log_level': log.ERROR}
+        obj.log_obj = None
+        self.assertFalse(obj.log_enabled(log.WARNING))
+        self.assertTrue(obj.log_enabled(log.ERROR))
+        self.assertFalse(obj.log_enabled(log.IGNORE))
+        obj.warning("not logged: %s", Unformattable())
+        self.assertRaises(SystemExit, obj.fatal, "exiting %d", 2, exit_code=2)
+
+class LogRecorder(object):
+    def __init__(self):
+        self.messages = []
+        self.raw_messages = []
+
+    def log_message(self, message, level=log.INFO, exit_code=-1,
+                    console=False):
+        self.messages.append((level, message.strip()))
+
+    def log_raw(self, message, level=log.INFO):
+        self.raw_messages.append((level, message.strip()))
+
+class FrozenTime(object):
+    now = 1000.0
+
+    def time(self):
+        return self.now
+
+class TestOutputParser(unittest.TestCase):
+    def test_context_lines(self):
+        log_obj = LogRecorder()
+        parser = log.OutputParser(log_obj=log_obj, error_list=[
+            {'substr': 'Error', 'level': log.ERROR, 'context_lines': '2:1'},
+            {'substr': 'Warning', 'level': log.WARNING, 'context_lines': ':1'},
+        ])
+        parser.add_lines(['one', 'two', 'three', 'Error', 'four',
+                          'Warning', 'five', 'six'])
+        self.assertEqual(len(log_obj.messages), 6)
+        parser.finish()
+        self.assertEqual(log_obj.messages, [
+            (log.INFO, 'one'),
+            (log.ERROR, 'two'),
+            (log.ERROR, 'three'),
+            (log.ERROR, 'Error'),
+            (log.ERROR, 'four'),
+            (log.WARNING, 'Warning'),
+            (log.WARNING, 'five'),
+            (log.INFO, 'six'),
+        ])
+        self.assertEqual(parser.num_errors, 1)
+
+    def test_context_lines_fatal(self):
+        log_obj = LogRecorder()
+        parser = log.OutputParser(log_obj=log_obj, error_list=[
+            {'substr': 'Error', 'level': log.ERROR, 'context_lines': '5:'},
+            {'substr': 'Fatal', 'level': log.FATAL, 'context_lines': '1:'},
+        ])
+        parser.add_lines(['one', 'two', 'Fatal'])
+        # The match isn't held back with the context lines.
+        self.assertEqual(log_obj.messages, [
+            (log.INFO, 'one'),
+            (log.CRITICAL, 'two'),
+            (log.FATAL, 'Fatal'),
+        ])
+
+    def test_level_counts(self):
+        parser = log.OutputParser(log_obj=LogRecorder(), max_matches=1,
+                                  error_list=[
+            {'substr': 'Error', 'level': log.ERROR},
+            {'substr': 'Warning', 'level': log.WARNING},
+        ])
+        self.assertEqual(parser.worst_level, log.INFO)
+        parser.add_lines(['Warning 1', '', 'Error 1', 'Error 2', 'ok'])
+        self.assertEqual(parser.worst_level, log.ERROR)
+        self.assertEqual(parser.level_counts, {log.ERROR: 2, log.WARNING: 1})
+        self.assertEqual(parser.matches, {log.ERROR: [(3, 'Error 1')],
+                                          log.WARNING: [(1, 'Warning 1')]})
+
+    def test_no_context_lines(self):
+        log_obj = LogRecorder()
+        parser = log.OutputParser(log_obj=log_obj, error_list=[
+            {'substr': 'Error', 'level': log.ERROR},
+        ])
+        parser.add_lines(['one', 'Error'])
+        self.assertEqual(log_obj.messages, [(log.INFO, 'one'),
+                                            (log.ERROR, 'Error')])
+
+    def test_feed(self):
+        log_obj = LogRecorder()
+        parser = log.OutputParser(log_obj=log_obj, error_list=[
+            {'substr': 'Error', 'level': log.ERROR},
+        ])
+        parser.feed('one\ntw')
+        parser.feed('partial', stream_name='stderr')
+        parser.feed('o\nErr')
+        parser.feed('or\n\nh\xc3\xa9\r\nbad \xff\nlast')
+        self.assertEqual(len(log_obj.messages), 5)
+        parser.finish()
+        parser.finish()
+        self.assertEqual(log_obj.messages, [
+            (log.INFO, 'one'),
+            (log.INFO, 'two'),
+            (log.ERROR, 'Error'),
+            (log.INFO, u'h\xe9'),
+            (log.INFO, u'bad \ufffd'),
+            (log.INFO, 'partial'),
+            (log.INFO, 'last'),
+        ])
+        self.assertEqual(parser.num_lines, 8)
+        self.assertEqual(parser.num_errors, 1)
+
+    def test_collapse_repeats(self):
+        log_obj = LogRecorder()
+        parser = log.OutputParser(log_obj=log_obj, config={
+            'output_collapse_repeats': True,
+            'output_collapse_regex': r'\d+',
+        }, error_list=[{'substr': 'Warning', 'level': log.WARNING}])
+        parser.add_lines(['Warning: a', 'Warning: a', 'Warning: a',
+                          '1% done', '2% done', '3% done', 'Warning: a',
+                          'done'])
+        parser.finish()
+        self.assertEqual(log_obj.messages, [
+            (log.WARNING, 'Warning: a'),
+            (log.WARNING, 'Last line repeated 2 more times.'),
+            (log.INFO, '1% done'),
+            (log.INFO, 'Last line repeated 2 more times.'),
+            (log.WARNING, 'Warning: a'),
+            (log.INFO, 'done'),
+        ])
+        self.assertEqual(parser.level_counts, {log.WARNING: 4})
+        self.assertEqual(parser.num_collapsed_lines, 4)
+
+    def test_rate_limits(self):
+        log_obj = LogRecorder()
+        parser = log.OutputParser(log_obj=log_obj, config={
+            'output_rate_limits': {log.INFO: 2},
+        }, error_list=[{'substr': 'Error', 'level': log.ERROR}])
+        frozen_time = FrozenTime()
+        real_time = log.time
+        log.time = frozen_time
+        try:
+            parser.add_lines(['one', 'two', 'three', 'Error', 'four'])
+            frozen_time.now += 1
+            parser.add_lines(['five'])
+            parser.finish()
+        finally:
+            log.time = real_time
+        self.assertEqual(log_obj.messages, [
+            (log.INFO, 'one'),
+            (log.INFO, 'two'),
+            (log.ERROR, 'Error'),
+            (log.INFO, '2 more info lines than the limit of 2/sec only went to the raw log.'),
+            (log.INFO, 'five'),
+        ])
+        self.assertEqual(log_obj.raw_messages, [(log.INFO, 'three'),
+                                                (log.INFO, 'four')])
+        self.assertEqual(parser.num_spilled_lines, 2)
+        self.assertEqual(parser.num_lines, 6)
+
+    def test_feed_decode_errors(self):
+        parser = log.OutputParser(log_obj=LogRecorder(),
+                                  config={'output_decode_errors': 'strict'})
+        self.assertRaises(UnicodeDecodeError, parser.feed, 'bad \xff\n')
+
 if __name__ == '__main__':
     unittest.main()
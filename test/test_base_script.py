@@ -4,7 +4,9 @@ import re
 import shutil
 import subprocess
 import sys
+import time
 import unittest
+from StringIO import StringIO
 
 try:
     import simplejson as json
@@ -172,6 +174,29 @@ class TestScript(unittest.TestCase):
         self.assertTrue(error_logsize > 0,
                         msg="error list not working properly")
 
+    def test_run_command_trailing_output(self):
+        self.s = get_debug_script_obj()
+        self.s.run_command(command=["python", "-c",
+                                    "import sys; sys.stdout.write('foo\\nbar'); sys.stderr.write('error: baz')"],
+                           error_list=[{'substr': 'error:', 'level': ERROR}])
+        error_log = open("test_logs/test_error.log").read()
+        info_log = open("test_logs/test_info.log").read()
+        self.assertTrue('error: baz' in error_log,
+                        msg="stderr without a trailing newline was lost")
+        self.assertTrue(' bar' in info_log,
+                        msg="stdout without a trailing newline was lost")
+
+    def test_output_pump(self):
+        p = subprocess.Popen(["python", "-c",
+                              "import sys; print 'one'; sys.stderr.write('two\\n'); sys.stdout.write('three')"],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        lines = []
+        for chunk in script.OutputPump(p):
+            lines.extend(chunk)
+        p.wait()
+        self.assertEqual(sorted([(stream, line) for (timestamp, stream, line) in lines]),
+                         [('stderr', 'two\n'), ('stdout', 'one\n'), ('stdout', 'three')])
+
 
 
 class TestHelperFunctions(unittest.TestCase):
@@ -205,6 +230,59 @@ class TestHelperFunctions(unittest.TestCase):
         self.assertEqual(test_string, contents,
                          msg="get_output_from_command('cat file') differs from fh.write")
 
+    def test_get_output_from_command_no_tmpfiles(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        self.s.get_output_from_command("echo foo; echo bar >&2")
+        self.assertFalse(os.path.exists('tmpfile_stdout') or
+                         os.path.exists('tmpfile_stderr'),
+                         msg="pipe capture mode created tmpfiles")
+
+    def test_get_output_from_command_truncate(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        contents = self.s.get_output_from_command(
+            ["python", "-c", "for i in range(1000): print i"],
+            max_output_bytes=100, keep_lines=3
+        )
+        self.assertEqual(contents, "0\n1\n2\n[994 lines omitted]\n997\n998\n999")
+
+    def test_get_output_from_command_spill(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        contents = self.s.get_output_from_command(
+            ["python", "-c", "for i in range(1000): print i"],
+            max_output_bytes=100, output_overflow='spill', silent=True
+        )
+        self.assertEqual(contents, ''.join(["%d\n" % i for i in range(1000)]))
+        contents = self.s.get_output_from_command(
+            ["python", "-c",
+             "for i in range(1000): print i\nprint ' \\r\\n \\n'"],
+            max_output_bytes=100, output_overflow='spill'
+        )
+        self.assertEqual(contents, '\n'.join(["%d" % i for i in range(1000)]))
+
+    def test_iter_output_lines(self):
+        self._create_temp_file()
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        lines = list(self.s.iter_output_lines(["cat", self.temp_file]))
+        self.assertEqual(lines, test_string.splitlines())
+
+    def test_iter_output_lines_stop_early(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        for line in self.s.iter_output_lines("echo foo; sleep 30; echo bar"):
+            self.assertEqual(line, "foo")
+            break
+
+    def test_iter_output_lines_failure(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        lines = []
+        try:
+            for line in self.s.iter_output_lines("echo foo; exit 2"):
+                lines.append(line)
+        except subprocess.CalledProcessError, e:
+            self.assertEqual(e.returncode, 2)
+        else:
+            self.assertTrue(False, msg="iter_output_lines() didn't raise!")
+        self.assertEqual(lines, ["foo"])
+
     def test_run_command(self):
         self._create_temp_file()
         self.s = script.BaseScript(initial_config_file='test/test.json')
@@ -213,6 +291,315 @@ class TestHelperFunctions(unittest.TestCase):
                                        cwd="test_dir"), 0,
                          msg="run_command('cat file') did not exit 0")
 
+    def test_parser_thread(self):
+        class SlowParser(object):
+            def __init__(self):
+                self.lines = []
+            def add_lines(self, lines):
+                time.sleep(0.05)
+                if lines == ['fatal']:
+                    raise SystemExit(-1)
+                self.lines.extend(lines)
+        parser = SlowParser()
+        parser_thread = script.ParserThread(max_chunks=2)
+        for i in range(5):
+            parser_thread.add_lines(parser, [str(i)])
+        parser_thread.flush()
+        self.assertEqual(parser.lines, ['0', '1', '2', '3', '4'])
+        self.assertEqual(parser_thread.high_water_mark, 2)
+        self.assertTrue(parser_thread.num_full > 0)
+        parser_thread.add_lines(parser, ['fatal'])
+        self.assertRaises(SystemExit, parser_thread.close)
+
+    def test_run_command_result(self):
+        self.s = get_debug_script_obj()
+        result = self.s.run_command(
+            "echo foo; echo warning: bar; echo error: baz; exit 2",
+            error_list=[{'substr': 'error:', 'level': ERROR},
+                        {'substr': 'warning:', 'level': WARNING}],
+            return_type='result'
+        )
+        self.assertEqual(result.return_code, 2)
+        self.assertEqual(result.num_errors, 1)
+        self.assertEqual(result.worst_level, ERROR)
+        self.assertEqual(result.level_counts, {ERROR: 1, WARNING: 1})
+        self.assertEqual(result.matches[ERROR], [(3, 'error: baz')])
+
+    def test_event_log(self):
+        self.s = get_debug_script_obj()
+        self.s.set_event_context(locale='de')
+        self.s.run_command("echo error: baz",
+                           error_list=[{'substr': 'error:', 'level': ERROR}])
+        self.s.add_failure('de')
+        self.s.set_event_context(locale=None)
+        self.s.add_summary('done')
+        self.s.event_log.close()
+        fh = open(os.path.join('test_logs', 'log_events.jsonl'))
+        events = [json.loads(line) for line in fh]
+        fh.close()
+        self.assertEqual([e['event'] for e in events],
+                         ['command_start', 'match', 'command_end', 'failure',
+                          'summary', 'summary'])
+        self.assertEqual(events[1]['line'], 'error: baz')
+        self.assertEqual(events[1]['level'], ERROR)
+        self.assertEqual(events[2]['returncode'], 0)
+        self.assertEqual(events[3]['key'], 'de')
+        self.assertEqual(events[3]['locale'], 'de')
+        self.assertFalse('locale' in events[5])
+        for (first, second) in zip(events, events[1:]):
+            self.assertTrue(first['monotonic'] <= second['monotonic'])
+
+    def test_item_log_sections(self):
+        self.s = script.BaseScript(config={'log_type': 'multi',
+                                           'log_item_sections': True},
+                                   initial_config_file='test/test.json')
+        self.s.current_action = 'repack'
+        self.s.set_event_context(locale='de')
+        self.s.info('de line')
+        self.s.set_event_context(locale='de')
+        self.s.set_event_context(locale='fr')
+        self.s.error('fr error')
+        self.s._end_item_log_section()
+        self.s.info('no section')
+        de_log = open(os.path.join('test_logs', 'sections',
+                                   'test_repack-de.log')).read()
+        fr_log = open(os.path.join('test_logs', 'sections',
+                                   'test_repack-fr.log')).read()
+        self.assertTrue('de line' in de_log)
+        self.assertFalse('fr error' in de_log)
+        self.assertTrue(fr_log.endswith(' ERROR - fr error\n'))
+        self.assertFalse('no section' in fr_log)
+        fh = open(os.path.join('test_logs', 'test_sections.json'))
+        sections = json.load(fh)
+        fh.close()
+        self.assertEqual([section['name'] for section in sections],
+                         ['repack-de', 'repack-fr'])
+        self.assertEqual(sections[1]['level_counts'], {ERROR: 1})
+        self.assertTrue(os.path.join('sections', 'test_repack-fr.log') in
+                        self.s.log_obj.query_log_files())
+
+    def test_report_progress(self):
+        self.s = script.BaseScript(config={'log_type': 'multi',
+                                           'console_summary': True,
+                                           'console_progress_interval': 3600},
+                                   initial_config_file='test/test.json')
+        # test.json turns log_to_console off.
+        self.s.log_obj.add_console_handler()
+        console = StringIO()
+        self.s.log_obj.all_handlers[-1].stream = console
+        self.s.current_action = 'repack'
+        self.s.action_start_time -= 12 * 60
+        for num in range(4):
+            self.s.report_progress(num, 3, 'locales')
+        self.s.info('detail')
+        console_lines = console.getvalue().splitlines()
+        self.assertEqual(len(console_lines), 2)
+        self.assertTrue(console_lines[0].endswith(
+            ' INFO - repack 0/3 locales, 12m elapsed'))
+        self.assertTrue(console_lines[1].endswith(
+            ' INFO - repack 3/3 locales, 12m elapsed'))
+        info_log = open(os.path.join('test_logs', 'test_info.log')).read()
+        self.assertTrue('repack 2/3 locales' in info_log)
+        self.assertTrue(' INFO - detail' in info_log)
+
+    def test_run_commands_parallel(self):
+        self.s = get_debug_script_obj()
+        results = self.s.run_commands_parallel([
+            {'command': "sleep 0.2; echo error: one; exit 3",
+             'error_list': [{'substr': 'error:', 'level': ERROR}],
+             'name': 'first'},
+            {'command': ["echo", "two"]},
+            {'command': "exit 1", 'success_codes': [1]},
+        ], max_workers=2)
+        self.assertEqual(results, [{'return_code': 3, 'num_errors': 1},
+                                   {'return_code': 0, 'num_errors': 0},
+                                   {'return_code': 1, 'num_errors': 0}])
+        error_log = open("test_logs/test_error.log").read()
+        self.assertTrue('[first] error: one' in error_log,
+                        msg="run_commands_parallel didn't prefix job output")
+
+    def test_run_commands_parallel_start_error(self):
+        self.s = get_debug_script_obj()
+        # A non-string env value keeps Popen from starting the command.
+        results = self.s.run_commands_parallel([
+            {'command': ["echo", "one"], 'env': {'FOO': 1}, 'name': 'bad'},
+            {'command': ["echo", "two"]},
+            {'command': ["echo", "three"]},
+        ], max_workers=1)
+        self.assertEqual(results, [{'return_code': -1, 'num_errors': 0},
+                                   {'return_code': 0, 'num_errors': 0},
+                                   {'return_code': 0, 'num_errors': 0}])
+        error_log = open("test_logs/test_error.log").read()
+        self.assertTrue('[bad] Error running' in error_log)
+        self.assertRaises(SystemExit, self.s.run_commands_parallel,
+                          [{'command': ["echo", "one"], 'env': {'FOO': 1}}],
+                          halt_on_failure=True)
+
+    def test_run_commands_parallel_event_loop(self):
+        self.s = script.BaseScript(config={'log_type': 'multi',
+                                           'parallel_backend': 'event_loop'},
+                                   initial_config_file='test/test.json')
+        results = self.s.run_commands_parallel([
+            {'command': "sleep 0.2; echo error: one; exit 3",
+             'error_list': [{'substr': 'error:', 'level': ERROR}],
+             'name': 'first'},
+            {'command': ["echo", "two"]},
+            {'command': "sleep 5", 'output_timeout': 0.5},
+            {'command': "exit 1", 'success_codes': [1]},
+        ], max_workers=3)
+        self.assertEqual(results, [{'return_code': 3, 'num_errors': 1},
+                                   {'return_code': 0, 'num_errors': 0},
+                                   {'return_code': script.TIMEOUT_STATUS,
+                                    'num_errors': 0},
+                                   {'return_code': 1, 'num_errors': 0}])
+        error_log = open("test_logs/test_error.log").read()
+        self.assertTrue('[first] error: one' in error_log,
+                        msg="event_loop backend didn't prefix job output")
+
+    def test_run_command_timeout(self):
+        self.s = script.BaseScript(config={'kill_grace_period': 1},
+                                   initial_config_file='test/test.json')
+        start_time = time.time()
+        status = self.s.run_command("echo foo; sleep 30", timeout=1)
+        self.assertEqual(status, script.TIMEOUT_STATUS)
+        self.assertTrue(time.time() - start_time < 10,
+                        msg="run_command() timeout didn't kill the process group")
+
+    def test_run_command_fatal_kills_process(self):
+        self.s = script.BaseScript(config={'kill_grace_period': 1},
+                                   initial_config_file='test/test.json')
+        start_time = time.time()
+        self.assertRaises(SystemExit, self.s.run_command,
+                          "echo oh no; sleep 30",
+                          error_list=[{'substr': 'oh no', 'level': FATAL}])
+        self.assertTrue(time.time() - start_time < 10,
+                        msg="a FATAL match didn't kill the process group")
+
+    def test_run_commands_parallel_threads_fatal(self):
+        self.s = script.BaseScript(config={'kill_grace_period': 1},
+                                   initial_config_file='test/test.json')
+        start_time = time.time()
+        self.assertRaises(SystemExit, self.s.run_commands_parallel, [
+            {'command': "sleep 30"},
+            {'command': "echo oh no; sleep 30",
+             'error_list': [{'substr': 'oh no', 'level': FATAL}]},
+            {'command': "sleep 30"},
+        ], max_workers=2)
+        self.assertTrue(time.time() - start_time < 10,
+                        msg="a FATAL match didn't stop the other jobs")
+
+    def test_run_commands_parallel_fatal_kills_processes(self):
+        self.s = script.BaseScript(config={'kill_grace_period': 1,
+                                           'parallel_backend': 'event_loop'},
+                                   initial_config_file='test/test.json')
+        start_time = time.time()
+        self.assertRaises(SystemExit, self.s.run_commands_parallel, [
+            {'command': "sleep 30"},
+            {'command': "echo oh no; sleep 30",
+             'error_list': [{'substr': 'oh no', 'level': FATAL}]},
+        ], max_workers=2)
+        self.assertTrue(time.time() - start_time < 10,
+                        msg="a FATAL match didn't kill the process groups")
+
+    def test_get_output_from_command_output_timeout(self):
+        self.s = script.BaseScript(config={'kill_grace_period': 1},
+                                   initial_config_file='test/test.json')
+        start_time = time.time()
+        output = self.s.get_output_from_command(
+            "echo foo; sleep 0.5; echo bar; sleep 30; echo baz",
+            output_timeout=2
+        )
+        self.assertEqual(output, "foo\nbar")
+        self.assertTrue(time.time() - start_time < 10,
+                        msg="output_timeout didn't fire")
+
+    def test_output_timeout_partial_lines(self):
+        self.s = script.BaseScript(config={'kill_grace_period': 1},
+                                   initial_config_file='test/test.json')
+        # Progress dots, without a newline, for longer than output_timeout.
+        output = self.s.get_output_from_command(
+            "for i in 1 2 3 4 5 6 7 8; do printf .; sleep 0.3; done; echo done",
+            output_timeout=1
+        )
+        self.assertEqual(output, "........done")
+
+    def test_command_stats(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        self.s.current_action = 'build'
+        self.s.run_command(["python", "-c", "x = 'x' * 10000000"])
+        self.assertEqual(len(self.s.command_stats), 1)
+        record = self.s.command_stats[0]
+        self.assertEqual(record['action'], 'build')
+        self.assertEqual(record['returncode'], 0)
+        self.assertTrue(record['wall_time'] > 0)
+        if hasattr(os, 'wait4'):
+            self.assertTrue(record['max_rss'] > 0)
+        self.s.dump_command_stats()
+        dirs = self.s.query_abs_dirs()
+        fh = open(os.path.join(dirs['abs_log_dir'], 'command_stats.json'))
+        stats = json.load(fh)
+        fh.close()
+        self.assertEqual(stats[0]['command'], record['command'])
+
+    def test_command_stats_secret_args(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        p = self.s._start_process(["echo", "-storepass", "SECRET"],
+                                  secret_args=["SECRET", None])
+        self.s._reap_process(p)
+        self.assertEqual(self.s.command_stats[0]['command'],
+                         "echo -storepass ********")
+        self.s.summarize_command_stats()
+        self.s.dump_command_stats()
+        dirs = self.s.query_abs_dirs()
+        stats = open(os.path.join(dirs['abs_log_dir'],
+                                  'command_stats.json')).read()
+        info_log = open(os.path.join(dirs['abs_log_dir'],
+                                     'test_info.log')).read()
+        self.assertFalse('SECRET' in stats or 'SECRET' in info_log)
+        self.s.event_log.close()
+        events = open(os.path.join(dirs['abs_log_dir'],
+                                   'log_events.jsonl')).read()
+        self.assertTrue('command_start' in events)
+        self.assertFalse('SECRET' in events)
+
+    def test_command_stats_io_last_sample(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        samples = []
+        def query_process_io(pid):
+            samples.append(pid)
+            return (len(samples), 2 * len(samples))
+        self.s._query_process_io = query_process_io
+        # The timeout makes _wait_for_process() poll for the exit, once
+        # the command has closed its output.
+        self.s.run_command("exec >/dev/null 2>&1; sleep 0.5", timeout=30)
+        record = self.s.command_stats[0]
+        self.assertTrue(len(samples) > 1)
+        self.assertEqual((record['read_bytes'], record['write_bytes']),
+                         (len(samples), 2 * len(samples)))
+
+    def test_output_cache(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        command = ["python", "-c", "import time; print time.time()"]
+        output = self.s.get_output_from_command(command, cacheable=True)
+        self.assertEqual(self.s.get_output_from_command(command, cacheable=True),
+                         output)
+        self.assertEqual(list(self.s.iter_output_lines(command, cacheable=True)),
+                         list(self.s.iter_output_lines(command, cacheable=True)))
+        self.assertEqual(self.s.output_cache.hits, 2)
+        self.assertEqual(self.s.output_cache.misses, 2)
+        self.s.run_command(["python", "-c", "pass"], cwd='/')
+        self.assertNotEqual(self.s.get_output_from_command(command, cacheable=True),
+                            output)
+        self.assertEqual(self.s.output_cache.misses, 3)
+        # silent output isn't stripped, so it's cached apart.
+        self.s.get_output_from_command(command, cacheable=True, silent=True)
+        self.assertEqual(self.s.output_cache.misses, 4)
+        self.s.get_output_from_command(command, cacheable=True, silent=True)
+        self.assertEqual(self.s.output_cache.hits, 3)
+        self.s.rmtree('test_logs/nonexistent')
+        self.s.get_output_from_command(command, cacheable=True, silent=True)
+        self.assertEqual(self.s.output_cache.misses, 5)
+
     def test_move1(self):
         self._create_temp_file()
         self.s = script.BaseScript(initial_config_file='test/test.json')
@@ -293,6 +680,42 @@ class TestHelperFunctions(unittest.TestCase):
         script_env = self.s.query_env(partial_env={'PATH': partial_path})
         self.assertEqual(script_env['PATH'], full_path)
 
+    def test_env_memoized(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        script_env = self.s.query_env(partial_env={'foo': 'bar'})
+        self.assertTrue(self.s.query_env(partial_env={'foo': 'bar'}) is script_env)
+        self.assertFalse(self.s.query_env(partial_env={'foo': 'baz'}) is script_env)
+        def set_foo():
+            script_env['foo'] = 'baz'
+        self.assertRaises(TypeError, set_foo)
+
+    def test_env_follows_os_environ(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        script_env = self.s.query_env()
+        partial_env = self.s.query_env(partial_env={'foo': 'bar'})
+        self.assertFalse('MH_TEST_ENV' in script_env)
+        os.environ['MH_TEST_ENV'] = 'on'
+        try:
+            self.assertEqual(self.s.query_env()['MH_TEST_ENV'], 'on')
+            self.assertEqual(self.s.query_env(partial_env={'foo': 'bar'})['MH_TEST_ENV'], 'on')
+        finally:
+            del os.environ['MH_TEST_ENV']
+        self.assertFalse('MH_TEST_ENV' in self.s.query_env())
+        self.assertFalse(self.s.query_env(partial_env={'foo': 'bar'}) is partial_env)
+
+    def test_env_overlay(self):
+        self.s = script.BaseScript(initial_config_file='test/test.json')
+        script_env = self.s.query_env(partial_env={'foo': 'bar'})
+        overlay_env = script_env.overlay({'baz': 'qux'})
+        self.assertEqual(overlay_env['foo'], 'bar')
+        self.assertEqual(len(overlay_env), len(script_env) + 1)
+        self.assertFalse('baz' in script_env)
+        output = self.s.get_output_from_command(
+            ["python", "-c", "import os; print os.environ['baz']"],
+            env=overlay_env
+        )
+        self.assertEqual(output, 'qux')
+
 
 
 class TestScriptLogging(unittest.TestCase):